@@ -0,0 +1,254 @@
+import contextvars
+import functools
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from flask import g, has_request_context, jsonify
+from flask_jwt_extended import get_jwt_identity
+
+from clients import openai_clients
+
+# function=capacity/seconds: a user may burst up to capacity requests, refilled evenly
+# over the period.
+DEFAULT_LIMITS = "chat=30/60,image=10/3600,convert=30/60,analysis=30/60,voice=10/60,embedding=60/60"
+
+current_user = contextvars.ContextVar('admission_user', default=None)
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_limits(value):
+    limits = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        function, _, rate = item.partition('=')
+        capacity, _, seconds = rate.partition('/')
+        limits[function.strip()] = (float(capacity), float(seconds or 60))
+    return limits
+
+
+def _refill(tokens, updated, capacity, rate, now):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+class MemoryBucketStore:
+    # Token buckets for this process only. Each bucket keeps its own capacity and rate,
+    # since one store holds the buckets of every function.
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def take(self, key, capacity, rate, cost=1, now=None):
+        # Returns 0 when the request is admitted, otherwise the seconds until it would be.
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated, _, _ = self._buckets.get(key, (capacity, now, capacity, rate))
+            tokens = _refill(tokens, updated, capacity, rate, now)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now, capacity, rate)
+            self._writes += 1
+            # Pruning is amortised over writes instead of scanning on every call once full.
+            if self._writes % 100 == 0 and len(self._buckets) > self.max_entries:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket.
+        for key, (tokens, updated, capacity, rate) in list(self._buckets.items()):
+            if _refill(tokens, updated, capacity, rate, now) >= capacity:
+                del self._buckets[key]
+
+
+class SQLiteBucketStore:
+    # Same buckets in a SQLite table, so every worker on the host shares the limits.
+    # BEGIN IMMEDIATE makes the read-modify-write atomic across processes.
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_bucket (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+        return self._conn
+
+    def take(self, key, capacity, rate, cost=1, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at FROM rate_bucket WHERE key = ?", (key,)).fetchone()
+                tokens = _refill(row[0], row[1], capacity, rate, now) if row else capacity
+                wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+                if not wait:
+                    tokens -= cost
+                conn.execute("INSERT OR REPLACE INTO rate_bucket (key, tokens, updated_at) VALUES (?, ?, ?)",
+                             (key, tokens, now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return wait
+
+
+class FairGate:
+    # Caps model calls in flight in this process. Once every slot is busy, callers wait
+    # in one queue per user and freed slots go to the users in turn, so a user fanning
+    # out dozens of chunk calls can't push everyone else to the back.
+
+    def __init__(self, limit=8, timeout=30.0):
+        self.limit = limit
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiting = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, user):
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiting:
+                self.in_flight += 1
+                return
+            ticket = threading.Event()
+            self._waiting.setdefault(user, deque()).append(ticket)
+        if ticket.wait(self.timeout):
+            return
+        with self._lock:
+            if ticket.is_set():
+                return
+            queue = self._waiting[user]
+            queue.remove(ticket)
+            if not queue:
+                del self._waiting[user]
+        raise Overloaded("Too many model calls in flight", self.timeout)
+
+    def release(self):
+        with self._lock:
+            if self._waiting:
+                # The slot passes straight to the next user in turn; in_flight is unchanged.
+                user, queue = next(iter(self._waiting.items()))
+                ticket = queue.popleft()
+                if queue:
+                    self._waiting.move_to_end(user)
+                else:
+                    del self._waiting[user]
+                ticket.set()
+            else:
+                self.in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        self.acquire(_user())
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def _user():
+    user = current_user.get()
+    if user is None and has_request_context():
+        # Streamed responses run their generator after the view returned.
+        user = g.get('admission_user')
+    return user
+
+
+def with_user(fn):
+    # Carries the caller's user into pool threads, which start with an empty context.
+    user = current_user.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = current_user.set(user)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_user.reset(token)
+    return run
+
+
+class AdmissionControl:
+    def __init__(self):
+        self.limits = {}
+        self.store = MemoryBucketStore()
+        self.gate = FairGate()
+
+    def init_app(self, app):
+        self.limits = parse_limits(app.config.get('ADMISSION_LIMITS', DEFAULT_LIMITS))
+        store = app.config.get('ADMISSION_STORE', 'memory')
+        if store.startswith('sqlite:///'):
+            self.store = SQLiteBucketStore(store[len('sqlite:///'):])
+        else:
+            self.store = MemoryBucketStore()
+        self.gate = FairGate(app.config.get('ADMISSION_MAX_INFLIGHT', 8), app.config.get('ADMISSION_QUEUE_TIMEOUT', 30.0))
+        openai_clients.gate = self.gate
+
+        @app.errorhandler(Overloaded)
+        def overloaded(e):
+            return throttled(str(e), e.retry_after, 503)
+
+    def check(self, user_id, function, cost=1):
+        limit = self.limits.get(function)
+        if limit is None:
+            return 0.0
+        capacity, seconds = limit
+        return self.store.take(f"{user_id}:{function}", capacity, capacity / seconds, cost)
+
+
+admission = AdmissionControl()
+
+
+def throttled(message, retry_after, status=429):
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({"error": message, "retry_after": retry_after})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def admit(function, cost=1):
+    # Goes under @jwt_required(): spends one token from the user's bucket for this
+    # function, and tags the request so its model calls queue under this user.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            user_id = get_jwt_identity()
+            wait = admission.check(user_id, function, cost)
+            if wait:
+                return throttled(f"Too many {function} requests, retry later", wait)
+            g.admission_user = user_id
+            token = current_user.set(user_id)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                current_user.reset(token)
+        return wrapper
+    return decorator
@@ -1,47 +1,106 @@
 from flask import request, jsonify, url_for
-from openai import OpenAI
 import json
 import re
 import os
-from gtts import gTTS
-from models import db, Conversation
-import requests
-import string
-import random
-
-def clean_screenplay_text(screenplay,api_key):
-    client = OpenAI(
-        api_key= api_key
+from models import db, Conversation, ConversationSummary
+from cache import llm_cache
+from clients import openai_clients
+from admission import Overloaded
+from chunking import estimate_tokens, chunk_screenplay, map_chunks
+from images import IMAGE_DIR, store_image
+from metrics import timed, record_model_call
+from embeddings import embedding_index
+import time
+
+CHAT_CONTEXT_TOKENS = int(os.environ.get('CHAT_CONTEXT_TOKENS', 3000))
+CHAT_RECENT_TURNS = int(os.environ.get('CHAT_RECENT_TURNS', 8))
+CHAT_FOLD_TURNS = int(os.environ.get('CHAT_FOLD_TURNS', 4))
+ANALYSIS_CHUNK_TOKENS = int(os.environ.get('ANALYSIS_CHUNK_TOKENS', 3000))
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 4))
+
+def _complete(function, messages, model, temperature, max_tokens, api_key, use_cache=True):
+    key = llm_cache.make_key(function, model, messages, temperature, max_tokens=max_tokens)
+    start = time.perf_counter()
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            record_model_call(function, model, time.perf_counter() - start, cache='hit')
+            return cached
+
+    client = openai_clients.get(api_key)
+    chat_completion = openai_clients.call(
+        client.chat.completions.create,
+        messages=messages,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens
+    )
+    record_model_call(function, model, time.perf_counter() - start, chat_completion.usage)
+    response = chat_completion.choices[0].message.content.strip()
+    # A bypassed call still refreshes the stored entry so the next cached read sees it.
+    llm_cache.set(key, response, function=function)
+    return response
+
+def _stream_completion(function, messages, model, temperature, max_tokens, api_key, use_cache=True, cacheable=True):
+    key = llm_cache.make_key(function, model, messages, temperature, max_tokens=max_tokens)
+    start = time.perf_counter()
+    if cacheable and use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            record_model_call(function, model, time.perf_counter() - start, cache='hit')
+            yield cached
+            return
+
+    client = openai_clients.get(api_key)
+    stream = openai_clients.stream(
+        client.chat.completions.create,
+        messages=messages,
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
     )
+    parts = []
+    usage = None
+    for chunk in stream:
+        # With include_usage the final chunk has no choices, only the token counts.
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+    record_model_call(function, model, time.perf_counter() - start, usage)
+    if cacheable:
+        llm_cache.set(key, ''.join(parts).strip(), function=function)
+
+@timed("clean_screenplay_text")
+def clean_screenplay_text(screenplay,api_key, use_cache=True, max_tokens=100):
     try:
-        chat_completion = client.chat.completions.create(
+        response = _complete(
+            "clean_screenplay_text",
             messages=[
                 {"role": "system", "content": "Convert the given screenplay text into a narration instance which can be used for text to speech."},
                 {"role": "user", "content": screenplay}
             ],
             model ="gpt-4o",
             temperature= 0.1,
-            max_tokens= 100
+            max_tokens= max_tokens,
+            api_key=api_key,
+            use_cache=use_cache
         )
-        response = chat_completion.choices[0].message.content.strip()
         return response
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return None
     
 
-def convert_text_to_speech2(text, output_file):
-    tts = gTTS(text, lang='en')
-    tts.save(output_file)
-    print(f"Speech saved as: {output_file}")
-
-
-
-def rate_screenplay(screenplay_content, api_key):
-    client = OpenAI(
-        api_key= api_key
-    )
-
+def rate_request(screenplay_content):
     system_prompt = f"""You are a professional screenwriter and a screenplay critic. Your response should be based on the following:
                     Plot, Character Development, Dialogue, Originality, and Theme. Rate each criterion out of 10 in the format:
                     Plot: [score]
@@ -53,38 +112,55 @@ def rate_screenplay(screenplay_content, api_key):
                     Scene headings, Action lines, Characters, Dialogue, Parenthesis.
                     Understand each tag and rate correctly.
                 """
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": screenplay_content}
-            ],
-            model="gpt-4", 
-            temperature=0.5,
-            max_tokens=100
-        )
+    return {
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": screenplay_content}
+        ],
+        "model": "gpt-4",
+        "temperature": 0.5,
+        "max_tokens": 100,
+    }
 
-        response = chat_completion.choices[0].message.content.strip()
+def parse_scores(response):
+    scores = {}
+    criteria = ["Plot", "Character Development", "Dialogue", "Originality", "Theme"]
+    for criterion in criteria:
+        match = re.search(rf"{criterion}:\s*(\d+)", response)
+        if match:
+            scores[criterion] = int(match.group(1))
+        else:
+            scores[criterion] = None
+    return scores
+
+def _rate_chunk(screenplay_content, api_key, use_cache=True):
+    response = _complete("rate_screenplay", api_key=api_key, use_cache=use_cache, **rate_request(screenplay_content))
+    return parse_scores(response)
 
-        scores = {}
-        criteria = ["Plot", "Character Development", "Dialogue", "Originality", "Theme"]
-        for criterion in criteria:
-            match = re.search(rf"{criterion}:\s*(\d+)", response)
-            if match:
-                scores[criterion] = int(match.group(1))
-            else:
-                scores[criterion] = None
+def _combine_scores(partials, weights):
+    # Length-weighted mean per criterion, ignoring chunks the model did not score.
+    scores = {}
+    for criterion in partials[0]:
+        rated = [(p[criterion], w) for p, w in zip(partials, weights) if p[criterion] is not None]
+        total = sum(w for _, w in rated)
+        scores[criterion] = round(sum(score * w for score, w in rated) / total) if total else None
+    return scores
 
+@timed("rate_screenplay")
+def rate_screenplay(screenplay_content, api_key, use_cache=True):
+    try:
+        chunks = chunk_screenplay(screenplay_content, ANALYSIS_CHUNK_TOKENS)
+        partials = map_chunks(lambda chunk: _rate_chunk(chunk, api_key, use_cache), chunks, ANALYSIS_WORKERS)
+        scores = _combine_scores(partials, [estimate_tokens(chunk) for chunk in chunks])
         return json.dumps(scores)
         
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Could not generate analysis: {e}")
         return None
 
-def convert_to_screenplay(screenplay_content, api_key):
-    client = OpenAI(
-        api_key= api_key
-    )
+def _screenplay_messages(screenplay_content):
     system_prompt = """Format the following text into screenplay format:
     
     Use the following format:
@@ -98,10 +174,7 @@ def convert_to_screenplay(screenplay_content, api_key):
     - <shot> for shot
     Ensure each tag has both an opening and a closing tag. wrap dialogue tag around character and parathesis.
     """
-    
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=[
+    return [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": """
 Adejo still wasn't quite sure how his uncle had got caught up with the two wedding guests in the first place.
@@ -123,77 +196,126 @@ For a while it seemed that they wouldn't even hear the wedding, let alone see it
 <action>The van pulls up to a steel door. His uncle starts pressing numbers into the keypad, but the door won't open.</action>
 """},
                 {"role": "user", "content": screenplay_content}
-            ],
+            ]
+
+@timed("convert_to_screenplay")
+def convert_to_screenplay(screenplay_content, api_key, use_cache=True):
+    try:
+        analysis = _complete(
+            "convert_to_screenplay",
+            messages=_screenplay_messages(screenplay_content),
             model="gpt-4o", 
             temperature=0.1,
-            max_tokens=1000
+            max_tokens=1000,
+            api_key=api_key,
+            use_cache=use_cache
         )
         output = {
             "screenplay": screenplay_content,
-            "analysis": chat_completion.choices[0].message.content.strip()
+            "analysis": analysis
         }
         return output["analysis"]
         
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Could not generate analysis: {e}")
         return None
 
-def summarize_screenplay(screenplay_content,api_key):
-    client = OpenAI(
-        api_key= api_key
+def convert_to_screenplay_stream(screenplay_content, api_key, use_cache=True):
+    return _stream_completion(
+        "convert_to_screenplay",
+        messages=_screenplay_messages(screenplay_content),
+        model="gpt-4o",
+        temperature=0.1,
+        max_tokens=1000,
+        api_key=api_key,
+        use_cache=use_cache
     )
 
+def _summarize_chunk(screenplay_content, api_key, use_cache=True):
     system_prompt = f"""You are a professional screenwriter and a screenplay critic. Summarize the given screenplay."""
+    return _complete(
+        "summarize_screenplay",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": screenplay_content}
+        ],
+        model="gpt-4", 
+        temperature=0.3,
+        max_tokens=100,
+        api_key=api_key,
+        use_cache=use_cache
+    )
+
+def _summarize_parts(screenplay_content, api_key, use_cache=True):
+    chunks = chunk_screenplay(screenplay_content, ANALYSIS_CHUNK_TOKENS)
+    return map_chunks(lambda chunk: _summarize_chunk(chunk, api_key, use_cache), chunks, ANALYSIS_WORKERS)
+
+@timed("summarize_screenplay")
+def summarize_screenplay(screenplay_content,api_key, use_cache=True):
     try:
-        chat_completion = client.chat.completions.create(
+        partials = _summarize_parts(screenplay_content, api_key, use_cache)
+        if len(partials) == 1:
+            return json.dumps(partials[0])
+        parts = "\n\n".join(f"Part {i + 1}: {summary}" for i, summary in enumerate(partials))
+        response = _complete(
+            "summarize_screenplay_reduce",
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": screenplay_content}
+                {"role": "system", "content": """You are a professional screenwriter and a screenplay critic. You are given summaries
+                                                of consecutive parts of one screenplay. Combine them into a single summary of the whole screenplay."""},
+                {"role": "user", "content": parts}
             ],
-            model="gpt-4", 
+            model="gpt-4",
             temperature=0.3,
-            max_tokens=100
+            max_tokens=200,
+            api_key=api_key,
+            use_cache=use_cache
         )
-
-        response = chat_completion.choices[0].message.content.strip()
         return json.dumps(response)
         
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Could not generate analysis: {e}")
         return None
 
-def get_sentimental_analysis(screenplay, api_key):
+def sentiment_request(screenplay):
+    return {
+        "messages": [
+            {"role": "system", "content": """ You are a screenplay professional. Analyze the given scene and
+                                                provide an emotional analysis of the scene. I want the emotional
+                                                analysis to be 1-3 Emojis that potray those emotions and then a brief 2-3 line text. Strictly use face emojis do not use objects. The
+                                                intensity of the emoji should be based on the emotion analysis.
+                                                Let it be in JSON format. Just start and end with flower brackets.
+                                            """},
+            {"role": "user", "content": "<action>Adejo's Uncle turns to him, an angry look on his face. His uncle looked at him confused</action>"},
+            { "role": "assistant", "content": '{"emojies": [{"name": "Angry face", "emoji": ":angry_face:"},{"name": "Confused face", "emoji": ":angry_face:",{"name": "Nervous face", emoji=":anxious_face_with_sweat:"}], "description": "The scene is tense as uncle is angered by Adejo"}'},
+            {"role": "user", "content": screenplay}
+        ],
+        "model": "gpt-4o",
+        "temperature": 0.5,
+        "max_tokens": 100,
+    }
+
+def parse_sentiment(r):
+    fixed_json_string = r.replace('\\', '\\\\')
+    parsed_data = json.loads(fixed_json_string)
+    scene_emoji = parsed_data['emojies']
+    scene_description = parsed_data['description']
+    return scene_emoji, scene_description
+
+@timed("get_sentimental_analysis")
+def get_sentimental_analysis(screenplay, api_key, use_cache=True):
     if not screenplay:
         return
     else:
-    
-        client = OpenAI(
-            api_key = api_key
-        )
         try:
-            chat_completion = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": """ You are a screenplay professional. Analyze the given scene and
-                                                        provide an emotional analysis of the scene. I want the emotional
-                                                        analysis to be 1-3 Emojis that potray those emotions and then a brief 2-3 line text. Strictly use face emojis do not use objects. The
-                                                        intensity of the emoji should be based on the emotion analysis.
-                                                        Let it be in JSON format. Just start and end with flower brackets.
-                                                    """},
-                    {"role": "user", "content": "<action>Adejo's Uncle turns to him, an angry look on his face. His uncle looked at him confused</action>"},
-                    { "role": "assistant", "content": '{"emojies": [{"name": "Angry face", "emoji": ":angry_face:"},{"name": "Confused face", "emoji": ":angry_face:",{"name": "Nervous face", emoji=":anxious_face_with_sweat:"}], "description": "The scene is tense as uncle is angered by Adejo"}'},
-                    {"role": "user", "content": screenplay}
-                ],
-                model ="gpt-4o",
-                temperature= 0.5,
-                max_tokens= 100
-            )
-            r = chat_completion.choices[0].message.content.strip()
-            fixed_json_string = r.replace('\\', '\\\\')
-            parsed_data = json.loads(fixed_json_string)
-            scene_emoji = parsed_data['emojies']
-            scene_description = parsed_data['description']
-            return scene_emoji, scene_description
+            r = _complete("get_sentimental_analysis", api_key=api_key, use_cache=use_cache, **sentiment_request(screenplay))
+            return parse_sentiment(r)
             
+        except Overloaded:
+            raise
         except Exception as e:
             print({e})
 
@@ -202,15 +324,70 @@ def save_message(user_id,role, content):
     db.session.add(new_message) 
     db.session.commit()
 
-def get_conversation_history(user_id):
-    conversations = Conversation.query.filter_by(user_id=user_id).all()
-    return [{"role": convo.role, "content": convo.content} for convo in conversations]
-
-def chatbot_chat(user_id, user_input,api_key):
-    client = OpenAI(
-        api_key= api_key
+@timed("summarize_conversation")
+def summarize_conversation(previous_summary, messages, api_key):
+    transcript = "\n".join(f"{m.role}: {m.content}" for m in messages)
+    return _complete(
+        "summarize_conversation",
+        messages=[
+            {"role": "system", "content": """You maintain a running summary of a conversation between a screenwriter
+                                            and a screenplay assistant. Update the summary with the new messages.
+                                            Keep names, projects, preferences and decisions. Reply with the summary only."""},
+            {"role": "user", "content": f"Current summary:\n{previous_summary or '(empty)'}\n\nNew messages:\n{transcript}"}
+        ],
+        model="gpt-4o",
+        temperature=0.2,
+        max_tokens=300,
+        api_key=api_key
     )
-    history= get_conversation_history(user_id)
+
+def get_conversation_history(user_id, api_key):
+    state = db.session.get(ConversationSummary, user_id)
+    summary = state.summary if state else ''
+    summarized_through = state.summarized_through_id if state else 0
+    keep = 2 * CHAT_RECENT_TURNS
+    fold = 2 * CHAT_FOLD_TURNS
+
+    # Newest unsummarized rows only; served by the (user_id, id) index.
+    rows = (Conversation.query
+            .filter(Conversation.user_id == user_id, Conversation.id > summarized_through)
+            .order_by(Conversation.id.desc())
+            .limit(keep + fold)
+            .all())
+    rows.reverse()
+
+    # Fold in batches so the summary call happens every few turns rather than every turn.
+    # Rows older than this fetch (legacy histories) are skipped rather than summarized.
+    if len(rows) >= keep + fold:
+        overflow, rows = rows[:-keep], rows[-keep:]
+        try:
+            summary = summarize_conversation(summary, overflow, api_key)
+            if state is None:
+                state = ConversationSummary(user_id=user_id)
+                db.session.add(state)
+            state.summary = summary
+            state.summarized_through_id = overflow[-1].id
+            db.session.commit()
+        except Exception as e:
+            print(f"Could not summarize conversation: {e}")
+            rows = overflow + rows
+
+    history = []
+    budget = CHAT_CONTEXT_TOKENS - estimate_tokens(summary)
+    for convo in reversed(rows):
+        cost = estimate_tokens(convo.content)
+        if history and cost > budget:
+            break
+        budget -= cost
+        history.append({"role": convo.role, "content": convo.content})
+    history.reverse()
+
+    if summary:
+        history.insert(0, {"role": "system", "content": f"Summary of the earlier conversation with this user:\n{summary}"})
+    return history
+
+def _chat_messages(user_id, user_input, api_key):
+    history= get_conversation_history(user_id, api_key)
     messages=  [{
                 "role": "system", "content": """You are a professional screenplay writer and you will refer 
                                                 to reputed and recognized sources on the internet for your answer.
@@ -219,16 +396,31 @@ def chatbot_chat(user_id, user_input,api_key):
                                                 Suggest,recommend,rate and help with the user with any queries related
                                                 to screenplay,screenplay script writting """
                 }]
+    # The user's own scenes closest to the question, within CHAT_RETRIEVAL_TOKENS.
+    scenes = embedding_index.relevant_scenes(user_id, user_input)
+    if scenes:
+        messages.append({"role": "system", "content": "User data: scenes from this user's stories that may be relevant.\n\n" + "\n\n".join(scenes)})
     messages.extend(history)
     messages.append({"role": "user", "content": user_input})
+    return messages
+
+@timed("chatbot_chat")
+def chatbot_chat(user_id, user_input,api_key):
+    client = openai_clients.get(api_key)
+    messages = _chat_messages(user_id, user_input, api_key)
     try:
-        chat_completion = client.chat.completions.create(
+        start = time.perf_counter()
+        chat_completion = openai_clients.call(
+            client.chat.completions.create,
             messages= messages,
             model ="gpt-4o",
             temperature= 0.3,
             max_tokens= 1000 #Change this if required btw 
         )
+        record_model_call("chatbot_chat", "gpt-4o", time.perf_counter() - start, chat_completion.usage)
         response = chat_completion.choices[0].message.content.strip()
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"error": "An error occurred while processing your request.", "details": str(e)}), 500
         
@@ -236,35 +428,56 @@ def chatbot_chat(user_id, user_input,api_key):
     save_message(user_id,"assistant",response)
     return jsonify({"reply":response}),200
 
-def generate_image(description, api_key, save_directory='static/generated_images/'):
-    if not os.path.exists(save_directory):
-        os.makedirs(save_directory)
+def chatbot_chat_stream(user_id, user_input, api_key):
+    messages = _chat_messages(user_id, user_input, api_key)
+    parts = []
+    for delta in _stream_completion(
+        "chatbot_chat",
+        messages=messages,
+        model="gpt-4o",
+        temperature=0.3,
+        max_tokens=1000,
+        api_key=api_key,
+        cacheable=False
+    ):
+        parts.append(delta)
+        yield delta
+    # Only a completed stream is persisted; an aborted one leaves no half reply in the history.
+    save_message(user_id, "user", user_input)
+    save_message(user_id, "assistant", ''.join(parts).strip())
 
-    client =OpenAI(
-            api_key= api_key)
+@timed("generate_image")
+def generate_image(description, api_key, use_cache=True):
+    # Returns {"image_link", "thumbnail_link"}. Files are named by content hash, and the
+    # response cache maps a prompt to the files it produced, so repeating a description
+    # reuses the stored image instead of paying for (and storing) another one.
+    client = openai_clients.get(api_key)
     model = "dall-e-3"
     prompt = description
 
-    response = client.images.generate(
-        prompt=prompt,
-        model=model,
-        response_format="url"
-    )
-    res = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-    image_url = response.data[0].url.strip()
-    image_data = requests.get(image_url).content
-    image_filename = "{}.jpg".format(res)
-    image_path = os.path.join(save_directory, image_filename)
-    with open(image_path, 'wb') as image_file:
-        image_file.write(image_data)
-    saved_image_url = url_for('static', filename=f'generated_images/{image_filename}', _external=True)
-
-    return saved_image_url
+    key = llm_cache.make_key("generate_image", model, [prompt], None)
+    stored = llm_cache.get(key) if use_cache else None
+    if stored is not None:
+        filename, thumbnail = json.loads(stored)
+        if not os.path.exists(os.path.join(IMAGE_DIR, filename)):
+            stored = None
+    if stored is None:
+        start = time.perf_counter()
+        response = openai_clients.call(
+            client.images.generate,
+            prompt=prompt,
+            model=model,
+            response_format="url"
+        )
+        record_model_call("generate_image", model, time.perf_counter() - start)
+        filename, thumbnail = store_image(response.data[0].url.strip())
+        llm_cache.set(key, json.dumps([filename, thumbnail]), "generate_image")
 
-def generate_pitch_summary(screenplay, api_key):
-    client =OpenAI(
-          api_key= api_key)
+    image_url = url_for('static', filename=f'generated_images/{filename}', _external=True)
+    thumbnail_url = url_for('static', filename=f'generated_images/{thumbnail}', _external=True) if thumbnail else None
+    return {"image_link": image_url, "thumbnail_link": thumbnail_url}
 
+def pitch_request(screenplay, label="Screenplay"):
     system_message = {
         "role": "system",
         "content":  """You are an expert screenplay analyst. Your task is to read a screenplay 
@@ -275,17 +488,28 @@ def generate_pitch_summary(screenplay, api_key):
 
     user_message = {
         "role": "user",
-        "content": f"Screenplay:\n{screenplay}\n\nGenerate a pitch summary:"
+        "content": f"{label}:\n{screenplay}\n\nGenerate a pitch summary:"
+    }
+    return {
+        "model": "gpt-4o",
+        "messages": [system_message, user_message],
+        "max_tokens": 1500,
+        "temperature": 0.7,
     }
-    print(user_message)
+
+@timed("generate_pitch_summary")
+def generate_pitch_summary(screenplay, api_key, use_cache=True):
     try:
-        chat_completion = client.chat.completions.create(
-            model="gpt-4o",  
-            messages=[system_message, user_message],
-            max_tokens=1500,
-            temperature=0.7,
-        ) 
-        return chat_completion.choices[0].message.content.strip()
+        # Too long for one prompt: pitch from per-part summaries instead of the full text.
+        if estimate_tokens(screenplay) > ANALYSIS_CHUNK_TOKENS:
+            partials = _summarize_parts(screenplay, api_key, use_cache)
+            parts = "\n\n".join(f"Part {i + 1}: {summary}" for i, summary in enumerate(partials))
+            pitch = pitch_request(parts, label="Screenplay, summarized part by part")
+        else:
+            pitch = pitch_request(screenplay)
+        return _complete("generate_pitch_summary", api_key=api_key, use_cache=use_cache, **pitch)
+    except Overloaded:
+        raise
     except Exception as e:
         raise Exception(f"Error generating pitch summary: {str(e)}")
     
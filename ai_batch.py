@@ -0,0 +1,281 @@
+import json
+import os
+import time
+import uuid
+from types import SimpleNamespace
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.orm import joinedload
+
+from ai import rate_request, parse_scores, sentiment_request, parse_sentiment, pitch_request, ANALYSIS_CHUNK_TOKENS
+from analysis import ANALYSES, source_digest, is_fresh
+from chunking import estimate_tokens
+from clients import openai_clients
+from models import db, Scene
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Request builder and response parser per analysis; the prompts are the ones ai.py sends
+# interactively so batch results are interchangeable with the per-scene routes.
+BATCH_REQUESTS = {
+    "score": (rate_request, parse_scores),
+    "sentiment": (sentiment_request, parse_sentiment),
+    "summary": (pitch_request, lambda content: content),
+}
+
+
+def pending_requests(names, force=False, limit=None):
+    # Freshness is decided per scene by is_fresh, which compares a digest of the text:
+    # re-conversion rewrites the current version in place, which version ids can't show.
+    query = (Scene.query
+             .options(joinedload(Scene.current_version).undefer_group('body'))
+             .filter(Scene.current_version_id.isnot(None))
+             .order_by(Scene.id))
+
+    requests, skipped, scenes = [], 0, 0
+    for scene in query.yield_per(500):
+        if limit and scenes >= limit:
+            break
+        added = False
+        for name in names:
+            analysis = ANALYSES[name]
+            if not force and is_fresh(scene, name):
+                continue
+            text = getattr(scene.current_version, analysis.source)
+            # Long scenes need the map-reduce path; leave them to /api/story/<id>/batch_analysis.
+            if not text or estimate_tokens(text) > ANALYSIS_CHUNK_TOKENS:
+                skipped += 1
+                continue
+            build, _ = BATCH_REQUESTS[name]
+            requests.append({
+                "custom_id": f"{name}:{scene.id}:{scene.current_version_id}:{source_digest(text)}",
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": build(text),
+            })
+            added = True
+        scenes += added
+    return requests, skipped
+
+
+def write_jsonl(requests, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w', encoding='utf-8') as f:
+        for item in requests:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    return len(requests)
+
+
+def submit(client, path):
+    # Read once and sent as bytes: a retried upload of an open file would send it from
+    # wherever the failed attempt stopped reading.
+    with open(path, 'rb') as f:
+        data = f.read()
+    input_file = openai_clients.call(client.files.create, file=(os.path.basename(path), data), purpose="batch")
+    return openai_clients.call(
+        client.batches.create,
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h"
+    )
+
+
+def wait_for(client, batch_id, poll_interval=30, timeout=24 * 3600):
+    deadline = time.time() + timeout
+    while True:
+        batch = openai_clients.call(client.batches.retrieve, batch_id)
+        if batch.status in TERMINAL_STATUSES or time.time() >= deadline:
+            return batch
+        time.sleep(poll_interval)
+
+
+def read_results(client, batch):
+    results = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        content = openai_clients.call(client.files.content, file_id)
+        results.extend(json.loads(line) for line in content.text.splitlines() if line.strip())
+    return results
+
+
+def apply_results(results):
+    parsed = []
+    for result in results:
+        name, scene_id, version_id, digest = (result["custom_id"].split(":") + [None])[:4]
+        parsed.append((name, int(scene_id), int(version_id), digest, result))
+    scenes = {scene.id: scene for scene in (Scene.query
+                                            .options(joinedload(Scene.current_version).undefer_group('body'))
+                                            .filter(Scene.id.in_({p[1] for p in parsed})).all())}
+
+    counts = {"applied": 0, "stale": 0, "failed": 0}
+    for name, scene_id, version_id, digest, result in parsed:
+        scene = scenes.get(scene_id)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            counts["failed"] += 1
+            continue
+        # The scene was edited after the request was written; the result describes old text.
+        if (scene is None or scene.current_version_id != version_id
+                or digest != source_digest(getattr(scene.current_version, ANALYSES[name].source))):
+            counts["stale"] += 1
+            continue
+        try:
+            content = response["body"]["choices"][0]["message"]["content"].strip()
+            _, parse = BATCH_REQUESTS[name]
+            ANALYSES[name].apply(scene, parse(content))
+            counts["applied"] += 1
+        except Exception as e:
+            print(f"Could not apply {name} result for scene {scene_id}: {e}")
+            counts["failed"] += 1
+    db.session.commit()
+    return counts
+
+
+DEFAULT_FAKE_RESPONSES = {
+    "score": "Plot: 7\nCharacter Development: 7\nDialogue: 7\nOriginality: 7\nTheme: 7",
+    "sentiment": '{"emojies": [{"name": "Neutral face", "emoji": ":neutral_face:"}], "description": "Canned offline sentiment."}',
+    "summary": '{"Title": "Offline", "Logline": "Canned offline logline.", "Pitch summary": "Canned offline pitch."}',
+}
+
+
+class FakeBatchClient:
+    # Local stand-in for the Files and Batches APIs. Input and output files live in a
+    # directory, so separate CLI invocations see the same batches.
+
+    def __init__(self, directory, responses=None):
+        self.directory = directory
+        self.responses = dict(DEFAULT_FAKE_RESPONSES, **(responses or {}))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve_batch)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _create_file(self, file, purpose):
+        file_id = f"file-{uuid.uuid4().hex}"
+        with open(self._path(file_id), 'wb') as f:
+            f.write(file[1] if isinstance(file, tuple) else file.read())
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id):
+        with open(self._path(file_id), encoding='utf-8') as f:
+            return SimpleNamespace(text=f.read())
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        output_file_id = f"file-{uuid.uuid4().hex}"
+        total = 0
+        with open(self._path(input_file_id), encoding='utf-8') as source, \
+                open(self._path(output_file_id), 'w', encoding='utf-8') as output:
+            for line in source:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                name = item["custom_id"].split(":")[0]
+                output.write(json.dumps({
+                    "id": f"batch_req_{total}",
+                    "custom_id": item["custom_id"],
+                    "response": {"status_code": 200, "body": {
+                        "model": item["body"]["model"],
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": self.responses[name]}}],
+                    }},
+                    "error": None,
+                }) + "\n")
+                total += 1
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "status": "completed",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "output_file_id": output_file_id,
+            "error_file_id": None,
+            "request_counts": {"total": total, "completed": total, "failed": 0},
+        }
+        with open(self._path(batch["id"] + ".json"), 'w', encoding='utf-8') as f:
+            json.dump(batch, f)
+        return SimpleNamespace(**batch)
+
+    def _retrieve_batch(self, batch_id):
+        with open(self._path(batch_id + ".json"), encoding='utf-8') as f:
+            return SimpleNamespace(**json.load(f))
+
+
+def batch_client(fake):
+    if fake:
+        return FakeBatchClient(os.path.join(current_app.instance_path, 'fake_batches'))
+    return openai_clients.get(current_app.config['API_KEY'])
+
+
+ai_batch_cli = AppGroup('ai-batch', help="Offline bulk analysis through the OpenAI Batch API.")
+
+
+def _analyses_option(value):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in ANALYSES]
+    if unknown:
+        raise click.BadParameter(f"unknown analyses: {', '.join(unknown)}")
+    return names
+
+
+@ai_batch_cli.command('prepare')
+@click.option('--analyses', default='score,sentiment,summary', callback=lambda ctx, param, value: _analyses_option(value))
+@click.option('--output', required=True, type=click.Path(dir_okay=False))
+@click.option('--force', is_flag=True, help="Include scenes whose results are already current.")
+@click.option('--limit', type=int, default=None, help="Maximum number of scenes.")
+def prepare_command(analyses, output, force, limit):
+    requests, skipped = pending_requests(analyses, force=force, limit=limit)
+    count = write_jsonl(requests, output)
+    click.echo(f"Wrote {count} requests to {output} ({skipped} skipped)")
+
+
+@ai_batch_cli.command('submit')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--fake', is_flag=True, help="Use the local stand-in instead of OpenAI.")
+def submit_command(path, fake):
+    batch = submit(batch_client(fake), path)
+    click.echo(batch.id)
+
+
+@ai_batch_cli.command('collect')
+@click.argument('batch_id')
+@click.option('--poll-interval', type=int, default=30)
+@click.option('--timeout', type=int, default=24 * 3600)
+@click.option('--fake', is_flag=True, help="Use the local stand-in instead of OpenAI.")
+def collect_command(batch_id, poll_interval, timeout, fake):
+    client = batch_client(fake)
+    batch = wait_for(client, batch_id, poll_interval=poll_interval, timeout=timeout)
+    if batch.status != "completed":
+        raise click.ClickException(f"Batch {batch_id} is {batch.status}")
+    counts = apply_results(read_results(client, batch))
+    click.echo(f"Applied {counts['applied']}, stale {counts['stale']}, failed {counts['failed']}")
+
+
+@ai_batch_cli.command('run')
+@click.option('--analyses', default='score,sentiment,summary', callback=lambda ctx, param, value: _analyses_option(value))
+@click.option('--force', is_flag=True, help="Include scenes whose results are already current.")
+@click.option('--limit', type=int, default=None, help="Maximum number of scenes.")
+@click.option('--poll-interval', type=int, default=30)
+@click.option('--timeout', type=int, default=24 * 3600)
+@click.option('--fake', is_flag=True, help="Use the local stand-in instead of OpenAI.")
+def run_command(analyses, force, limit, poll_interval, timeout, fake):
+    requests, skipped = pending_requests(analyses, force=force, limit=limit)
+    if not requests:
+        click.echo(f"Nothing to do ({skipped} skipped)")
+        return
+    path = os.path.join(current_app.instance_path, 'ai_batches', f"{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+    write_jsonl(requests, path)
+    client = batch_client(fake)
+    batch = submit(client, path)
+    click.echo(f"Submitted {len(requests)} requests as {batch.id} ({skipped} skipped)")
+    batch = wait_for(client, batch.id, poll_interval=poll_interval, timeout=timeout)
+    if batch.status != "completed":
+        raise click.ClickException(f"Batch {batch.id} is {batch.status}")
+    counts = apply_results(read_results(client, batch))
+    click.echo(f"Applied {counts['applied']}, stale {counts['stale']}, failed {counts['failed']}")
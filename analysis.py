@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import emoji
+
+from admission import with_user
+from ai import rate_screenplay, get_sentimental_analysis, generate_pitch_summary
+from models import db
+
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 16))
+
+
+def source_digest(text):
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def _analyzed(scene, name):
+    # Records what an analysis was computed from. The digest matters because
+    # re-conversion rewrites the current version's text without changing its id.
+    analysis = ANALYSES[name]
+    setattr(scene, analysis.version_attr, scene.current_version_id)
+    setattr(scene, analysis.digest_attr, source_digest(getattr(scene.current_version, analysis.source)))
+
+
+def is_fresh(scene, name):
+    analysis = ANALYSES[name]
+    return (getattr(scene, analysis.version_attr) == scene.current_version_id
+            and getattr(scene, analysis.digest_attr) == source_digest(getattr(scene.current_version, analysis.source)))
+
+
+def apply_score(scene, score):
+    scene.plot = score["Plot"] or 0
+    scene.character_development = score["Character Development"] or 0
+    scene.dialogue = score["Dialogue"] or 0
+    scene.originality = score["Originality"] or 0
+    scene.theme = score["Theme"] or 0
+    _analyzed(scene, "score")
+
+
+def apply_sentiment(scene, sentiment):
+    scene_emoji, scene_description = sentiment
+    # Stored already emojized and in the shape get_sentiment_analysis returns.
+    scene.sentiment = [{"emoji": emoji.emojize(emoji_dict["emoji"]), "emoji_name": emoji_dict["name"]} for emoji_dict in scene_emoji]
+    scene.sentiment_desc = scene_description
+    _analyzed(scene, "sentiment")
+
+
+def apply_summary(scene, summary):
+    scene.summary = summary
+    _analyzed(scene, "summary")
+
+
+def _required(result, name):
+    if result is None:
+        raise ValueError(f"{name} returned no result")
+    return result
+
+
+def run_score(screenplay, api_key):
+    return json.loads(_required(rate_screenplay(screenplay, api_key), "rate_screenplay"))
+
+
+def run_sentiment(screenplay, api_key):
+    return _required(get_sentimental_analysis(screenplay, api_key), "get_sentimental_analysis")
+
+
+def run_summary(screenplay, api_key):
+    return _required(generate_pitch_summary(screenplay, api_key), "generate_pitch_summary")
+
+
+Analysis = namedtuple('Analysis', ['source', 'version_attr', 'digest_attr', 'run', 'apply'])
+
+# source is the SceneVersion column each analysis reads, matching the single-scene routes.
+ANALYSES = {
+    "score": Analysis('content', 'score_version_id', 'score_digest', run_score, apply_score),
+    "sentiment": Analysis('formatted', 'sentiment_version_id', 'sentiment_digest', run_sentiment, apply_sentiment),
+    "summary": Analysis('formatted', 'summary_version_id', 'summary_digest', run_summary, apply_summary),
+}
+
+
+def batch_analyze(scenes, names, api_key, concurrency=BATCH_CONCURRENCY, force=False):
+    # Model calls fan out on a bounded pool and only see plain strings; every result is
+    # applied back on the calling thread and committed in one transaction.
+    report = {scene.id: {} for scene in scenes}
+    tasks = []
+    for scene in scenes:
+        version = scene.current_version
+        for name in names:
+            analysis = ANALYSES[name]
+            if version is None or not getattr(version, analysis.source):
+                report[scene.id][name] = "skipped"
+            elif not force and is_fresh(scene, name):
+                report[scene.id][name] = "fresh"
+            else:
+                tasks.append((scene, name, getattr(version, analysis.source)))
+
+    workers = max(1, min(concurrency, BATCH_MAX_CONCURRENCY, len(tasks) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(scene, name, pool.submit(with_user(ANALYSES[name].run), text, api_key)) for scene, name, text in tasks]
+        for scene, name, future in futures:
+            try:
+                ANALYSES[name].apply(scene, future.result())
+                report[scene.id][name] = "updated"
+            except Exception as e:
+                print(f"Could not run {name} for scene {scene.id}: {e}")
+                report[scene.id][name] = "failed"
+
+    db.session.commit()
+    return report
@@ -1,36 +1,124 @@
-from flask import Flask, session, request, jsonify, url_for
+from flask import Flask, session, request, jsonify, url_for, Response, stream_with_context, send_file
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, User, Story, Scene, SceneVersion, Conversation
+from models import db, User, Story, Scene, SceneVersion, Conversation, Job, SceneStats, StoryStats
+from jobs import job_queue, QueueFull
+from pagination import page_args, paginate, InvalidCursor
+from database import database_settings, engine_options, configure_engine
+from conversion import convert_incremental
+from analysis import ANALYSES, BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, batch_analyze, apply_score, apply_sentiment, apply_summary
+from ai_batch import ai_batch_cli
+from tts import speech, narrate, VOICES, LANGUAGES
+from httpcache import http_cache
+import metrics
+import stats
+import versions
+from search import search_index, KINDS as SEARCH_KINDS
+from embeddings import embedding_index, scene_text
+from admission import admission, admit, DEFAULT_LIMITS
+from screenplay import parse_cache, filter_elements, characters, dialogue_counts, to_plain_text
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
-from ai import generate_pitch_summary, generate_image, chatbot_chat, rate_screenplay, convert_to_screenplay, summarize_screenplay, clean_screenplay_text, convert_text_to_speech2, get_sentimental_analysis
+from cache import llm_cache
+from ai import generate_pitch_summary, generate_image, chatbot_chat, chatbot_chat_stream, rate_screenplay, convert_to_screenplay_stream, summarize_screenplay, get_sentimental_analysis
 from dotenv import load_dotenv
+from sqlalchemy import and_, func
 import json
 import os
 from pytz import timezone
-import emoji
 import string 
-import random
 
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": "http://localhost:5173"}})
+CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": "http://localhost:5173"}}, expose_headers=['X-Next-Cursor'])
 
 app.config['JWT_SECRET_KEY'] = 'Num3R0n4u7s!Num3R0n4u7s!'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=6)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///stories.db'
+db_settings = database_settings()
+app.config['SQLALCHEMY_DATABASE_URI'] = db_settings["url"]
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(db_settings)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['API_KEY'] = os.environ.get("API_KEY")
+app.config['JOB_WORKERS'] = int(os.environ.get("JOB_WORKERS", 4))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get("JOB_MAX_PENDING", 100))
+app.config['JOB_STALE_AFTER'] = int(os.environ.get("JOB_STALE_AFTER", 120))
+app.config['JOB_HEARTBEAT'] = int(os.environ.get("JOB_HEARTBEAT", 30))
+app.config['PAGE_SIZE'] = int(os.environ.get("PAGE_SIZE", 50))
+app.config['MAX_PAGE_SIZE'] = int(os.environ.get("MAX_PAGE_SIZE", 200))
+app.config['HTTP_CACHE_MAX_AGE'] = int(os.environ.get("HTTP_CACHE_MAX_AGE", 0))
+app.config['RESPONSE_CACHE_ENTRIES'] = int(os.environ.get("RESPONSE_CACHE_ENTRIES", 0))
+app.config['SERVER_TIMING'] = os.environ.get("SERVER_TIMING", "0").lower() in ('1', 'true', 'yes', 'on')
+app.config['EMBEDDING_PROVIDER'] = os.environ.get("EMBEDDING_PROVIDER", "openai")
+app.config['EMBEDDING_ASYNC'] = os.environ.get("EMBEDDING_ASYNC", "1").lower() in ('1', 'true', 'yes', 'on')
+app.config['AUDIO_KEY_SECRET'] = os.environ.get("AUDIO_KEY_SECRET") or app.config['JWT_SECRET_KEY']
+app.config['ADMISSION_LIMITS'] = os.environ.get("ADMISSION_LIMITS", DEFAULT_LIMITS)
+app.config['ADMISSION_STORE'] = os.environ.get("ADMISSION_STORE", "memory")
+app.config['ADMISSION_MAX_INFLIGHT'] = int(os.environ.get("ADMISSION_MAX_INFLIGHT", 8))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 30))
 
 db.init_app(app)
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
+job_queue.init_app(app)
+versions.init_app(app)
+http_cache.init_app(app)
+metrics.init_app(app)
+stats.init_app(app)
+search_index.init_app(app)
+embedding_index.init_app(app)
+admission.init_app(app)
+speech.configure(secret=app.config['AUDIO_KEY_SECRET'])
+app.cli.add_command(ai_batch_cli)
 
 with app.app_context():
+    configure_engine(db.engine, db_settings)
     db.create_all()
+    with db.engine.begin() as connection:
+        search_index.create_table(connection)
+    job_queue.fail_stale()
+job_queue.start_heartbeat()
+
+def wants_async():
+    return request.args.get('async') in ('1', 'true')
+
+def enqueue(kind, user_id, fn, *args, payload=None):
+    try:
+        job = job_queue.submit(kind, user_id, fn, *args, base_url=request.host_url)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    body = dict(payload or {}, job_id=job.id, status=job.status)
+    return jsonify(body), 202, {'Location': url_for('get_job', job_id=job.id)}
+
+def wants_stream():
+    return request.args.get('stream') in ('1', 'true') or 'text/event-stream' in request.headers.get('Accept', '')
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def scene_validators(user_id, scene):
+    # updated_at moves on every analysis write and every version write (see httpcache).
+    return (user_id, scene.id, scene.current_version_id, scene.updated_at)
+
+@app.errorhandler(InvalidCursor)
+def invalid_cursor(e):
+    return jsonify({'error': str(e)}), 400
+
+def event_stream(chunks, on_complete):
+    def generate():
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield sse('token', {'text': chunk})
+            yield sse('done', on_complete(''.join(parts).strip()))
+        except Exception as e:
+            db.session.rollback()
+            yield sse('error', {'error': 'An error occurred while processing your request.', 'details': str(e)})
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -68,35 +156,62 @@ def login():
 @jwt_required()
 def get_stories():
     current_user_id = get_jwt_identity()
-    user = db.session.get(User, current_user_id)
-    if not user:
-        return jsonify({"message": "User not found"}), 404
 
-    stories = Story.query.filter_by(user_id = current_user_id)
-    scenes_data = []
-    for story in stories:
-        scenes_data.append({"id": story.id, "title": story.title, "image_link": story.image_link, "created_at": story.created_at.strftime("%Y-%m-%d %H:%M:%S")
-, "updated_at": story.updated_at, "description": story.description})
-    return jsonify({"scenes_data": scenes_data}), 201
+    limit, after = page_args()
+
+    # Any insert, delete or update of this user's stories changes one of these.
+    validators = db.session.query(
+        func.count(Story.id), func.max(Story.id), func.max(Story.updated_at)
+    ).filter(Story.user_id == current_user_id).one()
+
+    def build():
+        # Only the serialized columns, in one query; the identity is trusted from the JWT.
+        stories = db.session.query(
+            Story.id, Story.title, Story.image_link, Story.thumbnail_link, Story.created_at, Story.updated_at, Story.description
+        ).filter(Story.user_id == current_user_id)
+        if after is not None:
+            stories = stories.filter(Story.id > after)
+        stories, next_cursor = paginate(stories.order_by(Story.id).limit(limit + 1).all(), limit)
+        scenes_data = []
+        for story in stories:
+            # The list shows the WebP thumbnail; full_image_link is the original for detail views.
+            scenes_data.append({"id": story.id, "title": story.title, "image_link": story.thumbnail_link or story.image_link, "full_image_link": story.image_link, "created_at": story.created_at.strftime("%Y-%m-%d %H:%M:%S")
+    , "updated_at": story.updated_at, "description": story.description})
+        return {"scenes_data": scenes_data, "next_cursor": next_cursor}
+
+    return http_cache.json_response((current_user_id, *validators), build, tags=(f"user:{current_user_id}",))
 
 @app.route('/api/story/<int:story_id>/get_scenes', methods=['GET'])
 @jwt_required()
 def get_scenes(story_id):
     current_user_id = get_jwt_identity()
-    user = db.session.get(User, current_user_id)
-    if not user:
-        return jsonify({"message": "User not found"}), 404
+    limit, after = page_args()
+
+    # One round trip: the story row proves ownership and the outer joins bring each
+    # scene's current title, so an empty story (or past-the-end page) still returns a row.
+    scene_join = Scene.story_id == Story.id
+    if after is not None:
+        scene_join = and_(scene_join, Scene.id > after)
+    rows = (db.session.query(Scene.id, SceneVersion.title)
+            .select_from(Story)
+            .outerjoin(Scene, scene_join)
+            .outerjoin(SceneVersion, SceneVersion.id == Scene.current_version_id)
+            .filter(Story.id == story_id, Story.user_id == current_user_id)
+            .order_by(Scene.id)
+            .limit(limit + 1)
+            .all())
+    if not rows:
+        return jsonify({'error': 'Story not found'}), 404
 
-    scenes = Scene.query.filter_by(story_id = story_id)
-    story = db.session.get(Story, story_id)
+    rows, next_cursor = paginate([row for row in rows if row.id is not None], limit)
     scenes_data = []
-    for scene in scenes:
-        scene_version = db.session.get(SceneVersion, scene.current_version_id) 
-        scenes_data.append({"story_id": story.id, "id": scene.id, "title": scene_version.title})
-    return jsonify({"scenes_data": scenes_data}), 201
+    for scene_id, title in rows:
+        scenes_data.append({"story_id": story_id, "id": scene_id, "title": title})
+    return jsonify({"scenes_data": scenes_data, "next_cursor": next_cursor}), 200
 
 @app.route('/api/add_story', methods=['POST'])
 @jwt_required()
+@admit('image')
 def create_story():
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -110,14 +225,33 @@ def create_story():
     if not story_title:
         return jsonify({'error': 'Story title is required'}), 400
 
-    new_story = Story(title=story_title, user_id=current_user_id, description=desc, image_link=generate_image(desc, app.config['API_KEY']))
+    new_story = Story(title=story_title, user_id=current_user_id, description=desc)
     db.session.add(new_story)
     db.session.commit()
+    payload = {'message': 'Story created successfully', 'story': {'id': new_story.id, 'title': new_story.title}}
 
-    return jsonify({'message': 'Story created successfully', 'story': {'id': new_story.id, 'title': new_story.title}}), 201
+    if wants_async():
+        return enqueue('story_image', current_user_id, generate_story_image, new_story.id, payload=payload)
+
+    # The story is usable right away; the image is generated, downloaded and thumbnailed
+    # on the job queue. Only a full queue makes this request wait for it.
+    try:
+        payload['image_job_id'] = job_queue.submit('story_image', current_user_id, generate_story_image, new_story.id, base_url=request.host_url).id
+    except QueueFull:
+        generate_story_image(new_story.id)
+    return jsonify(payload), 201
+
+def generate_story_image(story_id, use_cache=True):
+    story = db.session.get(Story, story_id)
+    image = generate_image(story.description, app.config['API_KEY'], use_cache=use_cache)
+    story.image_link = image['image_link']
+    story.thumbnail_link = image['thumbnail_link']
+    db.session.commit()
+    return {'story_id': story.id, 'image_link': story.image_link, 'thumbnail_link': story.thumbnail_link}
 
 @app.route('/api/add_story/image/<int:story_id>', methods=['POST'])
 @jwt_required()
+@admit('image')
 def create_story_image(story_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -125,15 +259,22 @@ def create_story_image(story_id):
         return jsonify({"message": "User not found"}), 404
 
     story = db.session.get(Story, story_id)
+    if not story:
+        return jsonify({'error': 'Story not found'}), 404
 
-    story.image_link = generate_image(story.description, app.config['API_KEY'])
-    db.session.commit()
+    # Explicitly asking for a new image skips the prompt cache.
+    if wants_async():
+        return enqueue('story_image', current_user_id, generate_story_image, story_id, False,
+                       payload={'message': 'Image generation started'})
+
+    generate_story_image(story_id, use_cache=False)
 
     return jsonify({'message': 'Image created successfully'}), 201
 
 
 @app.route('/api/story/<int:story_id>/add_scene', methods=['POST'])
 @jwt_required()
+@admit('convert')
 def create_scene(story_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -151,14 +292,24 @@ def create_scene(story_id):
     if not story:
         return jsonify({'error': 'Story not found'}), 404
 
+    if wants_async():
+        return enqueue('add_scene', current_user_id, add_scene, story_id, scene_title, scene_content)
+
+    return jsonify({
+        'message': 'Scene created successfully',
+        'scene': add_scene(story_id, scene_title, scene_content)
+    }), 201
+
+def add_scene(story_id, scene_title, scene_content):
     new_scene = Scene(story_id=story_id)
     db.session.add(new_scene)
     db.session.flush()
-    screenplay = convert_to_screenplay(scene_content, app.config['API_KEY'])
+    screenplay, blocks = convert_incremental(scene_content, None, app.config['API_KEY'])
     initial_version = SceneVersion(
         scene_id=new_scene.id,
         version_number=1,
         formatted = screenplay,
+        blocks=blocks,
         title=scene_title,
         content=scene_content
     )
@@ -168,15 +319,12 @@ def create_scene(story_id):
     new_scene.current_version_id = initial_version.id
     db.session.commit()
 
-    return jsonify({
-        'message': 'Scene created successfully',
-        'scene': {
-            'id': new_scene.id,
-            'title': initial_version.title,
-            'content': initial_version.content,
-            'version': initial_version.version_number
-        }
-    }), 201
+    return {
+        'id': new_scene.id,
+        'title': initial_version.title,
+        'content': initial_version.content,
+        'version': initial_version.version_number
+    }
 
 @app.route('/api/story/<int:story_id>/edit_scene_formatted/<int:scene_id>', methods=['POST'])
 @jwt_required()
@@ -198,11 +346,12 @@ def edit_scene_formatted(story_id, scene_id):
     if not story:
         return jsonify({'error': 'Story not found'}), 404
 
+    previous_version = versions.current_version(scene)
     new_version = SceneVersion(
         scene_id=scene_id,
-        version_number=scene.current_version_id+1,
-        title="Scene 1",
-        content=scene.content,
+        version_number=versions.next_version_number(scene_id),
+        title=previous_version.title,
+        content=previous_version.content,
         formatted=scene_formatted
     )
     db.session.add(new_version)
@@ -216,7 +365,7 @@ def edit_scene_formatted(story_id, scene_id):
         'scene': {
             'id': scene_id,
             'title': new_version.title,
-            'formatted': new_version.scene_formatted,
+            'formatted': new_version.formatted,
             'version': new_version.version_number
         }
     }), 201
@@ -230,15 +379,206 @@ def get_scene_formatted(scene_id):
         return jsonify({"message": "User not found"}), 404
 
     scene = db.session.get(Scene, scene_id)
-    scene_version = db.session.get(SceneVersion, scene.current_version_id)
+    if not scene:
+        return jsonify({'error': 'Scene not found'}), 404
 
-    return jsonify({
-        'formatted': scene_version.formatted
-    }), 201
+    def build():
+        scene_version = versions.current_version(scene)
+        return {'formatted': scene_version.formatted}
+
+    return http_cache.json_response(scene_validators(current_user_id, scene), build, tags=(f"scene:{scene.id}",))
+
+
+@app.route('/api/scene/<int:scene_id>/structure', methods=['GET'])
+@jwt_required()
+def get_scene_structure(scene_id):
+    current_user_id = get_jwt_identity()
+    scene = db.session.get(Scene, scene_id)
+    if not scene or not scene.current_version_id or scene.story.user_id != current_user_id:
+        return jsonify({'error': 'Scene not found'}), 404
+
+    kinds = [kind for kind in request.args.get('kinds', '').split(',') if kind]
+
+    def build():
+        # Parsed locally from the tagged text; no model call involved.
+        elements = parse_cache.get(versions.current_version(scene))
+        selected = filter_elements(elements, kinds) if kinds else elements
+        body = {
+            "elements": [element.to_dict() for element in selected],
+            "characters": characters(elements),
+            "dialogue_counts": dict(dialogue_counts(elements)),
+        }
+        if request.args.get('format') == 'text':
+            body["text"] = to_plain_text(selected)
+        return body
 
+    return http_cache.json_response(scene_validators(current_user_id, scene), build, tags=(f"scene:{scene.id}",))
+
+@app.route('/api/scene/<int:scene_id>/stats', methods=['GET'])
+@jwt_required()
+def get_scene_stats(scene_id):
+    current_user_id = get_jwt_identity()
+    scene = db.session.get(Scene, scene_id)
+    if not scene or not scene.current_version_id or scene.story.user_id != current_user_id:
+        return jsonify({'error': 'Scene not found'}), 404
+
+    def build():
+        # Written with the version; only versions older than the stats table lack a row.
+        version = versions.current_version(scene)
+        if version.stats is not None:
+            return version.stats.to_dict()
+        return SceneStats(version_id=version.id, **stats.compute(version.formatted or version.content)).to_dict()
+
+    return http_cache.json_response(scene_validators(current_user_id, scene), build, tags=(f"scene:{scene.id}",))
+
+@app.route('/api/story/<int:story_id>/stats', methods=['GET'])
+@jwt_required()
+def get_story_stats(story_id):
+    current_user_id = get_jwt_identity()
+    story = db.session.get(Story, story_id)
+    if not story or story.user_id != current_user_id:
+        return jsonify({'error': 'Story not found'}), 404
+
+    story_stats = db.session.get(StoryStats, story_id) or StoryStats(story_id=story_id, character_lines={})
+    return http_cache.json_response((current_user_id, story_id, story_stats.updated_at), story_stats.to_dict, tags=(f"story:{story_id}",))
+
+@app.route('/api/scene/<int:scene_id>/versions', methods=['GET'])
+@jwt_required()
+def get_scene_versions(scene_id):
+    current_user_id = get_jwt_identity()
+    scene = db.session.get(Scene, scene_id)
+    if not scene or scene.story.user_id != current_user_id:
+        return jsonify({'error': 'Scene not found'}), 404
+    limit, before = page_args()
+
+    def build():
+        # Metadata columns only, newest first, walking the (scene_id, version_number)
+        # index; the text bodies are never read.
+        rows = (db.session.query(SceneVersion.id, SceneVersion.version_number, SceneVersion.title,
+                                 SceneVersion.created_at, SceneVersion.parent_id, SceneStats.words)
+                .outerjoin(SceneStats, SceneStats.version_id == SceneVersion.id)
+                .filter(SceneVersion.scene_id == scene_id))
+        if before is not None:
+            rows = rows.filter(SceneVersion.version_number < before)
+        rows, next_cursor = paginate(rows.order_by(SceneVersion.version_number.desc()).limit(limit + 1).all(), limit,
+                                     key=lambda row: row.version_number)
+        versions_data = []
+        for row in rows:
+            versions_data.append({"id": row.id, "version": row.version_number, "title": row.title,
+                                  "created_at": row.created_at, "parent_id": row.parent_id, "words": row.words,
+                                  "current": row.id == scene.current_version_id})
+        return {"versions": versions_data, "next_cursor": next_cursor}
+
+    return http_cache.json_response(scene_validators(current_user_id, scene), build, tags=(f"scene:{scene.id}",))
+
+@app.route('/api/scene/<int:scene_id>/versions/<int:version_number>', methods=['GET'])
+@jwt_required()
+def get_scene_version(scene_id, version_number):
+    current_user_id = get_jwt_identity()
+    scene = db.session.get(Scene, scene_id)
+    if not scene or scene.story.user_id != current_user_id:
+        return jsonify({'error': 'Scene not found'}), 404
+
+    if not db.session.query(SceneVersion.id).filter_by(scene_id=scene_id, version_number=version_number).first():
+        return jsonify({'error': 'Version not found'}), 404
+
+    def build():
+        version = versions.find_version(scene_id, version_number)
+        return {"id": version.id, "version": version.version_number, "title": version.title,
+                "created_at": version.created_at, "parent_id": version.parent_id,
+                "current": version.id == scene.current_version_id,
+                "content": version.content, "formatted": version.formatted}
+
+    return http_cache.json_response(scene_validators(current_user_id, scene) + (version_number,), build,
+                                    tags=(f"scene:{scene.id}",))
+
+@app.route('/api/scene/<int:scene_id>/diff', methods=['GET'])
+@jwt_required()
+def get_scene_diff(scene_id):
+    # ?from=&to= are version numbers; to defaults to the current version. mode=lines
+    # compares raw lines instead of parsed screenplay elements.
+    current_user_id = get_jwt_identity()
+    scene = db.session.get(Scene, scene_id)
+    if not scene or not scene.current_version_id or scene.story.user_id != current_user_id:
+        return jsonify({'error': 'Scene not found'}), 404
+    mode = request.args.get('mode', 'elements')
+    if mode not in ('elements', 'lines'):
+        return jsonify({'error': 'mode must be elements or lines'}), 400
+    from_number = request.args.get('from', type=int)
+    if from_number is None:
+        return jsonify({'error': 'from is required'}), 400
+    to_number = request.args.get('to', type=int)
+    if to_number is None:
+        to_number = db.session.query(SceneVersion.version_number).filter_by(id=scene.current_version_id).scalar()
+    found = (db.session.query(func.count(SceneVersion.id))
+             .filter(SceneVersion.scene_id == scene_id, SceneVersion.version_number.in_({from_number, to_number}))
+             .scalar())
+    if found != len({from_number, to_number}):
+        return jsonify({'error': 'Version not found'}), 404
+
+    def build():
+        old = versions.find_version(scene_id, from_number)
+        new = versions.find_version(scene_id, to_number)
+        return dict(versions.diff_versions(old, new, mode), **{"from": from_number, "to": to_number})
+
+    return http_cache.json_response(scene_validators(current_user_id, scene) + (from_number, to_number, mode), build,
+                                    tags=(f"scene:{scene.id}",))
+
+@app.route('/api/scene/<int:scene_id>/similar', methods=['GET'])
+@jwt_required()
+@admit('embedding')
+def get_similar_scenes(scene_id):
+    # Nearest scenes by embedding across all of the user's stories.
+    current_user_id = get_jwt_identity()
+    scene = db.session.get(Scene, scene_id)
+    if not scene or not scene.current_version_id or scene.story.user_id != current_user_id:
+        return jsonify({'error': 'Scene not found'}), 404
+    limit = max(1, min(request.args.get('limit', 5, type=int), 50))
+
+    hits = embedding_index.similar(current_user_id, scene_id, limit)
+    if hits is None:
+        # Written before embeddings existed, or its vector is still queued.
+        version = versions.current_version(scene)
+        embedding_index.index([(current_user_id, scene_id, scene_text(version))])
+        hits = embedding_index.similar(current_user_id, scene_id, limit)
+        if hits is None:
+            return jsonify({"scene_id": scene_id, "similar": []}), 200
+
+    rows = (db.session.query(Scene.id, Scene.story_id, Story.title, SceneVersion.title)
+            .join(Story, Story.id == Scene.story_id)
+            .join(SceneVersion, SceneVersion.id == Scene.current_version_id)
+            .filter(Scene.id.in_([hit_id for hit_id, _ in hits]), Story.user_id == current_user_id)
+            .all())
+    found = {row[0]: row for row in rows}
+    similar = [{"scene_id": hit_id, "story_id": found[hit_id][1], "story_title": found[hit_id][2],
+                "title": found[hit_id][3], "score": round(score, 4)}
+               for hit_id, score in hits if hit_id in found]
+    return jsonify({"scene_id": scene_id, "similar": similar}), 200
+
+@app.route('/api/search', methods=['GET'])
+@jwt_required()
+def search_route():
+    # ?q= with optional kind (story, scene, dialogue), character and story_id filters.
+    # Results are ranked, so the cursor is an offset into the ranking.
+    current_user_id = get_jwt_identity()
+    if not search_index.enabled:
+        return jsonify({'error': 'Search is not available'}), 503
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    kind = request.args.get('kind')
+    if kind is not None and kind not in SEARCH_KINDS:
+        return jsonify({'error': f"kind must be one of {', '.join(SEARCH_KINDS)}"}), 400
+    limit, offset = page_args()
+    offset = offset or 0
+    results = search_index.search(current_user_id, query, kind=kind, character=request.args.get('character'),
+                                  story_id=request.args.get('story_id', type=int), limit=limit + 1, offset=offset)
+    results, next_cursor = paginate(results, limit, key=lambda result: offset + limit)
+    return jsonify({"results": results, "next_cursor": next_cursor}), 200
 
 @app.route('/api/edit_scene_text/<int:scene_id>', methods=['POST'])
 @jwt_required()
+@admit('convert')
 def edit_scene_text(scene_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -252,13 +592,17 @@ def edit_scene_text(scene_id):
 
     if not scene_title or not scene_content:
         return jsonify({'error': 'Scene title and content are required'}), 400
-    screenplay = convert_to_screenplay(scene_content, app.config['API_KEY'])
+    # Only paragraphs changed since the current version go back through the model.
+    previous_version = versions.current_version(scene)
+    previous_blocks = previous_version.blocks if previous_version else None
+    screenplay, blocks = convert_incremental(scene_content, previous_blocks, app.config['API_KEY'])
 
     new_version = SceneVersion(
         scene_id=scene_id,
-        version_number=scene.current_version_id+1,
+        version_number=versions.next_version_number(scene_id),
         title=scene_title,
         formatted = screenplay,
+        blocks=blocks,
         content=scene_content
     )
     db.session.add(new_version)
@@ -279,6 +623,7 @@ def edit_scene_text(scene_id):
 
 @app.route('/api/convert_to_screenplay/scene/<int:scene_id>', methods=['POST'])
 @jwt_required()
+@admit('convert')
 def convert_to_screenplay_route(scene_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -286,16 +631,30 @@ def convert_to_screenplay_route(scene_id):
         return jsonify({"message": "User not found"}), 404
 
     scene = db.session.get(Scene, scene_id)
-    scene_version = db.session.get(SceneVersion, scene.current_version_id)
+    scene_version = versions.current_version(scene)
 
     text_content = scene_version.content
-    screenplay = convert_to_screenplay(text_content, app.config['API_KEY'])
+    use_cache = request.args.get('refresh') != '1'
+
+    if wants_stream():
+        def save_screenplay(screenplay):
+            # A whole-scene conversion no longer lines up with the per-paragraph blocks.
+            scene_version.formatted = screenplay
+            scene_version.blocks = None
+            db.session.commit()
+            return {'screenplay': screenplay}
+        return event_stream(convert_to_screenplay_stream(text_content, app.config['API_KEY'], use_cache=use_cache), save_screenplay)
+
+    previous_blocks = scene_version.blocks if use_cache else None
+    screenplay, blocks = convert_incremental(text_content, previous_blocks, app.config['API_KEY'], use_cache=use_cache)
     scene_version.formatted = screenplay
+    scene_version.blocks = blocks
     db.session.commit()
     return jsonify({'screenplay': screenplay})
 
 @app.route('/api/score_screenplay/scene/<int:scene_id>', methods=['POST'])
 @jwt_required()
+@admit('analysis')
 def score_screenplay_route(scene_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -303,14 +662,11 @@ def score_screenplay_route(scene_id):
         return jsonify({"message": "User not found"}), 404
 
     scene = db.session.get(Scene, scene_id)
-    scene_version = db.session.get(SceneVersion, scene.current_version_id)
+    scene_version = versions.current_version(scene)
     screenplay = scene_version.content
-    score = json.loads(rate_screenplay(screenplay, app.config['API_KEY']))
-    scene.plot = score["Plot"] or 0
-    scene.character_development = score["Character Development"] or 0
-    scene.dialogue = score["Dialogue"] or 0
-    scene.originality = score["Originality"] or 0
-    scene.theme = score["Theme"] or 0
+    use_cache = request.args.get('refresh') != '1'
+    score = json.loads(rate_screenplay(screenplay, app.config['API_KEY'], use_cache=use_cache))
+    apply_score(scene, score)
     db.session.commit()
     print(score, type(score))
     return {"message": "Successfully scored", "Plot": scene.plot, "CharacterDevelopment": scene.character_development, "Dialogue": scene.dialogue, "Originality": scene.originality, "Theme": scene.theme}
@@ -324,10 +680,14 @@ def get_score(scene_id):
         return jsonify({"message": "User not found"}), 404
 
     scene = db.session.get(Scene, scene_id)
-    return {"scores": {"Plot": scene.plot or 0, "CharacterDevelopment": scene.character_development  or 0, "Dialogue": scene.dialogue  or 0, "Originality": scene.originality  or 0, "Theme": scene.theme  or 0}}
+    if not scene:
+        return jsonify({'error': 'Scene not found'}), 404
+    build = lambda: {"scores": {"Plot": scene.plot or 0, "CharacterDevelopment": scene.character_development  or 0, "Dialogue": scene.dialogue  or 0, "Originality": scene.originality  or 0, "Theme": scene.theme  or 0}}
+    return http_cache.json_response(scene_validators(current_user_id, scene), build, tags=(f"scene:{scene.id}",))
 
 @app.route('/api/summarize_screenplay/scene/<int:scene_id>', methods=['POST'])
 @jwt_required()
+@admit('analysis')
 def summarize_screenplay_route(scene_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -335,38 +695,68 @@ def summarize_screenplay_route(scene_id):
         return jsonify({"message": "User not found"}), 404
 
     scene = db.session.get(Scene, scene_id)
-    scene_version = db.session.get(SceneVersion, scene.current_version_id)
+    scene_version = versions.current_version(scene)
     screenplay = scene_version.formatted
     summary = summarize_screenplay(screenplay, app.config['API_KEY'])
     return summary
 
 @app.route('/api/scene_to_voice/<int:scene_id>', methods=['POST'])
 @jwt_required()
-def scene_to_voice_route(scene_id, save_directory='static/generated_audios/'):
-    if not os.path.exists(save_directory):
-        os.makedirs(save_directory)
+@admit('voice')
+def scene_to_voice_route(scene_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
     if not user:
         return jsonify({"message": "User not found"}), 404
 
-    data = request.get_json()
     scene = db.session.get(Scene, scene_id)
-    scene_version = db.session.get(Scene, scene_id)
-    screenplay = scene_version.formatted
-    cleaned_text = clean_screenplay_text(screenplay,app.config['API_KEY'])
-    
-    
-    res = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-    filename = "{}.mp3".format(res)
-    audio_path = os.path.join(save_directory, filename)
-    convert_text_to_speech2(cleaned_text, audio_path)
-    saved_audio_url = url_for('static', filename=f'generated_audios/{filename}', _external=True)
-
-    return saved_audio_url
+    if not scene:
+        return jsonify({'error': 'Scene not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    voice = data.get('voice') or request.args.get('voice', 'com')
+    lang = data.get('lang') or request.args.get('lang', 'en')
+    if voice not in VOICES:
+        return jsonify({'error': f"voice must be one of {', '.join(VOICES)}"}), 400
+    if lang not in LANGUAGES:
+        return jsonify({'error': 'Unsupported lang'}), 400
+    key = speech.audio_key(scene.current_version_id, voice, lang)
+    if speech.is_cached(key):
+        return url_for('get_audio', key=key, _external=True)
+
+    if wants_async():
+        # audio_url starts answering as soon as the first sentences are synthesized.
+        return enqueue('scene_to_voice', current_user_id, scene_to_voice, scene_id, voice, lang,
+                       payload={'audio_url': url_for('get_audio', key=key, _external=True)})
+
+    return scene_to_voice(scene_id, voice, lang)
+
+def scene_to_voice(scene_id, voice='com', lang='en'):
+    scene = db.session.get(Scene, scene_id)
+    scene_version = versions.current_version(scene)
+    key = speech.audio_key(scene_version.id, voice, lang)
+    if not speech.is_cached(key):
+        narration = narrate(scene_version.formatted, app.config['API_KEY'])
+        speech.synthesize(key, narration, voice, lang)
+    return url_for('get_audio', key=key, _external=True)
+
+@app.route('/api/audio/<key>.mp3', methods=['GET'])
+def get_audio(key):
+    # Public like the static URLs it replaces; keys are HMACs under AUDIO_KEY_SECRET, not ids.
+    if len(key) != 40 or any(ch not in string.hexdigits for ch in key):
+        return jsonify({'error': 'Audio not found'}), 404
+    if speech.is_cached(key):
+        # conditional=True answers Range requests with 206, so players can seek.
+        response = send_file(os.path.abspath(speech.path(key)), mimetype='audio/mpeg', conditional=True, max_age=86400)
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+    if os.path.exists(speech.partial_path(key)):
+        return Response(stream_with_context(speech.follow(key)), mimetype='audio/mpeg')
+    return jsonify({'error': 'Audio not found'}), 404
 
 @app.route('/api/sentiment_analysis/scene/<int:scene_id>', methods=['POST'])
 @jwt_required()
+@admit('analysis')
 def sentiment_analysis_route(scene_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -374,17 +764,10 @@ def sentiment_analysis_route(scene_id):
         return jsonify({"message": "User not found"}), 404
 
     scene = db.session.get(Scene, scene_id)
-    scene_version = db.session.get(SceneVersion, scene.current_version_id)
+    scene_version = versions.current_version(scene)
     screenplay = scene_version.formatted
     scene_emoji, scene_description = get_sentimental_analysis(screenplay, app.config['API_KEY'])
-    emoji_list = []
-    emojiNames_list = []
-    for emoji_dict in scene_emoji:
-        emoji_list.append(emoji.emojize(emoji_dict["emoji"]))
-        emojiNames_list.append(emoji_dict["name"])
-    scene.emoji = emoji_list
-    scene.emoji_name = emojiNames_list
-    scene.sentiment_desc = scene_description
+    apply_sentiment(scene, (scene_emoji, scene_description))
     db.session.commit()    
     return jsonify({"emoji": scene_emoji, "desc": scene_description})
 
@@ -396,26 +779,36 @@ def get_sentiment_analysis(scene_id):
     if not user:
         return jsonify({"message": "User not found"}), 404
     scene = db.session.get(Scene, scene_id)
-    emojis_data=[]
-    for i in range(len(scene.emoji)):
-        print(scene.emoji[i])
-        emojis_data.append({"emoji": emoji.emojize(scene.emoji[i]), "emoji_name": scene.emoji_name[i]})  
-    return jsonify({"emoji_data": emojis_data, "desc": scene.sentiment_desc})
+    if not scene:
+        return jsonify({'error': 'Scene not found'}), 404
+    build = lambda: {"emoji_data": scene.sentiment or [], "desc": scene.sentiment_desc}
+    return http_cache.json_response(scene_validators(current_user_id, scene), build, tags=(f"scene:{scene.id}",))
 
 @app.route('/api/generate_summary/scene/<int:scene_id>', methods=['POST'])
 @jwt_required()
+@admit('analysis')
 def generate_summary_route(scene_id):
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
     if not user:
         return jsonify({"message": "User not found"}), 404
     scene = db.session.get(Scene, scene_id)
-    scene_version = db.session.get(SceneVersion, scene.current_version_id)
+    if not scene:
+        return jsonify({'error': 'Scene not found'}), 404
+
+    if wants_async():
+        return enqueue('generate_summary', current_user_id, generate_summary, scene_id)
+
+    return jsonify(generate_summary(scene_id))
+
+def generate_summary(scene_id):
+    scene = db.session.get(Scene, scene_id)
+    scene_version = versions.current_version(scene)
     summary = generate_pitch_summary(scene_version.formatted, app.config['API_KEY'])
-    scene.summary = summary
+    apply_summary(scene, summary)
     db.session.commit()
     print(summary)
-    return jsonify({"summary": scene.summary})
+    return {"summary": scene.summary}
 
 @app.route('/api/get_summary/scene/<int:scene_id>', methods=['GET'])
 @jwt_required()
@@ -425,14 +818,101 @@ def get_summary(scene_id):
     if not user:
         return jsonify({"message": "User not found"}), 404
     scene = db.session.get(Scene, scene_id)
-    summary = json.loads(scene.summary)
-    title = summary["Title"]
-    logline = summary["Logline"]
-    pitch_summary = summary["Pitch summary"]
-    return jsonify({"Title": title, "Logline": logline, "Pitch summary": pitch_summary})
+    if not scene:
+        return jsonify({'error': 'Scene not found'}), 404
+
+    def build():
+        summary = json.loads(scene.summary)
+        title = summary["Title"]
+        logline = summary["Logline"]
+        pitch_summary = summary["Pitch summary"]
+        return {"Title": title, "Logline": logline, "Pitch summary": pitch_summary}
+
+    return http_cache.json_response(scene_validators(current_user_id, scene), build, tags=(f"scene:{scene.id}",))
+
+def story_screenplay(story_id, user_id):
+    # The current version of every scene in story order, formatted where available.
+    rows = (db.session.query(SceneVersion.formatted, SceneVersion.content)
+            .join(Scene, Scene.current_version_id == SceneVersion.id)
+            .join(Story, Story.id == Scene.story_id)
+            .filter(Story.id == story_id, Story.user_id == user_id)
+            .order_by(Scene.id)
+            .all())
+    return "\n".join(formatted or content for formatted, content in rows)
+
+def score_story(screenplay):
+    return json.loads(rate_screenplay(screenplay, app.config['API_KEY']))
+
+def summarize_story(screenplay):
+    return {"summary": json.loads(summarize_screenplay(screenplay, app.config['API_KEY']))}
+
+def pitch_story(screenplay):
+    return {"summary": generate_pitch_summary(screenplay, app.config['API_KEY'])}
+
+def story_analysis(story_id, kind, fn):
+    current_user_id = get_jwt_identity()
+    screenplay = story_screenplay(story_id, current_user_id)
+    if not screenplay:
+        return jsonify({'error': 'Story not found or has no scenes'}), 404
+    if wants_async():
+        return enqueue(kind, current_user_id, fn, screenplay)
+    return jsonify(fn(screenplay))
+
+@app.route('/api/score_screenplay/story/<int:story_id>', methods=['POST'])
+@jwt_required()
+@admit('analysis')
+def score_story_route(story_id):
+    return story_analysis(story_id, 'score_story', score_story)
+
+@app.route('/api/summarize_screenplay/story/<int:story_id>', methods=['POST'])
+@jwt_required()
+@admit('analysis')
+def summarize_story_route(story_id):
+    return story_analysis(story_id, 'summarize_story', summarize_story)
+
+@app.route('/api/generate_summary/story/<int:story_id>', methods=['POST'])
+@jwt_required()
+@admit('analysis')
+def generate_story_summary_route(story_id):
+    return story_analysis(story_id, 'pitch_story', pitch_story)
+
+@app.route('/api/story/<int:story_id>/batch_analysis', methods=['POST'])
+@jwt_required()
+@admit('analysis')
+def batch_analysis_route(story_id):
+    current_user_id = get_jwt_identity()
+    story = Story.query.filter_by(id=story_id, user_id=current_user_id).first()
+    if not story:
+        return jsonify({'error': 'Story not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    names = data.get('analyses') or list(ANALYSES)
+    unknown = [name for name in names if name not in ANALYSES]
+    if unknown:
+        return jsonify({'error': f"Unknown analyses: {', '.join(unknown)}", 'available': list(ANALYSES)}), 400
+    try:
+        concurrency = int(data.get('concurrency') or BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency must be an integer'}), 400
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    force = bool(data.get('force'))
+
+    if wants_async():
+        return enqueue('batch_analysis', current_user_id, batch_analyze_story, story_id, names, concurrency, force)
+    return jsonify(batch_analyze_story(story_id, names, concurrency, force))
+
+def batch_analyze_story(story_id, names, concurrency, force):
+    scenes = (Scene.query
+              .options(joinedload(Scene.current_version).undefer_group('body'))
+              .filter(Scene.story_id == story_id)
+              .order_by(Scene.id)
+              .all())
+    report = batch_analyze(scenes, names, app.config['API_KEY'], concurrency=concurrency, force=force)
+    return {'story_id': story_id, 'scenes': {str(scene_id): status for scene_id, status in report.items()}}
 
 @app.route('/api/chat', methods=['POST'])
 @jwt_required()
+@admit('chat')
 def chat():
     current_user_id = get_jwt_identity()
     user = db.session.get(User, current_user_id)
@@ -440,6 +920,8 @@ def chat():
         return jsonify({"message": "User not found"}), 404
     data = request.get_json()
     user_input = data.get('userInput')
+    if wants_stream():
+        return event_stream(chatbot_chat_stream(current_user_id, user_input, app.config['API_KEY']), lambda reply: {'reply': reply})
     return chatbot_chat(current_user_id, user_input, app.config['API_KEY'])
 
 @app.route('/api/get_chat', methods=['GET'])
@@ -449,11 +931,39 @@ def get_chat():
     user = db.session.get(User, current_user_id)
     if not user:
         return jsonify({"message": "User not found"}), 404
-    chats = Conversation.query.filter_by(user_id=current_user_id)
+    limit, before = page_args()
+
+    # Newest first so the first page is the latest messages; the cursor walks back in time
+    # and each page is returned oldest-to-newest like before.
+    chats = Conversation.query.filter(Conversation.user_id == current_user_id)
+    if before is not None:
+        chats = chats.filter(Conversation.id < before)
+    chats, next_cursor = paginate(chats.order_by(Conversation.id.desc()).limit(limit + 1).all(), limit)
     chats_data = []
-    for chat in chats:
+    for chat in reversed(chats):
         chats_data.append({"id": chat.id, "role": chat.role, "content": chat.content})
-    return jsonify(chats_data)
+    response = jsonify(chats_data)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    current_user_id = get_jwt_identity()
+    job = db.session.get(Job, job_id)
+    if not job or job.user_id != current_user_id:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/ai_cache/stats', methods=['GET'])
+@jwt_required()
+def ai_cache_stats():
+    return jsonify(llm_cache.stats()), 200
 
 
 if __name__ == '__main__':
@@ -0,0 +1,76 @@
+# Compares the stock SQLite engine with the tuned one from database.py under several
+# processes writing at once, the way multiple web workers share stories.db.
+#
+#   python benchmarks/concurrent_writers.py --workers 8 --writes 200
+import argparse
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.exc import OperationalError
+
+from database import database_settings, engine_options, configure_engine
+from models import db, Conversation
+
+
+def make_engine(url, tuned):
+    if not tuned:
+        return create_engine(url)
+    settings = database_settings(dict(os.environ, DATABASE_URL=url, SQLITE_TUNED='1'))
+    engine = create_engine(url, **engine_options(settings))
+    configure_engine(engine, settings)
+    return engine
+
+
+def writer(args):
+    url, tuned, worker_id, writes = args
+    engine = make_engine(url, tuned)
+    conversations = Conversation.__table__
+    errors = 0
+    latencies = []
+    for i in range(writes):
+        start = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(conversations).values(user_id=worker_id, role='user', content=f'message {i} ' * 20))
+                conn.execute(select(func.count()).select_from(conversations).where(conversations.c.user_id == worker_id))
+        except OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    engine.dispose()
+    return errors, latencies
+
+
+def run(mode, workers, writes):
+    directory = tempfile.mkdtemp()
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    tuned = mode == 'tuned'
+    engine = make_engine(url, tuned)
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    start = time.perf_counter()
+    with Pool(workers) as pool:
+        results = pool.map(writer, [(url, tuned, w, writes) for w in range(workers)])
+    elapsed = time.perf_counter() - start
+
+    errors = sum(r[0] for r in results)
+    latencies = sorted(l for r in results for l in r[1])
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    total = workers * writes
+    print(f"{mode:8} {total / elapsed:9.0f} writes/s  p50 {p50:7.2f} ms  p99 {p99:8.2f} ms  locked errors {errors}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--writes', type=int, default=200)
+    options = parser.parse_args()
+    for mode in ('default', 'tuned'):
+        run(mode, options.workers, options.writes)
@@ -0,0 +1,136 @@
+# Bytes per scene version and read latency with every version stored in full versus
+# snapshots plus deltas (versions.py). Simulates one scene edited many times with a
+# few paragraphs changed per edit.
+#
+#   python benchmarks/version_storage.py --versions 300 --paragraphs 80 --interval 16
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func
+from sqlalchemy.orm import undefer_group
+
+import versions
+from deltas import reconstruction_cache
+from models import db, User, Story, Scene, SceneVersion
+
+
+def paragraph(rng):
+    words = ['door', 'rain', 'she', 'looks', 'away', 'the', 'car', 'stops', 'quietly', 'night', 'he', 'laughs']
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(8, 30)))
+
+
+def formatted_text(paragraphs):
+    return '\n'.join(f"<action>{text}</action>" for text in paragraphs)
+
+
+def build_history(count, size, seed):
+    rng = random.Random(seed)
+    user = User(username=f'bench{seed}', password='x')
+    db.session.add(user)
+    db.session.flush()
+    story = Story(user_id=user.id, title='Bench', description='')
+    db.session.add(story)
+    db.session.flush()
+    scene = Scene(story_id=story.id)
+    db.session.add(scene)
+    db.session.flush()
+
+    paragraphs = [paragraph(rng) for _ in range(size)]
+    for number in range(1, count + 1):
+        if number > 1:
+            for _ in range(rng.randint(1, 3)):
+                index = rng.randrange(len(paragraphs))
+                action = rng.random()
+                if action < 0.6:
+                    paragraphs[index] = paragraph(rng)
+                elif action < 0.8:
+                    paragraphs.insert(index, paragraph(rng))
+                elif len(paragraphs) > 1:
+                    del paragraphs[index]
+        version = SceneVersion(scene_id=scene.id, version_number=number, title='Scene',
+                               content='\n\n'.join(paragraphs), formatted=formatted_text(paragraphs))
+        db.session.add(version)
+        db.session.flush()
+        scene.current_version_id = version.id
+        db.session.commit()
+    return scene.id
+
+
+def stored_bytes(scene_id):
+    row = db.session.query(
+        func.sum(func.length(SceneVersion._content)),
+        func.sum(func.coalesce(func.length(SceneVersion._formatted), 0)),
+        func.sum(func.coalesce(func.length(SceneVersion.delta), 0)),
+        func.count(SceneVersion.id),
+    ).filter(SceneVersion.scene_id == scene_id).one()
+    content, formatted, delta, count = row
+    return (content + formatted + delta) / count
+
+
+def read_latency(scene_id, samples, cold, seed):
+    rng = random.Random(seed)
+    ids = [version_id for (version_id,) in db.session.query(SceneVersion.id).filter_by(scene_id=scene_id)]
+    timings = []
+    for _ in range(samples):
+        version_id = rng.choice(ids)
+        if cold:
+            reconstruction_cache.clear()
+        db.session.expunge_all()
+        start = time.perf_counter()
+        version = db.session.get(SceneVersion, version_id, options=[undefer_group('body')])
+        version.content, version.formatted
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run(interval, count, size, samples):
+    directory = tempfile.mkdtemp()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    db.init_app(app)
+    versions.init_app(app)
+    versions.SNAPSHOT_INTERVAL = interval
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        scene_id = build_history(count, size, seed=1)
+        write_time = time.perf_counter() - start
+        per_version = stored_bytes(scene_id)
+        cold = read_latency(scene_id, samples, cold=True, seed=2)
+        warm = read_latency(scene_id, samples, cold=False, seed=2)
+        reconstruction_cache.clear()
+        db.session.remove()
+    return per_version, write_time, cold, warm
+
+
+def report(label, per_version, write_time, cold, warm, count):
+    def ms(values):
+        values = sorted(values)
+        return f"p50 {statistics.median(values) * 1000:.2f}ms p95 {values[int(len(values) * 0.95) - 1] * 1000:.2f}ms"
+    print(f"{label:>10}: {per_version:,.0f} bytes/version, write {write_time / count * 1000:.1f}ms/version, "
+          f"cold read {ms(cold)}, warm read {ms(warm)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--versions', type=int, default=300)
+    parser.add_argument('--paragraphs', type=int, default=80)
+    parser.add_argument('--interval', type=int, default=versions.SNAPSHOT_INTERVAL)
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+
+    for label, interval in (('full', 1), ('delta', args.interval)):
+        per_version, write_time, cold, warm = run(interval, args.versions, args.paragraphs, args.samples)
+        report(label, per_version, write_time, cold, warm, args.versions)
+
+
+if __name__ == '__main__':
+    main()
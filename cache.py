@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'llm_cache.db')
+
+
+class ResponseCache:
+    # Two tiers: a small in-process LRU in front of a SQLite table that survives restarts
+    # and is shared between workers on the same host.
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=7 * 24 * 3600, max_entries=10000, hot_entries=256, enabled=True):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hot_entries = hot_entries
+        self.enabled = enabled
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        # Access times of hits not yet written to disk, flushed with the next write or
+        # every 100 hits, so reads don't each commit an UPDATE.
+        self._accessed = {}
+        self._touches = 0
+        self.counters = {"hot_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(function, model, messages, temperature, **params):
+        payload = json.dumps({
+            "function": function,
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "params": params,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _connect(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    function TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key, value, created_at):
+        self._hot[key] = (value, created_at)
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+
+    def _touch(self, key, now):
+        self._accessed[key] = now
+        self._touches += 1
+        if self._touches % 100 == 0:
+            conn = self._connect()
+            self._flush_accessed(conn)
+            conn.commit()
+
+    def _flush_accessed(self, conn):
+        if self._accessed:
+            conn.executemany("UPDATE llm_cache SET accessed_at = ? WHERE key = ?",
+                             [(accessed_at, key) for key, accessed_at in self._accessed.items()])
+            self._accessed.clear()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            hot = self._hot.get(key)
+            if hot is not None:
+                value, created_at = hot
+                if now - created_at <= self.ttl:
+                    self._hot.move_to_end(key)
+                    self._touch(key, now)
+                    self.counters["hot_hits"] += 1
+                    return value
+                del self._hot[key]
+
+            conn = self._connect()
+            row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+                self.counters["misses"] += 1
+                return None
+            self._remember(key, value, created_at)
+            self._touch(key, now)
+            self.counters["disk_hits"] += 1
+            return value
+
+    def set(self, key, value, function=''):
+        if not self.enabled or value is None:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            self._accessed.pop(key, None)
+            self._flush_accessed(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, function, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, function, value, now, now)
+            )
+            self._writes += 1
+            self.counters["writes"] += 1
+            # Eviction is amortised over writes instead of counting rows on every insert.
+            if self._writes % 100 == 0:
+                self._evict(conn, now)
+            conn.commit()
+            self._remember(key, value, now)
+
+    def _evict(self, conn, now):
+        cursor = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        evicted = cursor.rowcount
+        total = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if total > self.max_entries:
+            cursor = conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                (total - self.max_entries,)
+            )
+            evicted += cursor.rowcount
+        self.counters["evictions"] += evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._hot.pop(key, None)
+            self._accessed.pop(key, None)
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._hot.clear()
+            self._accessed.clear()
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["hits"] = stats["hot_hits"] + stats["disk_hits"]
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+            stats["hot_entries"] = len(self._hot)
+            return stats
+
+
+llm_cache = ResponseCache(
+    path=os.environ.get('LLM_CACHE_PATH', DEFAULT_CACHE_PATH),
+    ttl=int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600)),
+    max_entries=int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 10000)),
+    hot_entries=int(os.environ.get('LLM_CACHE_HOT_ENTRIES', 256)),
+    enabled=os.environ.get('LLM_CACHE_ENABLED', '1') != '0',
+)
@@ -0,0 +1,82 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import with_user
+
+ELEMENT_RE = re.compile(
+    r"<(heading|sub-heading|action|character|parenthesis|dialogue|quote|shot)>.*?</\1>",
+    re.DOTALL
+)
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English prose; close enough for budgeting.
+    return len(text or '') // 4 + 1
+
+
+def split_units(text):
+    # Top-level screenplay elements when the text is tagged (a <dialogue> keeps its
+    # character and parenthetical with it), otherwise non-empty lines.
+    units = []
+    position = 0
+    for match in ELEMENT_RE.finditer(text or ''):
+        gap = text[position:match.start()].strip()
+        if gap:
+            units.extend(line.strip() for line in gap.splitlines() if line.strip())
+        units.append(match.group(0))
+        position = match.end()
+    tail = (text or '')[position:].strip()
+    if tail:
+        units.extend(line.strip() for line in tail.splitlines() if line.strip())
+    return units
+
+
+def _split_oversized(unit, budget):
+    pieces = []
+    current = ''
+    for sentence in SENTENCE_RE.split(unit):
+        while estimate_tokens(sentence) > budget:
+            cut = budget * 4
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:]
+        if current and estimate_tokens(current) + estimate_tokens(sentence) > budget:
+            pieces.append(current)
+            current = ''
+        current = f"{current} {sentence}".strip()
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_screenplay(text, budget):
+    if estimate_tokens(text) <= budget:
+        return [text]
+    chunks = []
+    current = []
+    size = 0
+    for unit in split_units(text):
+        cost = estimate_tokens(unit)
+        if cost > budget:
+            if current:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            chunks.extend(_split_oversized(unit, budget))
+            continue
+        # Prefer to start a chunk at a scene heading once the current one is half full.
+        starts_scene = unit.startswith('<heading>') and size > budget // 2
+        if current and (size + cost > budget or starts_scene):
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(unit)
+        size += cost
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def map_chunks(fn, chunks, workers):
+    if len(chunks) == 1:
+        return [fn(chunks[0])]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        return list(pool.map(with_user(fn), chunks))
@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+import httpx
+import openai
+from openai import OpenAI
+
+
+def _build_client(api_key, settings):
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings["pool_size"],
+            max_keepalive_connections=settings["pool_size"],
+            keepalive_expiry=settings["keepalive_expiry"],
+        ),
+        timeout=httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"]),
+    )
+    return OpenAI(
+        api_key=api_key,
+        base_url=settings["base_url"],
+        http_client=http_client,
+        # Retries are handled by ClientRegistry.call so the policy is the same for every endpoint.
+        max_retries=0,
+    )
+
+
+class ClientRegistry:
+    # One OpenAI client per (api key, base url) for the whole process, so keep-alive
+    # connections and TLS sessions are reused across requests and worker threads.
+
+    def __init__(self, base_url=None, pool_size=20, timeout=60.0, connect_timeout=5.0, keepalive_expiry=30.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=20.0, factory=_build_client):
+        self.settings = {
+            "base_url": base_url,
+            "pool_size": pool_size,
+            "timeout": timeout,
+            "connect_timeout": connect_timeout,
+            "keepalive_expiry": keepalive_expiry,
+            "max_retries": max_retries,
+            "backoff_base": backoff_base,
+            "backoff_max": backoff_max,
+        }
+        self.factory = factory
+        # Admission gate every call waits on for a slot; set by admission.init_app.
+        self.gate = None
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key):
+        key = (api_key, self.settings["base_url"])
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self.factory(api_key, self.settings)
+                    self._clients[key] = client
+        return client
+
+    def register(self, api_key, client):
+        with self._lock:
+            self._clients[(api_key, self.settings["base_url"])] = client
+
+    def configure(self, factory=None, **settings):
+        unknown = set(settings) - set(self.settings)
+        if unknown:
+            raise ValueError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+        self.reset()
+        self.settings.update(settings)
+        if factory is not None:
+            self.factory = factory
+
+    def reset(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            close = getattr(client, 'close', None)
+            if close is not None:
+                close()
+
+    def _retry_delay(self, attempt, error):
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.settings["backoff_max"])
+                except ValueError:
+                    pass
+        # Full jitter keeps workers that were throttled together from retrying in lockstep.
+        ceiling = min(self.settings["backoff_max"], self.settings["backoff_base"] * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return False
+
+    def call(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                if self.gate is None:
+                    return fn(*args, **kwargs)
+                # The slot is held for one attempt only, never across the backoff sleep.
+                with self.gate.slot():
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.settings["max_retries"] or not self.is_retryable(e):
+                    raise
+                time.sleep(self._retry_delay(attempt, e))
+                attempt += 1
+
+    def stream(self, fn, *args, **kwargs):
+        # Same retries as call for opening a stream=True request, but the gate slot is
+        # held until the stream is exhausted or closed, since the model keeps generating
+        # while chunks are read.
+        attempt = 0
+        with ExitStack() as held:
+            while True:
+                if self.gate is not None:
+                    held.enter_context(self.gate.slot())
+                try:
+                    response = fn(*args, **kwargs)
+                    break
+                except Exception as e:
+                    held.close()
+                    if attempt >= self.settings["max_retries"] or not self.is_retryable(e):
+                        raise
+                    time.sleep(self._retry_delay(attempt, e))
+                    attempt += 1
+            yield from response
+
+
+openai_clients = ClientRegistry(
+    base_url=os.environ.get('OPENAI_BASE_URL') or None,
+    pool_size=int(os.environ.get('OPENAI_POOL_SIZE', 20)),
+    timeout=float(os.environ.get('OPENAI_TIMEOUT', 60)),
+    connect_timeout=float(os.environ.get('OPENAI_CONNECT_TIMEOUT', 5)),
+    max_retries=int(os.environ.get('OPENAI_MAX_RETRIES', 3)),
+    backoff_base=float(os.environ.get('OPENAI_BACKOFF_BASE', 0.5)),
+    backoff_max=float(os.environ.get('OPENAI_BACKOFF_MAX', 20)),
+)
@@ -0,0 +1,103 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import with_user
+from ai import convert_to_screenplay
+from chunking import estimate_tokens
+
+# Input size of one conversion call. Keeps each formatted block well inside
+# convert_to_screenplay's max_tokens so long scenes are no longer truncated.
+CONVERT_BLOCK_TOKENS = int(os.environ.get('CONVERT_BLOCK_TOKENS', 400))
+CONVERT_WORKERS = int(os.environ.get('CONVERT_WORKERS', 4))
+
+
+def split_paragraphs(content):
+    return [line.strip() for line in (content or '').splitlines() if line.strip()]
+
+
+def paragraph_hash(paragraph):
+    normalized = ' '.join(paragraph.split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+def _match_blocks(hashes, previous_blocks):
+    # Returns a plan of ("reuse", block) and ("convert", [indexes]) steps. A previous
+    # block is reused only when all of its paragraphs appear unchanged and in order.
+    by_first_hash = {}
+    for block in previous_blocks or []:
+        if block.get("hashes") and block.get("formatted"):
+            by_first_hash.setdefault(block["hashes"][0], []).append(block)
+
+    plan = []
+    pending = []
+    i = 0
+    while i < len(hashes):
+        match = None
+        for block in by_first_hash.get(hashes[i], []):
+            if hashes[i:i + len(block["hashes"])] == block["hashes"]:
+                match = block
+                break
+        if match is None:
+            pending.append(i)
+            i += 1
+            continue
+        if pending:
+            plan.append(("convert", pending))
+            pending = []
+        plan.append(("reuse", match))
+        i += len(match["hashes"])
+    if pending:
+        plan.append(("convert", pending))
+    return plan
+
+
+def _pack(indexes, paragraphs):
+    # Splits a run of changed paragraphs into calls of at most CONVERT_BLOCK_TOKENS.
+    chunks = []
+    current = []
+    size = 0
+    for i in indexes:
+        cost = estimate_tokens(paragraphs[i])
+        if current and size + cost > CONVERT_BLOCK_TOKENS:
+            chunks.append(current)
+            current = []
+            size = 0
+        current.append(i)
+        size += cost
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def convert_incremental(content, previous_blocks, api_key, use_cache=True):
+    # Formats only the paragraphs that changed since previous_blocks and stitches them
+    # between the reused blocks. Returns (formatted, blocks); formatted is None on failure.
+    paragraphs = split_paragraphs(content)
+    hashes = [paragraph_hash(p) for p in paragraphs]
+
+    plan = []
+    for step, value in _match_blocks(hashes, previous_blocks):
+        if step == "reuse":
+            plan.append((step, value))
+        else:
+            plan.extend(("convert", chunk) for chunk in _pack(value, paragraphs))
+
+    pending = [indexes for step, indexes in plan if step == "convert"]
+    with ThreadPoolExecutor(max_workers=max(1, min(CONVERT_WORKERS, len(pending)))) as pool:
+        converted = list(pool.map(with_user(
+            lambda indexes: convert_to_screenplay("\n".join(paragraphs[i] for i in indexes), api_key, use_cache=use_cache)),
+            pending
+        ))
+    if any(formatted is None for formatted in converted):
+        return None, None
+
+    results = iter(converted)
+    blocks = []
+    for step, value in plan:
+        if step == "reuse":
+            blocks.append({"hashes": value["hashes"], "formatted": value["formatted"]})
+        else:
+            blocks.append({"hashes": [hashes[i] for i in value], "formatted": next(results)})
+
+    return "\n".join(block["formatted"] for block in blocks), blocks
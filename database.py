@@ -0,0 +1,64 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URL = 'sqlite:///stories.db'
+
+
+def _flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_settings(environ=os.environ):
+    return {
+        "url": environ.get('DATABASE_URL', DEFAULT_DATABASE_URL),
+        "pool_size": int(environ.get('DB_POOL_SIZE', 10)),
+        "max_overflow": int(environ.get('DB_MAX_OVERFLOW', 20)),
+        "pool_timeout": int(environ.get('DB_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(environ.get('DB_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": _flag('DB_POOL_PRE_PING', '1'),
+        "sqlite_tuned": _flag('SQLITE_TUNED', '1'),
+        "sqlite_busy_timeout": int(environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        "sqlite_mmap_size": int(environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    }
+
+
+def engine_options(settings):
+    url = make_url(settings["url"])
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # In-memory databases live in a single connection; pool settings do not apply.
+            return {}
+        return {
+            "pool_size": settings["pool_size"],
+            "max_overflow": settings["max_overflow"],
+            "pool_timeout": settings["pool_timeout"],
+            "pool_pre_ping": settings["pool_pre_ping"],
+            "connect_args": {"timeout": settings["sqlite_busy_timeout"] / 1000},
+        }
+    return {
+        "pool_size": settings["pool_size"],
+        "max_overflow": settings["max_overflow"],
+        "pool_timeout": settings["pool_timeout"],
+        "pool_recycle": settings["pool_recycle"],
+        "pool_pre_ping": settings["pool_pre_ping"],
+    }
+
+
+def sqlite_pragmas(busy_timeout=5000, mmap_size=256 * 1024 * 1024):
+    # WAL lets readers run alongside the single writer, NORMAL sync only fsyncs at
+    # checkpoints, and busy_timeout makes a blocked writer wait instead of failing.
+    def apply(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        cursor.close()
+    return apply
+
+
+def configure_engine(engine, settings):
+    if engine.dialect.name == 'sqlite' and settings["sqlite_tuned"]:
+        event.listen(engine, 'connect', sqlite_pragmas(settings["sqlite_busy_timeout"], settings["sqlite_mmap_size"]))
@@ -0,0 +1,118 @@
+import difflib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+COMPRESS = os.environ.get('VERSION_DELTA_COMPRESS', '1') not in ('0', 'false', 'False', '')
+
+
+def diff_lines(base, text):
+    # Line ops that rebuild text from base: [start, end] copies base lines,
+    # a list of strings inserts new lines. None stays None.
+    if text is None:
+        return None
+    base_lines = (base or '').splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(lines[j1:j2])
+    return ops
+
+
+def patch_lines(base, ops):
+    if ops is None:
+        return None
+    base_lines = (base or '').splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if op and isinstance(op[0], int):
+            parts.extend(base_lines[op[0]:op[1]])
+        else:
+            parts.extend(op)
+    return ''.join(parts)
+
+
+def encode(payload):
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    if COMPRESS:
+        return b'z' + zlib.compress(data, 9)
+    return b'j' + data
+
+
+def decode(blob):
+    data = zlib.decompress(blob[1:]) if blob[:1] == b'z' else blob[1:]
+    return json.loads(data)
+
+
+def make_delta(base, texts):
+    # base and texts are (content, formatted) pairs.
+    return encode({"content": diff_lines(base[0], texts[0]), "formatted": diff_lines(base[1], texts[1])})
+
+
+def apply_delta(base, blob):
+    ops = decode(blob)
+    return patch_lines(base[0], ops["content"]), patch_lines(base[1], ops["formatted"])
+
+
+class ReconstructionCache:
+    # Texts of delta-stored versions. Keys include a checksum of the delta, so an entry
+    # can never outlive the row it was built from.
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            texts = self._entries.get(key)
+            if texts is not None:
+                self._entries.move_to_end(key)
+            return texts
+
+    def set(self, key, texts):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = texts
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+reconstruction_cache = ReconstructionCache(int(os.environ.get('VERSION_CACHE_ENTRIES', 256)))
+
+
+def reconstruct(version, preload=None):
+    # Walks parents back to a full snapshot (or a cached ancestor) and replays the
+    # deltas forward. Works on any object with id, delta, parent, _content and _formatted;
+    # preload is called once on a cache miss to fetch the ancestors in bulk.
+    chain = []
+    node = version
+    texts = None
+    ancestors = None
+    while node.delta is not None:
+        key = (node.id, zlib.crc32(node.delta))
+        texts = reconstruction_cache.get(key)
+        if texts is not None:
+            break
+        if ancestors is None and preload is not None:
+            ancestors = preload()
+        chain.append((node, key))
+        node = node.parent
+    if texts is None:
+        texts = (node._content, node._formatted)
+    for node, key in reversed(chain):
+        texts = apply_delta(texts, node.delta)
+        reconstruction_cache.set(key, texts)
+    return texts
@@ -0,0 +1,387 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import click
+import numpy as np
+from flask.cli import AppGroup
+from numpy.lib.format import open_memmap
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from chunking import estimate_tokens
+from clients import openai_clients
+from metrics import record_model_call
+from models import db, Story, Scene, SceneVersion
+from screenplay import parse_cache, to_plain_text
+from versions import rewritten_scenes
+
+EMBEDDING_MAX_TOKENS = int(os.environ.get('EMBEDDING_MAX_TOKENS', 2000))
+EMBEDDING_BATCH = int(os.environ.get('EMBEDDING_BATCH', 64))
+CHAT_RETRIEVAL_TOKENS = int(os.environ.get('CHAT_RETRIEVAL_TOKENS', 1500))
+CHAT_RETRIEVAL_SCENES = int(os.environ.get('CHAT_RETRIEVAL_SCENES', 4))
+CHAT_RETRIEVAL_MIN_SCORE = float(os.environ.get('CHAT_RETRIEVAL_MIN_SCORE', 0.2))
+WORD_RE = re.compile(r"[\w']+")
+
+
+class OpenAIEmbedder:
+    name = 'openai'
+
+    def __init__(self, model=None, dimensions=None):
+        self.model = model or os.environ.get('EMBEDDING_MODEL', 'text-embedding-3-small')
+        self.dimensions = dimensions or int(os.environ.get('EMBEDDING_DIMENSIONS', 512))
+
+    def __call__(self, texts, api_key):
+        client = openai_clients.get(api_key)
+        start = time.perf_counter()
+        response = openai_clients.call(client.embeddings.create, input=texts, model=self.model, dimensions=self.dimensions)
+        record_model_call("embed", self.model, time.perf_counter() - start)
+        return np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype=np.float32)
+
+
+class HashingEmbedder:
+    # Stand-in for tests and offline development: signed feature hashing of words and
+    # word pairs. Deterministic across processes, and texts sharing vocabulary score higher.
+    name = 'hashing'
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def __call__(self, texts, api_key=None):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = WORD_RE.findall(text.lower())
+            for feature in chain(words, map(' '.join, zip(words, words[1:]))):
+                value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                matrix[row, value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        return matrix
+
+
+EMBEDDERS = {
+    'openai': OpenAIEmbedder,
+    'hashing': HashingEmbedder,
+}
+
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class UserVectors:
+    # One user's scenes as rows of two memory-mapped .npy files: vectors (float32,
+    # unit length, so a dot product is the cosine) and ids (scene_id, text digest).
+    # scene_id 0 marks a free row. Rows are looked up in the mapped ids on every call,
+    # so rows another process fills in place are seen at once; growing replaces both
+    # files, which other processes notice by the new inode of ids.npy and reopen.
+
+    def __init__(self, directory, dimensions):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.vectors = None
+        self.ids = None
+        self._identity = None
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        try:
+            stat = os.stat(self._path('ids.npy'))
+        except FileNotFoundError:
+            self.vectors, self.ids, self._identity = None, None, None
+            return
+        if (stat.st_ino, stat.st_size) == self._identity:
+            return
+        self.vectors = np.load(self._path('vectors.npy'), mmap_mode='r+')
+        self.ids = np.load(self._path('ids.npy'), mmap_mode='r+')
+        self._identity = (stat.st_ino, stat.st_size)
+
+    def _grow(self):
+        capacity = max(16, 2 * (len(self.ids) if self.ids is not None else 0))
+        os.makedirs(self.directory, exist_ok=True)
+        for name, shape, dtype, old in (('vectors.npy', (capacity, self.dimensions), np.float32, self.vectors),
+                                        ('ids.npy', (capacity, 2), np.int64, self.ids)):
+            partial = self._path(name + '.part')
+            array = open_memmap(partial, mode='w+', dtype=dtype, shape=shape)
+            if old is not None:
+                array[:len(old)] = old
+            array.flush()
+            del array
+            os.replace(partial, self._path(name))
+        self._identity = None
+        self._load()
+
+    def _locked(self):
+        # Serializes writers across threads, and across processes where flock exists.
+        return _FileLock(self._path('lock'), self._lock)
+
+    def _row(self, scene_id):
+        if self.ids is None:
+            return None
+        rows = np.flatnonzero(self.ids[:, 0] == scene_id)
+        return int(rows[0]) if len(rows) else None
+
+    def upsert(self, scene_id, digest, vector):
+        with self._locked():
+            self._load()
+            row = self._row(scene_id)
+            if row is None:
+                row = self._row(0)
+                if row is None:
+                    self._grow()
+                    row = self._row(0)
+            self.vectors[row] = vector
+            self.ids[row] = (scene_id, digest)
+
+    def remove(self, scene_id):
+        with self._locked():
+            self._load()
+            row = self._row(scene_id)
+            if row is not None:
+                self.vectors[row] = 0
+                self.ids[row] = 0
+
+    def get(self, scene_id):
+        self._load()
+        row = self._row(scene_id)
+        if row is None:
+            return None
+        return np.array(self.vectors[row]), int(self.ids[row, 1])
+
+    def top_k(self, queries, k, exclude=()):
+        # One matrix product for the whole batch; argpartition avoids sorting every row.
+        # Returns, per query, [(scene_id, score)] best first.
+        self._load()
+        if self.ids is None:
+            return [[] for _ in queries]
+        scene_ids = np.array(self.ids[:, 0])
+        invalid = (scene_ids == 0) | np.isin(scene_ids, list(exclude))
+        scores = np.asarray(self.vectors) @ np.asarray(queries, dtype=np.float32).T
+        scores[invalid] = -np.inf
+        k = min(k, int(np.count_nonzero(~invalid)))
+        results = []
+        for column in scores.T:
+            if k <= 0:
+                results.append([])
+                continue
+            best = np.argpartition(-column, k - 1)[:k]
+            best = best[np.argsort(-column[best])]
+            results.append([(int(scene_ids[row]), float(column[row])) for row in best])
+        return results
+
+
+class _FileLock:
+    def __init__(self, path, lock):
+        self.path = path
+        self.lock = lock
+        self.handle = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.handle = open(self.path, 'a')
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+        self.lock.release()
+
+
+def text_digest(text):
+    # Signed 64 bits, to fit the int64 ids file.
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def scene_text(version):
+    text = to_plain_text(parse_cache.get(version)) if version.formatted else version.content
+    text = f"{version.title}\n{text or ''}"
+    # Cheap cap before the model sees it; the estimate is about four characters a token.
+    if estimate_tokens(text) > EMBEDDING_MAX_TOKENS:
+        text = text[:EMBEDDING_MAX_TOKENS * 4]
+    return text
+
+
+class EmbeddingIndex:
+    # Vectors of each scene's current version, written after the transaction that
+    # changed it commits (on a single background thread unless EMBEDDING_ASYNC is off).
+
+    def __init__(self):
+        self.embedder = None
+        self.directory = None
+        self.api_key = None
+        self.asynchronous = True
+        self.executor = None
+        self._users = {}
+        self._lock = threading.Lock()
+        self._futures = []
+
+    def init_app(self, app):
+        self.embedder = EMBEDDERS[app.config.get('EMBEDDING_PROVIDER', 'openai')]()
+        # Vectors from different providers or sizes are not comparable, so each gets its own directory.
+        self.directory = os.path.join(app.instance_path, 'embeddings', f"{self.embedder.name}-{self.embedder.dimensions}")
+        self.api_key = app.config.get('API_KEY')
+        self.asynchronous = app.config.get('EMBEDDING_ASYNC', True)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embed')
+        event.listen(db.session, 'after_flush', _after_flush)
+        event.listen(db.session, 'after_commit', _after_commit)
+        event.listen(db.session, 'after_rollback', _after_rollback)
+        app.cli.add_command(embeddings_cli)
+
+    def vectors(self, user_id):
+        with self._lock:
+            vectors = self._users.get(user_id)
+            if vectors is None:
+                vectors = self._users[user_id] = UserVectors(
+                    os.path.join(self.directory, f"user_{user_id}"), self.embedder.dimensions)
+            return vectors
+
+    def embed(self, texts):
+        matrices = [self.embedder(texts[i:i + EMBEDDING_BATCH], self.api_key) for i in range(0, len(texts), EMBEDDING_BATCH)]
+        return normalize(np.concatenate(matrices)) if matrices else np.zeros((0, self.embedder.dimensions), np.float32)
+
+    def index(self, items):
+        # items are (user_id, scene_id, text). Freshness goes by the text rather than the
+        # version id, since re-conversion rewrites the current version in place; scenes
+        # whose stored vector came from the same text are skipped.
+        items = [(user_id, scene_id, text, text_digest(text)) for user_id, scene_id, text in items]
+        items = [item for item in items if (self.vectors(item[0]).get(item[1]) or (None, None))[1] != item[3]]
+        if not items:
+            return 0
+        for (user_id, scene_id, _, digest), vector in zip(items, self.embed([item[2] for item in items])):
+            self.vectors(user_id).upsert(scene_id, digest, vector)
+        return len(items)
+
+    def remove(self, removals):
+        for user_id, scene_id in removals:
+            self.vectors(user_id).remove(scene_id)
+
+    def _apply(self, items, removals):
+        try:
+            self.index(items)
+            self.remove(removals)
+        except Exception as e:
+            print(f"Could not update embeddings: {e}")
+
+    def submit(self, items, removals):
+        if not self.asynchronous:
+            self._apply(items, removals)
+            return
+        with self._lock:
+            self._futures = [future for future in self._futures if not future.done()]
+            self._futures.append(self.executor.submit(self._apply, items, removals))
+
+    def wait(self):
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.result()
+
+    def search(self, user_id, texts, k, exclude=()):
+        return self.vectors(user_id).top_k(self.embed(texts), k, exclude)
+
+    def similar(self, user_id, scene_id, k):
+        stored = self.vectors(user_id).get(scene_id)
+        if stored is None:
+            return None
+        return self.vectors(user_id).top_k(stored[0][None, :], k, exclude=(scene_id,))[0]
+
+    def relevant_scenes(self, user_id, query, budget=CHAT_RETRIEVAL_TOKENS, k=CHAT_RETRIEVAL_SCENES):
+        # Best matching scenes for a chat message, as text blocks that fit the token
+        # budget together. Retrieval failures only cost the context, never the reply.
+        if self.embedder is None:
+            return []
+        try:
+            hits = [hit for hit in self.search(user_id, [query], k)[0] if hit[1] >= CHAT_RETRIEVAL_MIN_SCORE]
+        except Exception as e:
+            print(f"Could not retrieve scenes: {e}")
+            return []
+        if not hits:
+            return []
+        # Current versions are always stored in full, so their columns can be read directly.
+        rows = (db.session.query(Scene.id, Story.title, SceneVersion.title, SceneVersion.formatted, SceneVersion.content)
+                .join(Story, Story.id == Scene.story_id)
+                .join(SceneVersion, SceneVersion.id == Scene.current_version_id)
+                .filter(Scene.id.in_([scene_id for scene_id, _ in hits]), Story.user_id == user_id)
+                .all())
+        found = {row[0]: row[1:] for row in rows}
+        blocks = []
+        for scene_id, _ in hits:
+            if scene_id not in found:
+                continue
+            story_title, title, formatted, content = found[scene_id]
+            block = f"Story \"{story_title}\", scene \"{title}\":\n{formatted or content}"
+            remaining = budget - sum(estimate_tokens(existing) for existing in blocks)
+            if remaining <= 50:
+                break
+            if estimate_tokens(block) > remaining:
+                block = block[:remaining * 4].rsplit('\n', 1)[0]
+            blocks.append(block)
+        return blocks
+
+    def rebuild(self, user_id=None):
+        query = (db.session.query(Story.user_id, Scene)
+                 .join(Scene, Scene.story_id == Story.id)
+                 .options(joinedload(Scene.current_version).undefer_group('body'))
+                 .filter(Scene.current_version_id.isnot(None)))
+        if user_id is not None:
+            query = query.filter(Story.user_id == user_id)
+        items = [(owner, scene.id, scene_text(scene.current_version)) for owner, scene in query]
+        return self.index(items)
+
+
+embedding_index = EmbeddingIndex()
+
+
+def _after_flush(session, flush_context):
+    # Texts are captured here, while the objects are at hand, and handed to the index
+    # only once the transaction commits.
+    pending = session.info.setdefault('embeddings', {"items": [], "removals": []})
+    with session.no_autoflush:
+        for scene in rewritten_scenes(session):
+            story = session.get(Story, scene.story_id)
+            if story is None or not scene.current_version_id:
+                continue
+            version = session.get(SceneVersion, scene.current_version_id)
+            pending["items"].append((story.user_id, scene.id, scene_text(version)))
+        for obj in session.deleted:
+            if isinstance(obj, Scene):
+                story = session.get(Story, obj.story_id)
+                if story is not None:
+                    pending["removals"].append((story.user_id, obj.id))
+
+
+def _after_commit(session):
+    pending = session.info.pop('embeddings', None)
+    if pending and (pending["items"] or pending["removals"]):
+        embedding_index.submit(pending["items"], pending["removals"])
+
+
+def _after_rollback(session):
+    session.info.pop('embeddings', None)
+
+
+embeddings_cli = AppGroup('embeddings', help="Scene embedding index.")
+
+
+@embeddings_cli.command('rebuild')
+@click.option('--user', 'user_id', type=int, help="Only this user's scenes.")
+def rebuild_command(user_id):
+    count = embedding_index.rebuild(user_id)
+    click.echo(f"Embedded {count} scenes")
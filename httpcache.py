@@ -0,0 +1,146 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from itertools import chain
+
+from flask import current_app, request
+from pytz import timezone
+from sqlalchemy import event
+
+from models import db, Story, Scene, SceneVersion, StoryStats
+
+
+class ResponseStore:
+    # In-process LRU of serialized bodies keyed by ETag. Each entry carries tags
+    # ("scene:<id>", "user:<id>") so a write can drop everything derived from the rows
+    # it touched. Keys already embed the validators, so entries cached by another
+    # process can never be served for newer data either.
+
+    def __init__(self, max_entries=0):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, key):
+        if not self.max_entries:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def set(self, key, body, tags=()):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (body, tuple(tags))
+            self._entries.move_to_end(key)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, (_, old_tags) = self._entries.popitem(last=False)
+                self._forget(old_key, old_tags)
+
+    def _forget(self, key, tags):
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    entry = self._entries.pop(key, None)
+                    if entry is not None:
+                        self._forget(key, entry[1])
+                        self.counters["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+
+def make_etag(*parts):
+    payload = json.dumps(parts, default=str, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def _now():
+    return datetime.now(timezone("Asia/Kolkata"))
+
+
+def _before_flush(session, flush_context, instances):
+    # Editing a version in place (re-conversion) does not touch the scene row, so bump
+    # the scene's updated_at here; the scene validators then cover its versions too.
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, SceneVersion) and obj.scene_id is not None and session.is_modified(obj):
+            with session.no_autoflush:
+                scene = session.get(Scene, obj.scene_id)
+            if scene is not None:
+                scene.updated_at = _now()
+
+
+def _after_flush(session, flush_context):
+    tags = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Scene):
+            tags.add(f"scene:{obj.id}")
+        elif isinstance(obj, SceneVersion):
+            tags.add(f"scene:{obj.scene_id}")
+        elif isinstance(obj, Story):
+            tags.add(f"user:{obj.user_id}")
+        elif isinstance(obj, StoryStats):
+            tags.add(f"story:{obj.story_id}")
+    if tags:
+        http_cache.store.invalidate(tags)
+
+
+class HTTPCache:
+    # Conditional GETs: a strong ETag is derived from cheap validators (ids, version ids,
+    # updated_at) before the body is built, so a matching If-None-Match costs one small
+    # query and returns 304 without serializing anything.
+
+    def __init__(self):
+        self.max_age = 0
+        self.store = ResponseStore()
+
+    def init_app(self, app):
+        self.max_age = app.config.get('HTTP_CACHE_MAX_AGE', 0)
+        self.store = ResponseStore(app.config.get('RESPONSE_CACHE_ENTRIES', 0))
+        event.listen(db.session, 'before_flush', _before_flush)
+        event.listen(db.session, 'after_flush', _after_flush)
+
+    def json_response(self, validators, build, tags=()):
+        # view_args name the resource (a version number, say) even when the validators
+        # are the same for all of them.
+        etag = make_etag(request.endpoint, sorted((request.view_args or {}).items()),
+                         request.query_string.decode('utf-8'), *validators)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            body = self.store.get(etag)
+            if body is None:
+                body = current_app.json.dumps(build())
+                self.store.set(etag, body, tags)
+            response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # Responses are per user, so shared caches must not keep them; max-age 0 makes
+        # browsers revalidate on every poll.
+        response.headers['Cache-Control'] = f"private, max-age={self.max_age}, must-revalidate"
+        response.vary.add('Authorization')
+        return response
+
+
+http_cache = HTTPCache()
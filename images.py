@@ -0,0 +1,84 @@
+import hashlib
+import os
+import tempfile
+
+import requests
+from PIL import Image
+
+# Served from the static folder, so this stays under static/.
+IMAGE_DIR = 'static/generated_images'
+IMAGE_CHUNK_SIZE = int(os.environ.get('IMAGE_CHUNK_SIZE', 64 * 1024))
+IMAGE_DOWNLOAD_TIMEOUT = int(os.environ.get('IMAGE_DOWNLOAD_TIMEOUT', 60))
+THUMBNAIL_SIZE = int(os.environ.get('IMAGE_THUMBNAIL_SIZE', 320))
+THUMBNAIL_QUALITY = int(os.environ.get('IMAGE_THUMBNAIL_QUALITY', 80))
+
+EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+}
+
+
+def download_image(url, directory=IMAGE_DIR):
+    # Streams the body to a temporary file while hashing it, then moves it to
+    # <sha256>.<ext>. Identical bytes always land on the same file, so a second copy
+    # is simply discarded. Returns the stored filename.
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    digest = hashlib.sha256()
+    with requests.get(url, stream=True, timeout=IMAGE_DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(IMAGE_CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    filename = f"{digest.hexdigest()}.{EXTENSIONS.get(content_type, 'png')}"
+    path = os.path.join(directory, filename)
+    if os.path.exists(path):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, path)
+    return filename
+
+
+def thumbnail_name(filename):
+    return f"{os.path.splitext(filename)[0]}_thumb.webp"
+
+
+def make_thumbnail(filename, directory=IMAGE_DIR, size=THUMBNAIL_SIZE):
+    # WebP thumbnail next to the original; a few KB instead of a 1-2 MB DALL-E PNG.
+    # Returns None when the file cannot be decoded so callers fall back to the original.
+    name = thumbnail_name(filename)
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        return name
+    temp_path = None
+    try:
+        with Image.open(os.path.join(directory, filename)) as image:
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        os.replace(temp_path, path)
+    except Exception as e:
+        print(f"Could not create thumbnail for {filename}: {e}")
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+    return name
+
+
+def store_image(url, directory=IMAGE_DIR):
+    # Returns (filename, thumbnail filename or None).
+    filename = download_image(url, directory)
+    return filename, make_thumbnail(filename, directory)
@@ -0,0 +1,125 @@
+import json
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pytz import timezone
+
+from admission import current_user
+from models import db, Job
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    # Runs slow AI work on a bounded thread pool. Job state lives in the job table so any
+    # web worker can answer /api/jobs/<id>; the callables themselves only live in this process.
+
+    def __init__(self):
+        self.app = None
+        self.executor = None
+        self.max_pending = 0
+        self.stale_after = 120
+        self.heartbeat = 30
+        # Marks this process's rows, so its heartbeat keeps exactly its own jobs fresh.
+        self.worker_id = uuid.uuid4().hex
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat_thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.max_pending = app.config.get('JOB_MAX_PENDING', 100)
+        self.stale_after = app.config.get('JOB_STALE_AFTER', 120)
+        self.heartbeat = app.config.get('JOB_HEARTBEAT', 30)
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config.get('JOB_WORKERS', 4),
+            thread_name_prefix='job'
+        )
+        app.extensions['job_queue'] = self
+
+    def fail_stale(self):
+        # Jobs left queued or running by a process that died can never finish. Every live
+        # process touches its own jobs each heartbeat, so only rows nobody has touched for
+        # stale_after are failed, never a sibling's live jobs.
+        cutoff = datetime.now(timezone("Asia/Kolkata")) - timedelta(seconds=self.stale_after)
+        Job.query.filter(Job.status.in_(['queued', 'running']), Job.updated_at < cutoff).update(
+            {"status": "failed", "error": "Interrupted before completion"},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+    def touch(self):
+        Job.query.filter(Job.worker_id == self.worker_id, Job.status.in_(['queued', 'running'])).update(
+            {"updated_at": datetime.now(timezone("Asia/Kolkata"))},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+    def start_heartbeat(self):
+        # Runs the stale sweep periodically rather than only at startup, so jobs of a
+        # process that died are failed even when nothing restarts.
+        if self._heartbeat_thread is None:
+            self._heartbeat_thread = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.heartbeat):
+            try:
+                with self.app.app_context():
+                    self.touch()
+                    self.fail_stale()
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+
+    def submit(self, kind, user_id, fn, *args, base_url=None, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"Job queue is full ({self.max_pending} pending)")
+            self._pending += 1
+
+        job = Job(id=uuid.uuid4().hex, user_id=user_id, kind=kind, status='queued', worker_id=self.worker_id)
+        db.session.add(job)
+        db.session.commit()
+        try:
+            self.executor.submit(self._run, job.id, user_id, base_url, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job
+
+    def _run(self, job_id, user_id, base_url, fn, args, kwargs):
+        # A request context (rather than a bare app context) lets url_for(_external=True)
+        # build the same absolute URLs the synchronous routes return.
+        # The job's model calls queue for a slot under its owner, like the request's would have.
+        token = current_user.set(user_id)
+        try:
+            with self.app.test_request_context(base_url=base_url):
+                job = db.session.get(Job, job_id)
+                job.status = 'running'
+                db.session.commit()
+                try:
+                    result = fn(*args, **kwargs)
+                    job = db.session.get(Job, job_id)
+                    job.result = json.dumps(result)
+                    job.status = 'done'
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    traceback.print_exc()
+                    job = db.session.get(Job, job_id)
+                    job.status = 'failed'
+                    job.error = str(e)
+                    db.session.commit()
+        finally:
+            current_user.reset(token)
+            with self._lock:
+                self._pending -= 1
+
+
+job_queue = JobQueue()
@@ -0,0 +1,198 @@
+import functools
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_seconds = registry.histogram(
+    'http_request_duration_seconds', 'Wall time per route.', ('method', 'endpoint', 'status'))
+db_queries_per_request = registry.histogram(
+    'db_queries_per_request', 'SQL statements executed per request.', ('endpoint',),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250))
+db_query_seconds = registry.histogram(
+    'db_query_duration_seconds', 'Time per SQL statement.', ('endpoint',))
+ai_function_seconds = registry.histogram(
+    'ai_function_duration_seconds', 'Wall time per AI function, including chunking and cache lookups.', ('function', 'outcome'))
+ai_request_seconds = registry.histogram(
+    'ai_request_duration_seconds', 'Wall time per model call.', ('function', 'model', 'cache'))
+ai_tokens = registry.counter(
+    'ai_tokens_total', 'Tokens reported by the model API.', ('function', 'model', 'type'))
+
+
+def _request_stats():
+    # Only requests that went through before_request carry stats; job threads run in a
+    # bare test_request_context and are recorded under "background".
+    if has_request_context():
+        return g.get('_metrics')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's execution context, which is dropped whether or not the
+    # statement succeeds; a failed statement never reaches after_cursor_execute.
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    stats = _request_stats()
+    if stats is None:
+        db_query_seconds.observe(elapsed, endpoint='background')
+        return
+    stats['db_count'] += 1
+    stats['db_time'] += elapsed
+    db_query_seconds.observe(elapsed, endpoint=request.endpoint or 'unknown')
+
+
+def timed(function):
+    # Times an AI entry point. Calls made on the request thread also add to the
+    # request's "ai" Server-Timing entry; nested calls are only counted once.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            stats = _request_stats()
+            outer = stats is not None and not stats['ai_depth']
+            if stats is not None:
+                stats['ai_depth'] += 1
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = fn(*args, **kwargs)
+                outcome = 'ok' if result is not None else 'error'
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                ai_function_seconds.observe(elapsed, function=function, outcome=outcome)
+                if stats is not None:
+                    stats['ai_depth'] -= 1
+                    if outer:
+                        stats['ai_time'] += elapsed
+        return wrapper
+    return decorator
+
+
+def record_model_call(function, model, elapsed, usage=None, cache='miss'):
+    ai_request_seconds.observe(elapsed, function=function, model=model, cache=cache)
+    if usage is not None:
+        ai_tokens.inc(usage.prompt_tokens or 0, function=function, model=model, type='prompt')
+        ai_tokens.inc(usage.completion_tokens or 0, function=function, model=model, type='completion')
+
+
+def init_app(app):
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        g._metrics = {'start': time.perf_counter(), 'db_count': 0, 'db_time': 0.0, 'ai_time': 0.0, 'ai_depth': 0}
+
+    @app.after_request
+    def record_request(response):
+        stats = g.pop('_metrics', None)
+        if stats is None:
+            return response
+        elapsed = time.perf_counter() - stats['start']
+        endpoint = request.endpoint or 'unknown'
+        http_request_seconds.observe(elapsed, method=request.method, endpoint=endpoint, status=response.status_code)
+        db_queries_per_request.observe(stats['db_count'], endpoint=endpoint)
+        if app.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = ', '.join([
+                f'db;dur={stats["db_time"] * 1000:.1f};desc="{stats["db_count"]} queries"',
+                f'ai;dur={stats["ai_time"] * 1000:.1f}',
+                f'app;dur={elapsed * 1000:.1f}',
+            ])
+        return response
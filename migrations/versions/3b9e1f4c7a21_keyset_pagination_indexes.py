@@ -0,0 +1,28 @@
+"""keyset pagination indexes
+
+Revision ID: 3b9e1f4c7a21
+Revises: df788fc24edf
+Create Date: 2026-10-18 19:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9e1f4c7a21'
+down_revision = 'df788fc24edf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_story_user_id_id', 'story', ['user_id', 'id'], if_not_exists=True)
+    op.create_index('ix_scene_story_id_id', 'scene', ['story_id', 'id'], if_not_exists=True)
+    op.create_index('ix_conversations_user_id_id', 'conversations', ['user_id', 'id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_conversations_user_id_id', table_name='conversations', if_exists=True)
+    op.drop_index('ix_scene_story_id_id', table_name='scene', if_exists=True)
+    op.drop_index('ix_story_user_id_id', table_name='story', if_exists=True)
@@ -0,0 +1,69 @@
+"""store scene sentiment as json
+
+Revision ID: 5e7a0c3d9b42
+Revises: 8c2d5a9e0f13
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import json
+import pickle
+
+import emoji
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7a0c3d9b42'
+down_revision = '8c2d5a9e0f13'
+branch_labels = None
+depends_on = None
+
+
+def _scene_columns():
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scene')}
+
+
+def upgrade():
+    bind = op.get_bind()
+    columns = _scene_columns()
+    if 'sentiment' not in columns:
+        with op.batch_alter_table('scene') as batch_op:
+            batch_op.add_column(sa.Column('sentiment', sa.JSON(), nullable=True))
+
+    if 'emoji' in columns:
+        rows = bind.execute(sa.text(
+            "SELECT id, emoji, emoji_name FROM scene WHERE emoji IS NOT NULL"
+        )).all()
+        for scene_id, emojis, names in rows:
+            emojis = pickle.loads(emojis)
+            names = pickle.loads(names) if names is not None else []
+            sentiment = [
+                {"emoji": emoji.emojize(value), "emoji_name": names[i] if i < len(names) else None}
+                for i, value in enumerate(emojis)
+            ]
+            bind.execute(sa.text("UPDATE scene SET sentiment = :sentiment WHERE id = :id"),
+                         {"sentiment": json.dumps(sentiment), "id": scene_id})
+
+        with op.batch_alter_table('scene') as batch_op:
+            batch_op.drop_column('emoji_name')
+            batch_op.drop_column('emoji')
+
+
+def downgrade():
+    bind = op.get_bind()
+    with op.batch_alter_table('scene') as batch_op:
+        batch_op.add_column(sa.Column('emoji', sa.PickleType(), nullable=True))
+        batch_op.add_column(sa.Column('emoji_name', sa.PickleType(), nullable=True))
+
+    rows = bind.execute(sa.text("SELECT id, sentiment FROM scene WHERE sentiment IS NOT NULL")).all()
+    for scene_id, sentiment in rows:
+        items = json.loads(sentiment) if isinstance(sentiment, str) else sentiment
+        bind.execute(sa.text("UPDATE scene SET emoji = :emoji, emoji_name = :emoji_name WHERE id = :id"), {
+            "emoji": pickle.dumps([item["emoji"] for item in items]),
+            "emoji_name": pickle.dumps([item["emoji_name"] for item in items]),
+            "id": scene_id,
+        })
+
+    with op.batch_alter_table('scene') as batch_op:
+        batch_op.drop_column('sentiment')
@@ -0,0 +1,53 @@
+"""foreign key indexes and integer conversations.user_id
+
+Revision ID: 8c2d5a9e0f13
+Revises: 3b9e1f4c7a21
+Create Date: 2026-10-18 19:55:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2d5a9e0f13'
+down_revision = '3b9e1f4c7a21'
+branch_labels = None
+depends_on = None
+
+
+# story.user_id, scene.story_id and conversations.user_id are the leading columns of the
+# (fk, id) indexes from 3b9e1f4c7a21, and scene_version.scene_id leads the unique index
+# below, so every foreign-key lookup is already index-backed without single-column copies.
+
+def upgrade():
+    bind = op.get_bind()
+
+    # Old rows were numbered from global row ids; renumber any scene whose numbers collide
+    # so the unique index can be built.
+    duplicates = bind.execute(sa.text(
+        "SELECT DISTINCT scene_id FROM scene_version GROUP BY scene_id, version_number HAVING COUNT(*) > 1"
+    )).scalars().all()
+    for scene_id in duplicates:
+        version_ids = bind.execute(sa.text(
+            "SELECT id FROM scene_version WHERE scene_id = :scene_id ORDER BY id"
+        ), {"scene_id": scene_id}).scalars().all()
+        for number, version_id in enumerate(version_ids, start=1):
+            bind.execute(sa.text(
+                "UPDATE scene_version SET version_number = :number WHERE id = :id"
+            ), {"number": number, "id": version_id})
+
+    op.create_index('uq_scene_version_scene_id_version_number', 'scene_version',
+                    ['scene_id', 'version_number'], unique=True, if_not_exists=True)
+
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.String(length=50), type_=sa.Integer(),
+                              existing_nullable=False, postgresql_using='user_id::integer')
+
+
+def downgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), type_=sa.String(length=50),
+                              existing_nullable=False)
+
+    op.drop_index('uq_scene_version_scene_id_version_number', table_name='scene_version', if_exists=True)
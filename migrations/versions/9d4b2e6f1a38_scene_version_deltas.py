@@ -0,0 +1,96 @@
+"""store superseded scene versions as deltas
+
+Revision ID: 9d4b2e6f1a38
+Revises: f5c1a7e3d260
+Create Date: 2026-10-18 23:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import os
+
+from deltas import make_delta, apply_delta
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4b2e6f1a38'
+down_revision = 'f5c1a7e3d260'
+branch_labels = None
+depends_on = None
+
+
+def _version_columns():
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scene_version')}
+
+
+def _scene_versions(bind):
+    current = dict(bind.execute(sa.text("SELECT id, current_version_id FROM scene")).all())
+    rows = bind.execute(sa.text(
+        "SELECT id, scene_id, content, formatted, parent_id, depth, delta FROM scene_version ORDER BY scene_id, id"
+    )).all()
+    by_scene = {}
+    for row in rows:
+        by_scene.setdefault(row.scene_id, []).append(row)
+    return current, by_scene
+
+
+def upgrade():
+    columns = _version_columns()
+    with op.batch_alter_table('scene_version') as batch_op:
+        if 'parent_id' not in columns:
+            batch_op.add_column(sa.Column('parent_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_scene_version_parent_id', 'scene_version', ['parent_id'], ['id'])
+        if 'depth' not in columns:
+            batch_op.add_column(sa.Column('depth', sa.Integer(), nullable=False, server_default='0'))
+        if 'delta' not in columns:
+            batch_op.add_column(sa.Column('delta', sa.LargeBinary(), nullable=True))
+
+    # Compact existing history: each scene's versions in id order form one chain, and
+    # every version except the current one becomes a delta against the previous one,
+    # keeping a full snapshot every VERSION_SNAPSHOT_INTERVAL versions.
+    interval = int(os.environ.get('VERSION_SNAPSHOT_INTERVAL', 16))
+    bind = op.get_bind()
+    current, by_scene = _scene_versions(bind)
+    for scene_id, rows in by_scene.items():
+        if any(row.parent_id is not None or row.delta is not None for row in rows):
+            continue
+        previous = None
+        depth = 0
+        for row in rows:
+            texts = (row.content, row.formatted)
+            values = {"id": row.id, "parent_id": previous[0] if previous else None}
+            delta = None
+            if previous is not None and row.id != current.get(scene_id) and depth + 1 < interval:
+                delta = make_delta(previous[1], texts)
+                if len(delta) >= len(texts[0] or '') + len(texts[1] or ''):
+                    delta = None
+            depth = depth + 1 if delta is not None else 0
+            if delta is None:
+                bind.execute(sa.text(
+                    "UPDATE scene_version SET parent_id = :parent_id, depth = 0 WHERE id = :id"), values)
+            else:
+                bind.execute(sa.text(
+                    "UPDATE scene_version SET parent_id = :parent_id, depth = :depth, delta = :delta, "
+                    "content = '', formatted = NULL, blocks = NULL WHERE id = :id"),
+                    dict(values, depth=depth, delta=delta))
+            previous = (row.id, texts)
+
+
+def downgrade():
+    bind = op.get_bind()
+    _, by_scene = _scene_versions(bind)
+    for rows in by_scene.values():
+        texts = {}
+        for row in rows:
+            if row.delta is None:
+                texts[row.id] = (row.content, row.formatted)
+                continue
+            texts[row.id] = apply_delta(texts[row.parent_id], row.delta)
+            bind.execute(sa.text("UPDATE scene_version SET content = :content, formatted = :formatted WHERE id = :id"),
+                         {"content": texts[row.id][0], "formatted": texts[row.id][1], "id": row.id})
+
+    with op.batch_alter_table('scene_version') as batch_op:
+        batch_op.drop_constraint('fk_scene_version_parent_id', type_='foreignkey')
+        batch_op.drop_column('delta')
+        batch_op.drop_column('depth')
+        batch_op.drop_column('parent_id')
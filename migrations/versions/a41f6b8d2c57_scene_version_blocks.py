@@ -0,0 +1,28 @@
+"""per-paragraph conversion blocks on scene_version
+
+Revision ID: a41f6b8d2c57
+Revises: 5e7a0c3d9b42
+Create Date: 2026-10-18 20:25:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f6b8d2c57'
+down_revision = '5e7a0c3d9b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scene_version')}
+    if 'blocks' not in columns:
+        with op.batch_alter_table('scene_version') as batch_op:
+            batch_op.add_column(sa.Column('blocks', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('scene_version') as batch_op:
+        batch_op.drop_column('blocks')
@@ -0,0 +1,32 @@
+"""add the fts5 search index
+
+Revision ID: b7e3c9d14f62
+Revises: 9d4b2e6f1a38
+Create Date: 2026-10-19 00:10:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3c9d14f62'
+down_revision = '9d4b2e6f1a38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask search rebuild`; kept current on every write after that.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "ref, kind, title, character, body, story_id UNINDEXED, scene_id UNINDEXED, "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TABLE IF EXISTS search_index")
@@ -0,0 +1,33 @@
+"""record which scene version each analysis was computed from
+
+Revision ID: c6d3e8a1f094
+Revises: a41f6b8d2c57
+Create Date: 2026-10-18 20:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6d3e8a1f094'
+down_revision = 'a41f6b8d2c57'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('score_version_id', 'sentiment_version_id', 'summary_version_id')
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scene')}
+    missing = [name for name in COLUMNS if name not in existing]
+    if missing:
+        with op.batch_alter_table('scene') as batch_op:
+            for name in missing:
+                batch_op.add_column(sa.Column(name, sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('scene') as batch_op:
+        for name in reversed(COLUMNS):
+            batch_op.drop_column(name)
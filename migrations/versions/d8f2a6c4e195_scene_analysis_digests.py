@@ -0,0 +1,62 @@
+"""record a digest of the text each analysis was computed from
+
+Revision ID: d8f2a6c4e195
+Revises: b7e3c9d14f62
+Create Date: 2026-10-19 10:20:00.000000
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f2a6c4e195'
+down_revision = 'b7e3c9d14f62'
+branch_labels = None
+depends_on = None
+
+# (digest column, version column, source column on scene_version)
+ANALYSES = (
+    ('score_digest', 'score_version_id', 'content'),
+    ('sentiment_digest', 'sentiment_version_id', 'formatted'),
+    ('summary_digest', 'summary_version_id', 'formatted'),
+)
+
+
+def _digest(text):
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def upgrade():
+    bind = op.get_bind()
+    existing = {column['name'] for column in sa.inspect(bind).get_columns('scene')}
+    missing = [name for name, _, _ in ANALYSES if name not in existing]
+    if missing:
+        with op.batch_alter_table('scene') as batch_op:
+            for name in missing:
+                batch_op.add_column(sa.Column(name, sa.String(length=16), nullable=True))
+
+    # Analyses already marked fresh by version id keep counting as fresh. Current
+    # versions are always stored in full, so their columns can be read directly.
+    rows = bind.execute(sa.text(
+        "SELECT scene.id, scene.current_version_id, scene.score_version_id, scene.sentiment_version_id, "
+        "scene.summary_version_id, scene_version.content, scene_version.formatted "
+        "FROM scene JOIN scene_version ON scene_version.id = scene.current_version_id"
+    )).mappings()
+    updates = []
+    for row in rows:
+        values = {name: _digest(row[source]) for name, version_column, source in ANALYSES
+                  if row[version_column] == row['current_version_id']}
+        if values:
+            updates.append((row['id'], values))
+    for scene_id, values in updates:
+        assignments = ', '.join(f"{name} = :{name}" for name in values)
+        bind.execute(sa.text(f"UPDATE scene SET {assignments} WHERE id = :id"), dict(values, id=scene_id))
+
+
+def downgrade():
+    with op.batch_alter_table('scene') as batch_op:
+        for name, _, _ in reversed(ANALYSES):
+            batch_op.drop_column(name)
@@ -0,0 +1,28 @@
+"""initial schema
+
+Revision ID: df788fc24edf
+Revises: 
+Create Date: 2024-10-21 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'df788fc24edf'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# Tables are created by db.create_all() when the app starts; this revision marks the
+# schema existing databases are already stamped with. Later revisions only carry what
+# create_all() cannot do on an existing database: new indexes, column changes and data.
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
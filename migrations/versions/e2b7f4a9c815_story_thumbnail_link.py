@@ -0,0 +1,28 @@
+"""add story.thumbnail_link
+
+Revision ID: e2b7f4a9c815
+Revises: c6d3e8a1f094
+Create Date: 2026-10-18 21:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7f4a9c815'
+down_revision = 'c6d3e8a1f094'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('story')}
+    if 'thumbnail_link' not in existing:
+        with op.batch_alter_table('story') as batch_op:
+            batch_op.add_column(sa.Column('thumbnail_link', sa.String(length=700), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('story') as batch_op:
+        batch_op.drop_column('thumbnail_link')
@@ -0,0 +1,28 @@
+"""record which worker process owns each job
+
+Revision ID: e4a9c1f7b803
+Revises: d8f2a6c4e195
+Create Date: 2026-10-19 11:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9c1f7b803'
+down_revision = 'd8f2a6c4e195'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('job')}
+    if 'worker_id' not in existing:
+        with op.batch_alter_table('job') as batch_op:
+            batch_op.add_column(sa.Column('worker_id', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('job') as batch_op:
+        batch_op.drop_column('worker_id')
@@ -0,0 +1,58 @@
+"""add scene_stats and story_stats tables and scene.stats_version_id
+
+Revision ID: f5c1a7e3d260
+Revises: e2b7f4a9c815
+Create Date: 2026-10-18 22:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5c1a7e3d260'
+down_revision = 'e2b7f4a9c815'
+branch_labels = None
+depends_on = None
+
+
+def _stat_columns():
+    return [
+        sa.Column('words', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('dialogue_words', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('action_words', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('dialogue_lines', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('elements', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('page_lines', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('character_lines', sa.JSON(), nullable=True),
+    ]
+
+
+def upgrade():
+    # Existing versions get their stats from `flask stats rebuild`.
+    op.create_table(
+        'scene_stats',
+        sa.Column('version_id', sa.Integer(), sa.ForeignKey('scene_version.id'), primary_key=True),
+        *_stat_columns(),
+        sa.Column('computed_at', sa.DateTime(), nullable=True),
+        if_not_exists=True
+    )
+    op.create_table(
+        'story_stats',
+        sa.Column('story_id', sa.Integer(), sa.ForeignKey('story.id'), primary_key=True),
+        sa.Column('scenes', sa.Integer(), nullable=False, server_default='0'),
+        *_stat_columns(),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        if_not_exists=True
+    )
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('scene')}
+    if 'stats_version_id' not in existing:
+        with op.batch_alter_table('scene') as batch_op:
+            batch_op.add_column(sa.Column('stats_version_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('scene') as batch_op:
+        batch_op.drop_column('stats_version_id')
+    op.drop_table('story_stats', if_exists=True)
+    op.drop_table('scene_stats', if_exists=True)
@@ -1,7 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import deferred, undefer_group
 from datetime import datetime
 from pytz import timezone
-from sqlalchemy import PickleType
+import json
+
+from deltas import reconstruct
 
 db = SQLAlchemy()
 
@@ -11,7 +15,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone("Asia/Kolkata")))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")))
 
     def __repr__(self):
         return f"<User {self.username}>"
@@ -19,13 +23,17 @@ class User(db.Model):
 
 class Story(db.Model):
     __tablename__ = 'story'
+    __table_args__ = (
+        db.Index('ix_story_user_id_id', 'user_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     image_link = db.Column(db.String(700), nullable=True)
+    thumbnail_link = db.Column(db.String(700), nullable=True)
     title = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone("Asia/Kolkata")))
-    updated_at = db.Column(db.DateTime, onupdate=datetime.now(timezone("Asia/Kolkata")))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")), onupdate=lambda: datetime.now(timezone("Asia/Kolkata")))
     description = db.Column(db.Text, nullable=False)
 
     scenes = db.relationship('Scene', backref='story', lazy=True, cascade="all, delete")
@@ -35,48 +43,227 @@ class Story(db.Model):
 
 class Scene(db.Model):
     __tablename__ = 'scene'
+    __table_args__ = (
+        db.Index('ix_scene_story_id_id', 'story_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     story_id = db.Column(db.Integer, db.ForeignKey('story.id'), nullable=False)
     current_version_id = db.Column(db.Integer, db.ForeignKey('scene_version.id'))
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone("Asia/Kolkata")))
-    updated_at = db.Column(db.DateTime, onupdate=datetime.now(timezone("Asia/Kolkata")))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")), onupdate=lambda: datetime.now(timezone("Asia/Kolkata")))
     plot = db.Column(db.Integer, nullable=True)
     character_development = db.Column(db.Integer, nullable=True)
     dialogue = db.Column(db.Integer, nullable=True)
     originality = db.Column(db.Integer, nullable=True)
     theme = db.Column(db.Integer, nullable=True)
-    emoji = db.Column(PickleType, nullable=True)
-    emoji_name = db.Column(PickleType, nullable=True)
+    sentiment = db.Column(db.JSON, nullable=True)
     sentiment_desc = db.Column(db.Text, nullable=True)
     summary = db.Column(db.Text, nullable=True)
+    score_version_id = db.Column(db.Integer, nullable=True)
+    sentiment_version_id = db.Column(db.Integer, nullable=True)
+    summary_version_id = db.Column(db.Integer, nullable=True)
+    score_digest = db.Column(db.String(16), nullable=True)
+    sentiment_digest = db.Column(db.String(16), nullable=True)
+    summary_digest = db.Column(db.String(16), nullable=True)
+    stats_version_id = db.Column(db.Integer, nullable=True)
     
     versions = db.relationship('SceneVersion', backref='scene', lazy=True, cascade="all, delete", foreign_keys='SceneVersion.scene_id')
+    current_version = db.relationship('SceneVersion', foreign_keys=[current_version_id], post_update=True)
     
     def __repr__(self):
         return f"<Scene {self.id}>"
 
 class SceneVersion(db.Model):
     __tablename__ = 'scene_version'
+    __table_args__ = (
+        db.Index('uq_scene_version_scene_id_version_number', 'scene_id', 'version_number', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     scene_id = db.Column(db.Integer, db.ForeignKey('scene.id'), nullable=False)
     version_number = db.Column(db.Integer, nullable=False)
     title = db.Column(db.String(255), nullable=False)
-    content = db.Column(db.Text, nullable=False)
-    formatted = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone("Asia/Kolkata")))
+    # Superseded versions are stored as a delta against parent (see versions.py); their
+    # content column is then empty and formatted NULL. Read the content and formatted
+    # properties, which rebuild the text transparently. The body columns are deferred
+    # so history listings only load metadata; undefer_group('body') when reading text.
+    _content = deferred(db.Column('content', db.Text, nullable=False), group='body')
+    _formatted = deferred(db.Column('formatted', db.Text, nullable=True), group='body')
+    blocks = deferred(db.Column(db.JSON, nullable=True), group='body')
+    parent_id = db.Column(db.Integer, db.ForeignKey('scene_version.id'), nullable=True)
+    depth = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    delta = deferred(db.Column(db.LargeBinary, nullable=True), group='body')
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")))
+
+    stats = db.relationship('SceneStats', uselist=False, cascade="all, delete-orphan")
+    parent = db.relationship('SceneVersion', remote_side=[id], backref='children')
+
+    def texts(self):
+        if self.delta is None:
+            return self._content, self._formatted
+        return reconstruct(self, self._ancestors)
+
+    def _ancestors(self):
+        # Deltas chain to earlier versions of the same scene, so one query usually loads
+        # the whole chain into the session instead of one query per parent.
+        if self.id is None or self.scene_id is None:
+            return []
+        return (SceneVersion.query
+                .filter(SceneVersion.scene_id == self.scene_id, SceneVersion.id < self.id)
+                .options(undefer_group('body'))
+                .order_by(SceneVersion.id.desc())
+                .limit(self.depth)
+                .all())
+
+    def inflate(self):
+        if self.delta is None:
+            return
+        self._content, self._formatted = self.texts()
+        self.delta = None
+        self.depth = 0
+
+    def _edit(self, index, value):
+        # In-place edits need a full copy, and versions stored as deltas against this
+        # one are inflated first, while the old text they were diffed from is still here.
+        if self.texts()[index] == value:
+            return
+        self.inflate()
+        if self.id is not None:
+            for child in self.children:
+                child.inflate()
+        if index == 0:
+            self._content = value
+        else:
+            self._formatted = value
+
+    @hybrid_property
+    def content(self):
+        return self.texts()[0]
+
+    @content.setter
+    def content(self, value):
+        self._edit(0, value)
+
+    @content.expression
+    def content(cls):
+        # Plain column: only full versions, e.g. a scene's current version, have it.
+        return cls._content
+
+    @hybrid_property
+    def formatted(self):
+        return self.texts()[1]
+
+    @formatted.setter
+    def formatted(self, value):
+        self._edit(1, value)
+
+    @formatted.expression
+    def formatted(cls):
+        return cls._formatted
 
     def __repr__(self):
         return f"<SceneVersion {self.version_number} for Scene {self.scene_id}>"
 
+STAT_FIELDS = ('words', 'dialogue_words', 'action_words', 'dialogue_lines', 'elements', 'page_lines')
+LINES_PER_PAGE = 55
+
+def _stats_dict(row):
+    values = {name: getattr(row, name) or 0 for name in STAT_FIELDS}
+    spoken = values['dialogue_words'] + values['action_words']
+    values['character_lines'] = row.character_lines or {}
+    values['dialogue_ratio'] = round(values['dialogue_words'] / spoken, 3) if spoken else 0.0
+    # The one-page-per-minute rule of thumb.
+    values['screen_seconds'] = round(values['page_lines'] * 60 / LINES_PER_PAGE)
+    return values
+
+class SceneStats(db.Model):
+    __tablename__ = 'scene_stats'
+
+    version_id = db.Column(db.Integer, db.ForeignKey('scene_version.id'), primary_key=True)
+    words = db.Column(db.Integer, nullable=False, default=0)
+    dialogue_words = db.Column(db.Integer, nullable=False, default=0)
+    action_words = db.Column(db.Integer, nullable=False, default=0)
+    dialogue_lines = db.Column(db.Integer, nullable=False, default=0)
+    elements = db.Column(db.Integer, nullable=False, default=0)
+    page_lines = db.Column(db.Integer, nullable=False, default=0)
+    character_lines = db.Column(db.JSON, nullable=True)
+    computed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")), onupdate=lambda: datetime.now(timezone("Asia/Kolkata")))
+
+    def to_dict(self):
+        return dict(_stats_dict(self), version_id=self.version_id)
+
+    def __repr__(self):
+        return f"<SceneStats for version {self.version_id}>"
+
+class StoryStats(db.Model):
+    __tablename__ = 'story_stats'
+
+    story_id = db.Column(db.Integer, db.ForeignKey('story.id'), primary_key=True)
+    scenes = db.Column(db.Integer, nullable=False, default=0)
+    words = db.Column(db.Integer, nullable=False, default=0)
+    dialogue_words = db.Column(db.Integer, nullable=False, default=0)
+    action_words = db.Column(db.Integer, nullable=False, default=0)
+    dialogue_lines = db.Column(db.Integer, nullable=False, default=0)
+    elements = db.Column(db.Integer, nullable=False, default=0)
+    page_lines = db.Column(db.Integer, nullable=False, default=0)
+    character_lines = db.Column(db.JSON, nullable=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")), onupdate=lambda: datetime.now(timezone("Asia/Kolkata")))
+
+    def to_dict(self):
+        return dict(_stats_dict(self), story_id=self.story_id, scenes=self.scenes or 0)
+
+    def __repr__(self):
+        return f"<StoryStats for story {self.story_id}>"
+
 class Conversation(db.Model):
     __tablename__ = 'conversations'
+    __table_args__ = (
+        db.Index('ix_conversations_user_id_id', 'user_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String(50),db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     role = db.Column(db.String(20), nullable=False)
     content = db.Column(db.Text, nullable=False)
 
     def __repr__(self):
         return f"<Conversation {self.id} - {self.user_id} - {self.role}>"
+
+class ConversationSummary(db.Model):
+    __tablename__ = 'conversation_summary'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    summary = db.Column(db.Text, nullable=False, default='')
+    summarized_through_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")), onupdate=lambda: datetime.now(timezone("Asia/Kolkata")))
+
+    def __repr__(self):
+        return f"<ConversationSummary {self.user_id} through {self.summarized_through_id}>"
+
+class Job(db.Model):
+    __tablename__ = 'job'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    worker_id = db.Column(db.String(32), nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone("Asia/Kolkata")), onupdate=lambda: datetime.now(timezone("Asia/Kolkata")))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S") if self.created_at else None,
+            "updated_at": self.updated_at.strftime("%Y-%m-%d %H:%M:%S") if self.updated_at else None,
+        }
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status}>"
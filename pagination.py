@@ -0,0 +1,46 @@
+import base64
+import json
+
+from flask import current_app, request
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def page_args():
+    # Returns (limit, after) from ?limit=&cursor=. Keyset cursors carry the last id seen,
+    # so a page costs an index range scan no matter how deep into the list it is.
+    default = current_app.config.get('PAGE_SIZE', 50)
+    maximum = current_app.config.get('MAX_PAGE_SIZE', 200)
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        raise InvalidCursor("limit must be an integer")
+    limit = max(1, min(limit, maximum))
+
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and not isinstance(after, int):
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+    return limit, after
+
+
+def paginate(rows, limit, key=lambda row: row.id):
+    # Callers fetch limit + 1 rows; the extra row only tells us whether another page exists.
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(key(rows[-1]))
+    return rows, None
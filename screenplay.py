@@ -0,0 +1,195 @@
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+TAG_RE = re.compile(r"<(/?)(heading|sub-heading|action|character|parenthesis|dialogue|quote|shot)>")
+DIALOGUE_PARTS = ('character', 'parenthesis', 'quote')
+
+
+class Element:
+    # kind is a tag name, or "text" for untagged text between elements.
+    __slots__ = ('kind', 'text')
+
+    def __init__(self, kind, text):
+        self.kind = kind
+        self.text = text
+
+    def to_dict(self):
+        return {"type": self.kind, "text": self.text}
+
+    def __repr__(self):
+        return f"<Element {self.kind} {self.text[:30]!r}>"
+
+
+class Dialogue:
+    __slots__ = ('character', 'parenthetical', 'text')
+    kind = 'dialogue'
+
+    def __init__(self, character='', parenthetical='', text=''):
+        self.character = character
+        self.parenthetical = parenthetical
+        self.text = text
+
+    def to_dict(self):
+        return {"type": "dialogue", "character": self.character, "parenthetical": self.parenthetical, "text": self.text}
+
+    def __repr__(self):
+        return f"<Dialogue {self.character} {self.text[:30]!r}>"
+
+
+def _join(existing, text):
+    return f"{existing} {text}" if existing else text
+
+
+def parse(formatted):
+    # Single pass over the tags. Tolerates what the model sometimes emits: untagged text,
+    # a missing closing tag (closed by the next opening tag), stray closing tags, and
+    # dialogue text that is not wrapped in <quote>.
+    text = formatted or ''
+    elements = []
+    dialogue = None
+    leaf = None
+    position = 0
+
+    def add(kind, content):
+        nonlocal dialogue
+        content = content.strip()
+        if not content:
+            return
+        if dialogue is not None and kind in DIALOGUE_PARTS:
+            if kind == 'character':
+                dialogue.character = _join(dialogue.character, content)
+            elif kind == 'parenthesis':
+                dialogue.parenthetical = _join(dialogue.parenthetical, content)
+            else:
+                dialogue.text = _join(dialogue.text, content)
+            return
+        if dialogue is not None:
+            elements.append(dialogue)
+            dialogue = None
+        elements.append(Element(kind, content))
+
+    for match in TAG_RE.finditer(text):
+        closing, kind = match.group(1) == '/', match.group(2)
+        if leaf is not None:
+            if closing and kind not in (leaf[0], 'dialogue'):
+                continue
+            add(leaf[0], text[leaf[1]:match.start()])
+            matched = closing and kind == leaf[0]
+            leaf = None
+            if matched:
+                position = match.end()
+                continue
+        else:
+            add('quote' if dialogue is not None else 'text', text[position:match.start()])
+        position = match.end()
+
+        if kind == 'dialogue':
+            if dialogue is not None:
+                elements.append(dialogue)
+            dialogue = None if closing else Dialogue()
+        elif not closing:
+            leaf = (kind, match.end())
+
+    if leaf is not None:
+        add(leaf[0], text[leaf[1]:])
+    else:
+        add('quote' if dialogue is not None else 'text', text[position:])
+    if dialogue is not None:
+        elements.append(dialogue)
+    return elements
+
+
+def serialize(elements):
+    lines = []
+    for element in elements:
+        if element.kind == 'dialogue':
+            parts = [f"<character>{element.character}</character>"]
+            if element.parenthetical:
+                parts.append(f"<parenthesis>{element.parenthetical}</parenthesis>")
+            parts.append(f"<quote>{element.text}</quote>")
+            lines.append("<dialogue>" + "\n".join(parts) + "</dialogue>")
+        elif element.kind == 'text':
+            lines.append(element.text)
+        else:
+            lines.append(f"<{element.kind}>{element.text}</{element.kind}>")
+    return "\n".join(lines)
+
+
+def to_plain_text(elements):
+    # Screenplay layout without tags, for prompts and exports.
+    blocks = []
+    for element in elements:
+        if element.kind == 'dialogue':
+            lines = [element.character.upper()]
+            if element.parenthetical:
+                lines.append(element.parenthetical)
+            lines.append(element.text)
+            blocks.append("\n".join(lines))
+        elif element.kind in ('heading', 'sub-heading', 'shot'):
+            blocks.append(element.text.upper())
+        else:
+            blocks.append(element.text)
+    return "\n\n".join(blocks)
+
+
+def filter_elements(elements, kinds):
+    kinds = set(kinds)
+    return [element for element in elements if element.kind in kinds]
+
+
+def characters(elements):
+    # In order of first appearance.
+    seen = OrderedDict()
+    for element in elements:
+        if element.kind == 'dialogue' and element.character:
+            seen.setdefault(element.character.upper(), None)
+        elif element.kind == 'character':
+            seen.setdefault(element.text.upper(), None)
+    return list(seen)
+
+
+def element_key(element):
+    # Comparable identity of an element, for diffs.
+    if element.kind == 'dialogue':
+        return ('dialogue', element.character.upper(), element.parenthetical, element.text)
+    return (element.kind, element.text)
+
+
+def dialogue_counts(elements):
+    return Counter(element.character.upper() for element in elements if element.kind == 'dialogue' and element.character)
+
+
+class ParseCache:
+    # Parsed elements per scene version. A version's formatted text can be rewritten in
+    # place by re-conversion, so entries also remember a hash of the text they came from.
+    # Callers share the cached lists and must not mutate them.
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version):
+        formatted = version.formatted or ''
+        fingerprint = hash(formatted)
+        with self._lock:
+            entry = self._entries.get(version.id)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(version.id)
+                return entry[1]
+        elements = parse(formatted)
+        with self._lock:
+            self._entries[version.id] = (fingerprint, elements)
+            self._entries.move_to_end(version.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return elements
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+parse_cache = ParseCache(int(os.environ.get('PARSE_CACHE_ENTRIES', 512)))
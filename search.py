@@ -0,0 +1,182 @@
+import re
+from collections import OrderedDict
+from itertools import chain
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, text
+from sqlalchemy.orm import joinedload
+
+from models import db, Story, Scene, SceneVersion
+from screenplay import parse_cache, to_plain_text
+from versions import changed, rewritten_scenes
+
+KINDS = ('story', 'scene', 'dialogue')
+TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+# ref holds "user<id> story<id> scene<id>" tokens, so ownership filters and deletes by
+# story or scene are index lookups instead of scans. Scene rows carry the scene's
+# plain text; dialogue rows carry one character's lines in one scene.
+CREATE_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "ref, kind, title, character, body, story_id UNINDEXED, scene_id UNINDEXED, "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+INSERT = text(
+    "INSERT INTO search_index (ref, kind, title, character, body, story_id, scene_id) "
+    "VALUES (:ref, :kind, :title, :character, :body, :story_id, :scene_id)"
+)
+DELETE = text("DELETE FROM search_index WHERE rowid IN (SELECT rowid FROM search_index WHERE search_index MATCH :match)")
+# bm25 weights follow the column order: title matches count most, ref and kind not at all.
+QUERY = text(
+    "SELECT kind, story_id, scene_id, title, character, "
+    "snippet(search_index, 4, '<mark>', '</mark>', '…', 12) AS snippet, "
+    "bm25(search_index, 0, 0, 5.0, 2.0, 1.0) AS score "
+    "FROM search_index WHERE search_index MATCH :match ORDER BY score LIMIT :limit OFFSET :offset"
+)
+
+
+def match_terms(query):
+    # User input as quoted FTS5 phrases, so operators and stray punctuation can't cause
+    # syntax errors. "quoted text" stays a phrase and a trailing * is a prefix search.
+    terms = []
+    for phrase, word in TERM_RE.findall(query or ''):
+        prefix = False
+        if not phrase:
+            prefix = word.endswith('*')
+            phrase = word.rstrip('*')
+        if phrase.strip():
+            terms.append('"' + phrase.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def _phrase(value):
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class SearchIndex:
+    # Full-text index in an SQLite FTS5 table, kept current by a flush hook that
+    # re-indexes a scene whenever its current version moves or is edited in place.
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app):
+        self.enabled = app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+        if not self.enabled:
+            print("Search is disabled: the FTS5 index needs an SQLite database")
+        event.listen(db.session, 'after_flush', _after_flush)
+        app.cli.add_command(search_cli)
+
+    def create_table(self, connection):
+        if self.enabled:
+            connection.execute(text(CREATE_TABLE))
+
+    def remove(self, connection, match):
+        connection.execute(DELETE, {"match": match})
+
+    def index_story(self, connection, story):
+        self.remove(connection, f'ref:"story{story.id}" AND kind:story')
+        connection.execute(INSERT, {
+            "ref": f"user{story.user_id} story{story.id}", "kind": "story", "title": story.title,
+            "character": "", "body": story.description or "", "story_id": story.id, "scene_id": None,
+        })
+
+    def index_scene(self, connection, scene, user_id, version):
+        self.remove(connection, f'ref:"scene{scene.id}"')
+        if version is None:
+            return
+        ref = f"user{user_id} story{scene.story_id} scene{scene.id}"
+        rows = []
+        if version.formatted:
+            elements = parse_cache.get(version)
+            body = to_plain_text(elements)
+            lines = OrderedDict()
+            for element in elements:
+                if element.kind == 'dialogue' and element.character:
+                    lines.setdefault(element.character.upper(), []).append(element.text)
+            for character, spoken in lines.items():
+                rows.append({"ref": ref, "kind": "dialogue", "title": version.title, "character": character,
+                             "body": "\n".join(spoken), "story_id": scene.story_id, "scene_id": scene.id})
+        else:
+            body = version.content
+        rows.insert(0, {"ref": ref, "kind": "scene", "title": version.title, "character": "",
+                        "body": body or "", "story_id": scene.story_id, "scene_id": scene.id})
+        connection.execute(INSERT, rows)
+
+    def search(self, user_id, query, kind=None, character=None, story_id=None, limit=20, offset=0):
+        # Without a kind or character, stories and scenes are searched; dialogue rows
+        # repeat scene text and only come back when asked for.
+        terms = match_terms(query)
+        if not terms:
+            return []
+        clauses = [f'ref:"user{int(user_id)}"']
+        if story_id is not None:
+            clauses.append(f'ref:"story{int(story_id)}"')
+        if character:
+            kind = 'dialogue'
+            clauses.append(f'character:{_phrase(character)}')
+        clauses.append(f'kind:{kind}' if kind else 'kind:(story OR scene)')
+        clauses.append('{title character body}: (' + terms + ')')
+        rows = db.session.execute(QUERY, {"match": ' AND '.join(clauses), "limit": limit, "offset": offset})
+        return [{
+            "kind": row.kind,
+            "story_id": int(row.story_id),
+            "scene_id": int(row.scene_id) if row.scene_id is not None else None,
+            "title": row.title,
+            "character": row.character or None,
+            "snippet": row.snippet,
+            "score": round(-row.score, 4),
+        } for row in rows]
+
+    def rebuild(self):
+        connection = db.session.connection()
+        connection.execute(text("DELETE FROM search_index"))
+        count = 0
+        for story in Story.query.all():
+            self.index_story(connection, story)
+            scenes = (Scene.query
+                      .options(joinedload(Scene.current_version).undefer_group('body'))
+                      .filter(Scene.story_id == story.id))
+            for scene in scenes:
+                self.index_scene(connection, scene, story.user_id, scene.current_version)
+                count += 1
+        db.session.commit()
+        return count
+
+
+search_index = SearchIndex()
+
+
+def _after_flush(session, flush_context):
+    if not search_index.enabled:
+        return
+    stories = [obj for obj in chain(session.new, session.dirty)
+               if isinstance(obj, Story) and (obj in session.new or changed(obj, 'title', 'description'))]
+    scenes = rewritten_scenes(session)
+    removed = [obj for obj in session.deleted if isinstance(obj, (Story, Scene))]
+    if not (stories or scenes or removed):
+        return
+
+    connection = session.connection()
+    with session.no_autoflush:
+        for story in stories:
+            search_index.index_story(connection, story)
+        for scene in scenes:
+            story = session.get(Story, scene.story_id)
+            if story is None or story in session.deleted:
+                continue
+            version = session.get(SceneVersion, scene.current_version_id) if scene.current_version_id else None
+            search_index.index_scene(connection, scene, story.user_id, version)
+    for obj in removed:
+        kind = 'story' if isinstance(obj, Story) else 'scene'
+        search_index.remove(connection, f'ref:"{kind}{obj.id}"')
+
+
+search_cli = AppGroup('search', help="Full-text search index.")
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    count = search_index.rebuild()
+    click.echo(f"Indexed {count} scenes")
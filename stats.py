@@ -0,0 +1,199 @@
+from collections import Counter
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import selectinload, undefer_group
+
+from models import db, Story, Scene, SceneVersion, SceneStats, StoryStats, STAT_FIELDS
+from screenplay import parse
+
+ACTION_WIDTH = 60
+DIALOGUE_WIDTH = 35
+
+
+def _wrapped_lines(text, width):
+    return max(1, -(-len(text) // width))
+
+
+def compute(text):
+    # Deterministic counts from the tagged text. page_lines approximates a formatted
+    # page: action wraps at 60 characters, dialogue at 35, plus a blank line per element.
+    values = dict.fromkeys(STAT_FIELDS, 0)
+    character_lines = Counter()
+    for element in parse(text):
+        values['elements'] += 1
+        words = len(element.text.split())
+        values['words'] += words
+        if element.kind == 'dialogue':
+            values['dialogue_words'] += words
+            values['dialogue_lines'] += 1
+            if element.character:
+                character_lines[element.character.upper()] += 1
+            values['page_lines'] += 2 + bool(element.parenthetical) + _wrapped_lines(element.text, DIALOGUE_WIDTH)
+        else:
+            if element.kind in ('action', 'text'):
+                values['action_words'] += words
+            values['page_lines'] += 1 + _wrapped_lines(element.text, ACTION_WIDTH)
+    values['character_lines'] = dict(character_lines)
+    return values
+
+
+def _values(row):
+    if row is None:
+        return None
+    values = {name: getattr(row, name) or 0 for name in STAT_FIELDS}
+    values['character_lines'] = dict(row.character_lines or {})
+    return values
+
+
+def _set(row, values):
+    for name in STAT_FIELDS:
+        setattr(row, name, values[name])
+    row.character_lines = values['character_lines']
+
+
+def _apply(story_stats, values, sign):
+    if values is None:
+        return
+    for name in STAT_FIELDS:
+        setattr(story_stats, name, (getattr(story_stats, name) or 0) + sign * values[name])
+    lines = Counter(story_stats.character_lines or {})
+    lines.update({name: sign * count for name, count in values['character_lines'].items()})
+    # A new dict so the JSON column registers the change.
+    story_stats.character_lines = {name: count for name, count in lines.items() if count > 0}
+
+
+def _text(version):
+    return version.formatted or version.content or ''
+
+
+def _text_changed(version):
+    state = inspect(version)
+    if state.pending or state.transient:
+        return True
+    # Compaction only changes how the text is stored.
+    if any(value is not None for value in state.attrs.delta.history.added):
+        return False
+    return state.attrs._formatted.history.has_changes() or state.attrs._content.history.has_changes()
+
+
+def _version_stats(session, version_id):
+    # Current values for a version, computing (and storing) them for versions written
+    # before the stats table existed.
+    version = session.get(SceneVersion, version_id) if version_id else None
+    if version is None:
+        return None
+    if version.stats is None:
+        version.stats = SceneStats(**compute(_text(version)))
+    return _values(version.stats)
+
+
+def _before_flush(session, flush_context, instances):
+    # Runs inside every flush, so any code path that writes a version or moves a scene's
+    # current version keeps the stats current. Scene.stats_version_id records which
+    # version a scene contributes to its story's aggregate, so the aggregate is adjusted
+    # by the difference instead of being summed again.
+    with session.no_autoflush:
+        previous = {}
+        scene_ids = set()
+        for obj in list(session.new) + list(session.dirty):
+            if not isinstance(obj, SceneVersion) or not _text_changed(obj):
+                continue
+            values = compute(_text(obj))
+            if obj.stats is None:
+                obj.stats = SceneStats(**values)
+            else:
+                previous[obj.id] = _values(obj.stats)
+                _set(obj.stats, values)
+            if obj.scene_id is not None:
+                scene_ids.add(obj.scene_id)
+
+        scenes = {}
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Scene):
+                scenes[obj.id if obj.id is not None else id(obj)] = obj
+        for scene_id in scene_ids - set(scenes):
+            scene = session.get(Scene, scene_id)
+            if scene is not None:
+                scenes[scene_id] = scene
+
+        deleted_stories = {obj.id for obj in session.deleted if isinstance(obj, Story)}
+        aggregates = {}
+        for scene in scenes.values():
+            if scene.story_id in deleted_stories:
+                continue
+            target = None if scene in session.deleted else scene.current_version_id
+            counted = scene.stats_version_id
+            if target == counted and counted not in previous:
+                continue
+            story_stats = aggregates.get(scene.story_id)
+            if story_stats is None:
+                story_stats = session.get(StoryStats, scene.story_id)
+                if story_stats is None:
+                    story_stats = StoryStats(story_id=scene.story_id, character_lines={})
+                    session.add(story_stats)
+                aggregates[scene.story_id] = story_stats
+            old = previous[counted] if counted in previous else _version_stats(session, counted)
+            _apply(story_stats, old, -1)
+            _apply(story_stats, _version_stats(session, target), 1)
+            story_stats.scenes = (story_stats.scenes or 0) + (target is not None) - (counted is not None)
+            if scene not in session.deleted:
+                scene.stats_version_id = target
+
+        for story_id in deleted_stories:
+            story_stats = session.get(StoryStats, story_id)
+            if story_stats is not None:
+                session.delete(story_stats)
+
+
+def rebuild(force=False):
+    # Recomputes missing (or, with force, all) version stats and every story aggregate
+    # from scratch. Used to backfill rows written before the stats tables existed.
+    computed = 0
+    last_id = 0
+    while True:
+        batch = (SceneVersion.query
+                 .options(selectinload(SceneVersion.stats), undefer_group('body'))
+                 .filter(SceneVersion.id > last_id)
+                 .order_by(SceneVersion.id)
+                 .limit(500)
+                 .all())
+        if not batch:
+            break
+        for version in batch:
+            if version.stats is None:
+                version.stats = SceneStats(**compute(_text(version)))
+                computed += 1
+            elif force:
+                _set(version.stats, compute(_text(version)))
+                computed += 1
+        last_id = batch[-1].id
+        db.session.flush()
+
+    StoryStats.query.delete()
+    for story in Story.query.all():
+        story_stats = StoryStats(story_id=story.id, character_lines={})
+        for scene in Scene.query.filter_by(story_id=story.id):
+            if scene.current_version_id:
+                _apply(story_stats, _version_stats(db.session, scene.current_version_id), 1)
+                story_stats.scenes = (story_stats.scenes or 0) + 1
+            scene.stats_version_id = scene.current_version_id
+        db.session.add(story_stats)
+    db.session.commit()
+    return computed
+
+
+stats_cli = AppGroup('stats', help="Screenplay statistics.")
+
+
+@stats_cli.command('rebuild')
+@click.option('--force', is_flag=True, help="Recompute stats that already exist.")
+def rebuild_command(force):
+    computed = rebuild(force=force)
+    click.echo(f"Computed stats for {computed} versions and rebuilt story totals")
+
+
+def init_app(app):
+    event.listen(db.session, 'before_flush', _before_flush)
+    app.cli.add_command(stats_cli)
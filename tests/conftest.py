@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Everything the app writes (database, caches, audio, vectors) goes to a scratch
+# directory, and embeddings use the offline hashing stand-in.
+SCRATCH = tempfile.mkdtemp(prefix='storyapp-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(SCRATCH, 'stories.db')}"
+os.environ['LLM_CACHE_PATH'] = os.path.join(SCRATCH, 'llm_cache.db')
+os.environ['EMBEDDING_PROVIDER'] = 'hashing'
+os.environ['EMBEDDING_ASYNC'] = '0'
+os.environ['TTS_SYNTHESIZER'] = 'gtts'
+os.environ.setdefault('API_KEY', 'test-key')
+os.chdir(SCRATCH)
+
+
+@pytest.fixture(scope='session')
+def app():
+    import app as app_module
+    from embeddings import embedding_index
+
+    embedding_index.directory = os.path.join(SCRATCH, 'embeddings')
+    app_module.app.config['TESTING'] = True
+    return app_module.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(client):
+    # Registers a fresh user and returns (user id, auth headers).
+    from models import User
+
+    def make():
+        name = uuid.uuid4().hex
+        client.post('/api/register', json={'username': name, 'password': 'pw'})
+        token = client.post('/api/login', json={'username': name, 'password': 'pw'}).json['access_token']
+        with client.application.app_context():
+            user_id = User.query.filter_by(username=name).one().id
+        return user_id, {'Authorization': f'Bearer {token}'}
+
+    return make
+
+
+@pytest.fixture
+def user(make_user):
+    return make_user()
+
+
+@pytest.fixture
+def make_scene(app):
+    # Writes a scene straight to the database, one version per text, without any model calls.
+    from models import db, Story, Scene, SceneVersion
+
+    def make(user_id, texts, title='Scene', story_title='Story'):
+        with app.app_context():
+            story = Story(user_id=user_id, title=story_title, description='')
+            db.session.add(story)
+            db.session.flush()
+            scene = Scene(story_id=story.id)
+            db.session.add(scene)
+            db.session.flush()
+            for number, text in enumerate(texts, 1):
+                version = SceneVersion(scene_id=scene.id, version_number=number, title=title, content=text)
+                db.session.add(version)
+                db.session.flush()
+                scene.current_version_id = version.id
+                db.session.commit()
+            return story.id, scene.id
+
+    return make
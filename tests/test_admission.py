@@ -0,0 +1,85 @@
+import threading
+import time
+
+from admission import MemoryBucketStore, SQLiteBucketStore, FairGate, Overloaded, parse_limits
+
+
+def test_bucket_admits_up_to_capacity_then_reports_the_wait():
+    store = MemoryBucketStore()
+    assert [store.take('u:chat', 2, 1.0, now=100) for _ in range(3)] == [0.0, 0.0, 1.0]
+    assert store.take('u:chat', 2, 1.0, now=100.5) == 0.5
+    assert store.take('u:chat', 2, 1.0, now=101) == 0.0
+
+
+def test_pruning_uses_each_buckets_own_rate():
+    store = MemoryBucketStore(max_entries=10)
+    # A slow chat bucket, drained: it takes an hour to refill.
+    for _ in range(3):
+        store.take('alice:chat', 3, 3 / 3600, now=0)
+    # Many fast convert buckets overflow the store and trigger pruning.
+    for n in range(200):
+        store.take(f'user{n}:convert', 30, 30.0, now=10 + n)
+    assert 'alice:chat' in store._buckets
+    assert store.take('alice:chat', 3, 3 / 3600, now=300) > 0
+    assert len(store._buckets) < 200
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'admission.db')
+    one, two = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert [one.take('k', 2, 1.0, now=100), two.take('k', 2, 1.0, now=100), one.take('k', 2, 1.0, now=100)] == [0.0, 0.0, 1.0]
+
+
+def test_fair_gate_alternates_between_waiting_users():
+    gate = FairGate(limit=1, timeout=5)
+    order = []
+    gate.acquire('holder')
+
+    def worker(user, n):
+        gate.acquire(user)
+        order.append((user, n))
+        gate.release()
+
+    threads = [threading.Thread(target=worker, args=('alice', n)) for n in range(4)]
+    threads += [threading.Thread(target=worker, args=('bob', n)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    gate.release()
+    for thread in threads:
+        thread.join()
+
+    assert [user for user, _ in order[:4]] == ['alice', 'bob', 'alice', 'bob']
+    assert gate.in_flight == 0
+
+
+def test_fair_gate_times_out_with_overloaded():
+    gate = FairGate(limit=1, timeout=0.05)
+    gate.acquire('a')
+    try:
+        gate.acquire('b')
+        assert False, "expected Overloaded"
+    except Overloaded as e:
+        assert e.retry_after == 0.05
+    assert not gate._waiting and gate.in_flight == 1
+
+
+def test_parse_limits():
+    assert parse_limits("chat=30/60, image=10/3600,") == {"chat": (30.0, 60.0), "image": (10.0, 3600.0)}
+
+
+def test_throttled_route_returns_429_with_retry_after(client, user, make_scene, monkeypatch):
+    from admission import admission
+
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, ["A scene."])
+    monkeypatch.setitem(admission.limits, 'embedding', (2.0, 60.0))
+    monkeypatch.setattr(admission, 'store', MemoryBucketStore())
+
+    codes = [client.get(f'/api/scene/{scene_id}/similar', headers=headers).status_code for _ in range(3)]
+    throttled = client.get(f'/api/scene/{scene_id}/similar', headers=headers)
+
+    assert codes == [200, 200, 429]
+    assert throttled.status_code == 429
+    assert 1 <= int(throttled.headers['Retry-After']) <= 30
+    assert throttled.json['retry_after'] == int(throttled.headers['Retry-After'])
@@ -0,0 +1,29 @@
+import httpx
+import openai
+
+from ai_batch import submit, FakeBatchClient
+from clients import openai_clients
+
+
+def test_submit_retries_the_upload_with_the_full_file(tmp_path, monkeypatch):
+    path = tmp_path / 'requests.jsonl'
+    path.write_bytes(b'{"custom_id": "score:1:1:abc"}\n' * 50)
+    client = FakeBatchClient(str(tmp_path / 'batches'))
+    create = client.files.create
+    uploads = []
+
+    def flaky_create(file, purpose):
+        data = file[1] if isinstance(file, tuple) else file.read()
+        uploads.append(data)
+        if len(uploads) == 1:
+            raise openai.APIConnectionError(request=httpx.Request('POST', 'https://api.openai.com/v1/files'))
+        return create(file=file, purpose=purpose)
+
+    client.files.create = flaky_create
+    client.batches.create = lambda **kwargs: kwargs
+    monkeypatch.setitem(openai_clients.settings, 'backoff_base', 0)
+
+    batch = submit(client, str(path))
+
+    assert uploads == [path.read_bytes()] * 2
+    assert (tmp_path / 'batches' / batch['input_file_id']).read_bytes() == path.read_bytes()
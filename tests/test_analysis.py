@@ -0,0 +1,41 @@
+from analysis import batch_analyze, ANALYSES
+
+
+def test_batch_analysis_rejects_bad_concurrency(client, user, make_scene):
+    user_id, headers = user
+    story_id, _ = make_scene(user_id, ["Text."])
+
+    for value in ("abc", [2], {"n": 1}):
+        response = client.post(f'/api/story/{story_id}/batch_analysis', json={'concurrency': value}, headers=headers)
+        assert response.status_code == 400
+
+
+def test_in_place_rewrite_makes_analyses_stale(app, user, make_scene, monkeypatch):
+    from models import db, Scene
+    from sqlalchemy.orm import joinedload
+    import versions
+
+    runs = []
+    monkeypatch.setitem(ANALYSES, "summary", ANALYSES["summary"]._replace(
+        run=lambda text, api_key: runs.append(text) or "summary of " + text))
+
+    user_id, _ = user
+    _, scene_id = make_scene(user_id, ["Plain text."])
+    with app.app_context():
+        version = versions.current_version(db.session.get(Scene, scene_id))
+        version.formatted = "<action>First conversion.</action>"
+        db.session.commit()
+
+        def analyze():
+            scenes = Scene.query.options(joinedload(Scene.current_version).undefer_group('body')).filter_by(id=scene_id).all()
+            return batch_analyze(scenes, ["summary"], "key")[scene_id]["summary"]
+
+        assert analyze() == "updated"
+        assert analyze() == "fresh"
+
+        # Re-conversion: same version id, new text.
+        version = versions.current_version(db.session.get(Scene, scene_id))
+        version.formatted = "<action>Second conversion.</action>"
+        db.session.commit()
+        assert analyze() == "updated"
+        assert runs == ["<action>First conversion.</action>", "<action>Second conversion.</action>"]
@@ -0,0 +1,45 @@
+import sqlite3
+
+import cache
+from cache import ResponseCache
+
+
+def _accessed_at(path, key):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT accessed_at FROM llm_cache WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hot_hits_keep_entries_from_being_evicted(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: clock[0])
+    llm_cache = ResponseCache(path=str(tmp_path / 'cache.db'), max_entries=2)
+
+    llm_cache.set('old', 'kept by reads')
+    clock[0] += 1
+    llm_cache.set('new', 'never read')
+    clock[0] += 1
+    assert llm_cache.get('old') == 'kept by reads'
+    clock[0] += 1
+    llm_cache.set('newest', 'just written')
+    llm_cache._evict(llm_cache._connect(), clock[0])
+    llm_cache._hot.clear()
+
+    assert llm_cache.get('new') is None
+    assert llm_cache.get('old') == 'kept by reads'
+    assert llm_cache.get('newest') == 'just written'
+
+
+def test_access_times_are_written_back_in_batches(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: clock[0])
+    path = str(tmp_path / 'cache.db')
+    llm_cache = ResponseCache(path=path)
+    llm_cache.set('key', 'value')
+
+    for _ in range(99):
+        clock[0] += 1
+        llm_cache.get('key')
+    assert _accessed_at(path, 'key') == 1000.0
+    clock[0] += 1
+    llm_cache.get('key')
+    assert _accessed_at(path, 'key') == 1100.0
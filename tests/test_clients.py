@@ -0,0 +1,100 @@
+import httpx
+import openai
+import pytest
+
+from admission import FairGate
+import clients
+from clients import ClientRegistry
+
+
+def _status_error(status, headers=None):
+    request = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    cls = openai.RateLimitError if status == 429 else openai.InternalServerError if status >= 500 else openai.BadRequestError
+    return cls("error", response=response, body=None)
+
+
+class Flaky:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return ("ok", args, kwargs)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(clients.time, 'sleep', delays.append)
+    return delays
+
+
+def test_call_retries_retryable_errors_with_bounded_backoff(sleeps):
+    registry = ClientRegistry(max_retries=3, backoff_base=0.5, backoff_max=20.0)
+    fn = Flaky(_status_error(500), openai.APIConnectionError(request=httpx.Request('POST', 'https://x')), _status_error(503))
+
+    assert registry.call(fn, 1, model="m") == ("ok", (1,), {"model": "m"})
+    assert fn.calls == 4
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= 0.5 * 2 ** attempt for attempt, delay in enumerate(sleeps))
+
+
+def test_call_honours_retry_after_up_to_the_cap(sleeps):
+    registry = ClientRegistry(max_retries=2, backoff_max=5.0)
+    fn = Flaky(_status_error(429, {'retry-after': '2'}), _status_error(429, {'retry-after': '60'}))
+
+    assert registry.call(fn)[0] == "ok"
+    assert sleeps == [2.0, 5.0]
+
+
+def test_call_gives_up_after_max_retries(sleeps):
+    registry = ClientRegistry(max_retries=2)
+    fn = Flaky(*[_status_error(500) for _ in range(5)])
+
+    with pytest.raises(openai.InternalServerError):
+        registry.call(fn)
+    assert fn.calls == 3
+
+
+def test_call_does_not_retry_client_errors(sleeps):
+    registry = ClientRegistry(max_retries=3)
+    fn = Flaky(_status_error(400), _status_error(400))
+
+    with pytest.raises(openai.BadRequestError):
+        registry.call(fn)
+    assert fn.calls == 1 and sleeps == []
+
+
+def test_clients_are_built_once_per_key_and_reset_on_configure():
+    built = []
+    registry = ClientRegistry(factory=lambda api_key, settings: built.append(api_key) or object())
+
+    assert registry.get('a') is registry.get('a')
+    assert registry.get('a') is not registry.get('b')
+    registry.configure(base_url='http://localhost:1/v1')
+    registry.get('a')
+    assert built == ['a', 'b', 'a']
+    with pytest.raises(ValueError):
+        registry.configure(nope=1)
+
+
+def test_stream_holds_the_gate_slot_until_the_stream_ends(sleeps):
+    registry = ClientRegistry(max_retries=1)
+    registry.gate = FairGate(limit=2)
+    fn = Flaky(_status_error(503))
+    chunks = lambda *args, **kwargs: fn() and iter(["a", "b"])
+
+    stream = registry.stream(chunks)
+    assert next(stream) == "a"
+    assert registry.gate.in_flight == 1 and fn.calls == 2
+    assert list(stream) == ["b"]
+    assert registry.gate.in_flight == 0
+
+    stream = registry.stream(chunks)
+    next(stream)
+    stream.close()
+    assert registry.gate.in_flight == 0
@@ -0,0 +1,76 @@
+import numpy as np
+
+from embeddings import UserVectors, HashingEmbedder, normalize, embedding_index, scene_text
+
+
+def test_top_k_ranks_by_similarity_and_skips_excluded(tmp_path):
+    embedder = HashingEmbedder(256)
+    texts = {1: "the ship leaves the harbor at dawn", 2: "a quiet dinner in the city",
+             3: "the harbor master watches the ship", 4: "rain on the office windows"}
+    vectors = UserVectors(str(tmp_path), 256)
+    for scene_id, text in texts.items():
+        vectors.upsert(scene_id, scene_id, normalize(embedder([text]))[0])
+
+    query = normalize(embedder(["ship in the harbor"]))
+    best = vectors.top_k(query, 2)[0]
+    assert {scene_id for scene_id, _ in best} == {1, 3}
+    assert best[0][1] >= best[1][1]
+
+    assert 3 not in [scene_id for scene_id, _ in vectors.top_k(query, 3, exclude=(3,))[0]]
+    vectors.remove(1)
+    assert vectors.get(1) is None
+    assert 1 not in [scene_id for scene_id, _ in vectors.top_k(query, 4)[0]]
+
+
+def test_vectors_are_shared_between_instances(tmp_path):
+    writer = UserVectors(str(tmp_path), 8)
+    reader = UserVectors(str(tmp_path), 8)
+    for scene_id in range(1, 40):
+        writer.upsert(scene_id, scene_id, np.eye(8, dtype=np.float32)[scene_id % 8])
+    assert reader.get(39)[1] == 39
+    assert reader.top_k(np.eye(8, dtype=np.float32)[7:], 1)[0][0][1] == 1.0
+
+
+def test_in_place_rewrite_of_current_version_is_reembedded(app, user, make_scene):
+    from models import db, Scene
+    import versions
+
+    user_id, _ = user
+    _, scene_id = make_scene(user_id, ["A detective walks into an empty bar at midnight."])
+    with app.app_context():
+        version = versions.current_version(db.session.get(Scene, scene_id))
+        before = embedding_index.vectors(user_id).get(scene_id)[0]
+        assert np.allclose(before, embedding_index.embed([scene_text(version)])[0])
+
+        # What re-conversion does: the current version keeps its id, its text changes.
+        version.formatted = "<action>Two astronauts repair a satellite in orbit.</action>"
+        db.session.commit()
+        after = embedding_index.vectors(user_id).get(scene_id)[0]
+        expected = embedding_index.embed([scene_text(version)])[0]
+
+    assert np.allclose(after, expected)
+    assert not np.allclose(after, before)
+
+
+def test_similar_scenes_route(client, user, make_scene):
+    user_id, headers = user
+    _, ship = make_scene(user_id, ["The ship leaves the harbor at dawn."], title="Departure")
+    _, harbor = make_scene(user_id, ["The harbor master watches the ship leave."], title="Watch")
+    make_scene(user_id, ["Rain on the office windows all afternoon."], title="Office")
+
+    response = client.get(f'/api/scene/{ship}/similar?limit=2', headers=headers)
+
+    assert response.status_code == 200
+    assert response.json['similar'][0]['scene_id'] == harbor
+
+
+def test_similar_scenes_route_without_a_vector(client, user, make_scene, monkeypatch):
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, ["A scene the embedder never stores."])
+    monkeypatch.setattr(embedding_index, 'index', lambda items: 0)
+    monkeypatch.setattr(embedding_index, 'similar', lambda user_id, scene_id, k: None)
+
+    response = client.get(f'/api/scene/{scene_id}/similar', headers=headers)
+
+    assert response.status_code == 200
+    assert response.json == {"scene_id": scene_id, "similar": []}
@@ -0,0 +1,50 @@
+def test_versions_of_one_scene_get_their_own_etag_and_body(client, user, make_scene):
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, [f"Version {n} of the scene." for n in range(1, 6)])
+
+    first = client.get(f'/api/scene/{scene_id}/versions/2', headers=headers)
+    second = client.get(f'/api/scene/{scene_id}/versions/4', headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert first.json['version'] == 2 and first.json['content'] == "Version 2 of the scene."
+    assert second.json['version'] == 4 and second.json['content'] == "Version 4 of the scene."
+    assert first.headers['ETag'] != second.headers['ETag']
+
+
+def test_etag_of_one_version_does_not_revalidate_another(client, user, make_scene):
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, ["One.", "Two.", "Three."])
+
+    etag = client.get(f'/api/scene/{scene_id}/versions/1', headers=headers).headers['ETag']
+
+    same = client.get(f'/api/scene/{scene_id}/versions/1', headers=dict(headers, **{'If-None-Match': etag}))
+    other = client.get(f'/api/scene/{scene_id}/versions/3', headers=dict(headers, **{'If-None-Match': etag}))
+    assert same.status_code == 304
+    assert other.status_code == 200 and other.json['content'] == "Three."
+
+
+def test_response_store_keeps_versions_apart(app, client, user, make_scene):
+    from httpcache import http_cache, ResponseStore
+
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, ["Alpha.", "Beta."])
+    store = http_cache.store
+    http_cache.store = ResponseStore(100)
+    try:
+        bodies = [client.get(f'/api/scene/{scene_id}/versions/{n}', headers=headers).json['content'] for n in (1, 2, 1, 2)]
+    finally:
+        http_cache.store = store
+    assert bodies == ["Alpha.", "Beta.", "Alpha.", "Beta."]
+
+
+def test_diffs_between_different_versions_differ(client, user, make_scene):
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, ["A\nB", "A\nC", "A\nC\nD"])
+
+    one = client.get(f'/api/scene/{scene_id}/diff?from=1&to=2&mode=lines', headers=headers)
+    two = client.get(f'/api/scene/{scene_id}/diff?from=2&mode=lines', headers=headers)
+
+    assert (one.json['from'], one.json['to']) == (1, 2)
+    assert (two.json['from'], two.json['to']) == (2, 3)
+    assert one.json['added'] == 1 and two.json['added'] == 1
+    assert one.headers['ETag'] != two.headers['ETag']
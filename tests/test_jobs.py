@@ -0,0 +1,52 @@
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pytz import timezone
+
+from jobs import job_queue
+from models import db, Job
+
+
+def _job(user_id, worker_id, age, status='running'):
+    job = Job(id=uuid.uuid4().hex, user_id=user_id, kind='test', status=status, worker_id=worker_id)
+    db.session.add(job)
+    db.session.commit()
+    # updated_at is set after the insert, since onupdate would overwrite it otherwise.
+    Job.query.filter_by(id=job.id).update(
+        {"updated_at": datetime.now(timezone("Asia/Kolkata")) - timedelta(seconds=age)}, synchronize_session=False)
+    db.session.commit()
+    return job.id
+
+
+def test_heartbeat_keeps_own_jobs_and_sweep_fails_abandoned_ones(app, user):
+    user_id, _ = user
+    with app.app_context():
+        own = _job(user_id, job_queue.worker_id, age=job_queue.stale_after + 60)
+        dead = _job(user_id, uuid.uuid4().hex, age=job_queue.stale_after + 60, status='queued')
+        sibling = _job(user_id, uuid.uuid4().hex, age=5)
+        finished = _job(user_id, uuid.uuid4().hex, age=job_queue.stale_after + 60, status='done')
+
+        job_queue.touch()
+        job_queue.fail_stale()
+        db.session.expire_all()
+
+        assert db.session.get(Job, own).status == 'running'
+        assert db.session.get(Job, dead).status == 'failed'
+        assert db.session.get(Job, dead).error == "Interrupted before completion"
+        assert db.session.get(Job, sibling).status == 'running'
+        assert db.session.get(Job, finished).status == 'done'
+
+
+def test_submitted_jobs_carry_the_worker_id(app, user):
+    user_id, _ = user
+    with app.test_request_context():
+        job = job_queue.submit('test', user_id, lambda: {"ok": True})
+        assert job.worker_id == job_queue.worker_id
+    for _ in range(100):
+        with app.app_context():
+            if db.session.get(Job, job.id).status == 'done':
+                break
+        time.sleep(0.02)
+    with app.app_context():
+        assert db.session.get(Job, job.id).status == 'done'
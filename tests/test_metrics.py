@@ -0,0 +1,29 @@
+import time
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from metrics import db_query_seconds
+from models import db
+
+
+def _background():
+    series = db_query_seconds._values.get(('background',))
+    return (series['count'], series['sum']) if series else (0, 0.0)
+
+
+def test_failed_statements_do_not_skew_later_timings(app):
+    with app.app_context(), db.engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM no_such_table"))
+        time.sleep(0.2)
+        count, total = _background()
+        connection.execute(text("SELECT 1"))
+
+        assert '_query_start' not in connection.info
+        new_count, new_total = _background()
+        # Timed from its own start, not from a failed statement's 0.2s earlier.
+        assert new_count == count + 1
+        assert new_total - total < 0.1
@@ -0,0 +1,36 @@
+import pytest
+
+HISTORY_ROUTES = [
+    '/api/scene/{scene_id}/versions',
+    '/api/scene/{scene_id}/versions/1',
+    '/api/scene/{scene_id}/diff?from=1&to=2',
+]
+
+CURRENT_VERSION_ROUTES = [
+    '/api/scene/{scene_id}/structure',
+    '/api/scene/{scene_id}/stats',
+]
+
+
+@pytest.mark.parametrize('route', HISTORY_ROUTES)
+def test_history_routes_hide_other_users_scenes(client, make_user, make_scene, route):
+    owner_id, owner = make_user()
+    _, stranger = make_user()
+    _, scene_id = make_scene(owner_id, ["First draft.", "Second draft."])
+    url = route.format(scene_id=scene_id)
+
+    assert client.get(url, headers=owner).status_code == 200
+    response = client.get(url, headers=stranger)
+    assert response.status_code == 404
+    assert 'draft' not in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('route', CURRENT_VERSION_ROUTES)
+def test_current_version_routes_hide_other_users_scenes(client, make_user, make_scene, route):
+    owner_id, owner = make_user()
+    _, stranger = make_user()
+    _, scene_id = make_scene(owner_id, ["A private draft."])
+    url = route.format(scene_id=scene_id)
+
+    assert client.get(url, headers=owner).status_code == 200
+    assert client.get(url, headers=stranger).status_code == 404
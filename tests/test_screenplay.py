@@ -0,0 +1,67 @@
+import pytest
+
+import screenplay
+from screenplay import Dialogue, Element, ParseCache, parse, serialize
+
+TOLERATED = [
+    ("", []),
+    (None, []),
+    ("Loose text <action>She waits.</action> more",
+     [("text", "Loose text"), ("action", "She waits."), ("text", "more")]),
+    ("<action>Walks in<heading>INT. DINER - NIGHT</heading>",
+     [("action", "Walks in"), ("heading", "INT. DINER - NIGHT")]),
+    ("</action><action>Sits.</action></dialogue>", [("action", "Sits.")]),
+    ("<action>Never closed", [("action", "Never closed")]),
+    ("<dialogue><character>ANNA</character><parenthesis>quietly</parenthesis>Hello.</dialogue>",
+     [("dialogue", "ANNA", "quietly", "Hello.")]),
+    ("<dialogue><character>ANNA</character><quote>Hi.</quote>"
+     "<dialogue><character>BO</character><quote>Hey.</quote></dialogue>",
+     [("dialogue", "ANNA", "", "Hi."), ("dialogue", "BO", "", "Hey.")]),
+    ("<dialogue><character>ANNA</character><quote>Hi.</quote><action>She leaves.</action>",
+     [("dialogue", "ANNA", "", "Hi."), ("action", "She leaves.")]),
+]
+
+
+def _shape(elements):
+    return [(e.kind, e.character, e.parenthetical, e.text) if e.kind == 'dialogue' else (e.kind, e.text)
+            for e in elements]
+
+
+@pytest.mark.parametrize('formatted, expected', TOLERATED)
+def test_parse_tolerates_malformed_markup(formatted, expected):
+    assert _shape(parse(formatted)) == expected
+
+
+@pytest.mark.parametrize('formatted', [formatted for formatted, _ in TOLERATED] + [
+    "<heading>EXT. HARBOR - DAWN</heading>\n<shot>WIDE</shot>\n<action>The ship leaves.</action>\n"
+    "<dialogue><character>MAYA</character>\n<parenthesis>(to herself)</parenthesis>\n"
+    "<quote>Finally.</quote></dialogue>\n<sub-heading>LATER</sub-heading>",
+])
+def test_serialize_round_trips_through_parse(formatted):
+    elements = parse(formatted)
+    again = parse(serialize(elements))
+    assert _shape(again) == _shape(elements)
+    assert serialize(again) == serialize(elements)
+
+
+def test_serialize_writes_canonical_markup():
+    elements = [Element('heading', 'INT. DINER'), Dialogue('ANNA', '', 'Hi.'), Element('text', 'loose')]
+    assert serialize(elements) == ("<heading>INT. DINER</heading>\n"
+                                   "<dialogue><character>ANNA</character>\n<quote>Hi.</quote></dialogue>\nloose")
+
+
+def test_parse_cache_reparses_text_rewritten_in_place(monkeypatch):
+    class Version:
+        id = 1
+        formatted = "<action>First pass.</action>"
+
+    calls = []
+    real_parse = screenplay.parse
+    monkeypatch.setattr(screenplay, 'parse', lambda text: calls.append(text) or real_parse(text))
+    cache = ParseCache()
+    version = Version()
+
+    assert cache.get(version) is cache.get(version)
+    version.formatted = "<action>Second pass.</action>"
+    assert _shape(cache.get(version)) == [("action", "Second pass.")]
+    assert len(calls) == 2
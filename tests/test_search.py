@@ -0,0 +1,78 @@
+import pytest
+
+from models import db, Scene
+from search import match_terms, search_index
+
+HARBOR = ("<heading>EXT. HARBOR - DAWN</heading><action>The lighthouse keeper waits.</action>"
+          "<dialogue><character>MAYA</character><quote>The lighthouse is dark tonight.</quote></dialogue>"
+          "<dialogue><character>BO</character><quote>Then we sail anyway.</quote></dialogue>")
+
+
+def _formatted(app, scene_id, formatted):
+    with app.app_context():
+        scene = db.session.get(Scene, scene_id)
+        scene.current_version.formatted = formatted
+        db.session.commit()
+
+
+def _search(client, headers, **params):
+    response = client.get('/api/search', query_string=params, headers=headers)
+    assert response.status_code == 200, response.json
+    return response.json['results']
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('lighthouse keeper', '"lighthouse" "keeper"'),
+    ('"dark tonight" sail*', '"dark tonight" "sail"*'),
+    ('NOT OR AND', '"NOT" "OR" "AND"'),
+    ('body:x (a) -b ^c', '"body:x" "(a)" "-b" "^c"'),
+    ('say "hi', '"say" "\"\"hi"'),
+    ('* "" ', ''),
+])
+def test_match_terms_quotes_every_term(query, expected):
+    assert match_terms(query) == expected
+
+
+def test_search_only_returns_the_callers_own_rows(app, client, make_user, make_scene):
+    owner_id, owner = make_user()
+    _, stranger = make_user()
+    make_scene(owner_id, ["The quartermaster counts barrels."], story_title="Quartermaster tales")
+
+    assert {result['kind'] for result in _search(client, owner, q='quartermaster')} == {'story', 'scene'}
+    assert _search(client, stranger, q='quartermaster') == []
+    with app.app_context():
+        assert search_index.search(owner_id + 1000, 'quartermaster') == []
+
+
+def test_search_filters_by_kind_character_and_story(app, client, user, make_scene):
+    user_id, headers = user
+    harbor_story, harbor = make_scene(user_id, ["draft"], title="Harbor", story_title="Lighthouse saga")
+    other_story, other = make_scene(user_id, ["The lighthouse beam sweeps the fields."], title="Fields")
+    _formatted(app, harbor, HARBOR)
+
+    assert {(r['kind'], r['scene_id']) for r in _search(client, headers, q='lighthouse')} == {
+        ('story', None), ('scene', harbor), ('scene', other)}
+    assert [r['scene_id'] for r in _search(client, headers, q='lighthouse', kind='scene', story_id=other_story)] == [other]
+    assert [r['story_id'] for r in _search(client, headers, q='lighthouse', kind='story')] == [harbor_story]
+
+    dialogue = _search(client, headers, q='lighthouse', kind='dialogue')
+    assert [(r['scene_id'], r['character']) for r in dialogue] == [(harbor, 'MAYA')]
+    assert _search(client, headers, q='sail', character='bo')[0]['character'] == 'BO'
+    assert _search(client, headers, q='lighthouse', character='BO') == []
+
+
+def test_search_treats_fts_operators_as_text(app, client, user, make_scene):
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, ["Ships NOT sailing (near) the body: of water*"], title="Operators")
+
+    for query in ['NOT', 'sailing OR', '(near)', 'body:', 'water*', '"unbalanced', 'AND ^ -']:
+        response = client.get('/api/search', query_string={'q': query}, headers=headers)
+        assert response.status_code == 200, query
+    assert [r['scene_id'] for r in _search(client, headers, q='NOT sailing', kind='scene')] == [scene_id]
+    assert _search(client, headers, q='wat*', kind='scene')[0]['scene_id'] == scene_id
+
+
+def test_search_rejects_unknown_kinds(client, user):
+    _, headers = user
+    assert client.get('/api/search', query_string={'q': 'x', 'kind': 'user'}, headers=headers).status_code == 400
+    assert client.get('/api/search', headers=headers).status_code == 400
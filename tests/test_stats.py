@@ -0,0 +1,71 @@
+import stats
+import versions
+from models import db, Scene, SceneVersion, StoryStats, STAT_FIELDS
+
+
+def _totals(story_id):
+    row = db.session.get(StoryStats, story_id)
+    return {name: getattr(row, name) for name in STAT_FIELDS + ('scenes', 'character_lines')}
+
+
+def _write(scene, content, formatted=None):
+    version = SceneVersion(scene_id=scene.id, version_number=versions.next_version_number(scene.id),
+                           title="Scene", content=content, formatted=formatted)
+    db.session.add(version)
+    db.session.flush()
+    scene.current_version_id = version.id
+    db.session.commit()
+    return version
+
+
+def test_compute_counts_words_dialogue_and_page_lines():
+    values = stats.compute("<heading>INT. DINER</heading><action>Rain taps the glass.</action>"
+                           "<dialogue><character>Anna</character><parenthesis>(low)</parenthesis>"
+                           "<quote>We should go.</quote></dialogue>")
+
+    assert values['elements'] == 3
+    assert values['words'] == 9
+    assert values['action_words'] == 4
+    assert (values['dialogue_words'], values['dialogue_lines']) == (3, 1)
+    assert values['page_lines'] == 2 + 2 + 4
+    assert values['character_lines'] == {'ANNA': 1}
+
+
+def test_incremental_story_totals_match_a_rebuild(app, user, make_scene):
+    user_id, _ = user
+    story_id, first_id = make_scene(user_id, ["A first draft of the opening."])
+
+    with app.app_context():
+        first = db.session.get(Scene, first_id)
+        second = Scene(story_id=story_id)
+        db.session.add(second)
+        db.session.flush()
+        _write(second, "Second scene.", "<dialogue><character>MAYA</character><quote>Hello.</quote></dialogue>")
+        third = Scene(story_id=story_id)
+        db.session.add(third)
+        db.session.flush()
+        _write(third, "A scene that gets deleted.", "<action>Gone soon.</action>")
+
+        # An edit, a re-conversion in place, a restore, and a deletion.
+        original = versions.current_version(first)
+        _write(first, "The opening, rewritten.",
+               "<action>The opening, rewritten.</action><dialogue><character>ANNA</character>"
+               "<quote>Again.</quote></dialogue>")
+        versions.current_version(second).formatted = (
+            "<dialogue><character>MAYA</character><quote>Hello there.</quote></dialogue>"
+            "<dialogue><character>BO</character><quote>Hi.</quote></dialogue>")
+        db.session.commit()
+        _write(second, "Another pass.", "<action>Maya waves.</action>")
+        second.current_version_id = SceneVersion.query.filter_by(scene_id=second.id, version_number=1).one().id
+        first.current_version_id = original.id
+        db.session.commit()
+        db.session.delete(third)
+        db.session.commit()
+
+        incremental = _totals(story_id)
+        stats.rebuild(force=True)
+        db.session.expire_all()
+
+        assert incremental == _totals(story_id)
+        assert incremental['scenes'] == 2
+        assert incremental['character_lines'] == {'MAYA': 1, 'BO': 1}
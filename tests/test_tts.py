@@ -0,0 +1,59 @@
+import hashlib
+import os
+
+from tts import SpeechService, OfflineSynthesizer
+
+
+class CountingSynthesizer(OfflineSynthesizer):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text, voice, lang):
+        self.calls += 1
+        return super().__call__(text, voice, lang)
+
+
+def test_synthesize_misses_once_then_hits_the_cache(tmp_path):
+    synthesizer = CountingSynthesizer()
+    service = SpeechService(directory=str(tmp_path), synthesizer=synthesizer, chunk_chars=20, secret='s')
+    key = service.audio_key(7, 'com', 'en')
+    text = "First sentence here. Second sentence here. Third one."
+
+    assert not service.is_cached(key)
+    path = service.synthesize(key, text, 'com', 'en')
+    calls = synthesizer.calls
+    assert calls == 3
+    assert os.path.getsize(path) == len(OfflineSynthesizer.FRAME) * sum(len(chunk) for chunk in
+                                                                       ["First sentence here.", "Second sentence here.", "Third one."])
+
+    assert service.is_cached(key)
+    assert service.synthesize(key, text, 'com', 'en') == path
+    assert synthesizer.calls == calls
+    assert not os.path.exists(service.partial_path(key))
+
+
+def test_audio_keys_depend_on_the_secret(tmp_path):
+    one = SpeechService(directory=str(tmp_path), synthesizer=OfflineSynthesizer(), secret='one')
+    two = SpeechService(directory=str(tmp_path), synthesizer=OfflineSynthesizer(), secret='two')
+
+    key = one.audio_key(1, 'com', 'en')
+    assert key == one.audio_key(1, 'com', 'en')
+    assert key != two.audio_key(1, 'com', 'en')
+    assert key != one.audio_key(2, 'com', 'en')
+    assert key != hashlib.sha256(b"1|com|en|offline").hexdigest()[:40]
+
+
+def test_scene_to_voice_rejects_unknown_voice_and_lang(client, user, make_scene):
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, ["Some text."])
+
+    bad_voice = client.post(f'/api/scene_to_voice/{scene_id}', json={'voice': 'attacker.example'}, headers=headers)
+    bad_lang = client.post(f'/api/scene_to_voice/{scene_id}', json={'lang': 'xx-nope'}, headers=headers)
+
+    assert bad_voice.status_code == 400
+    assert bad_lang.status_code == 400
+
+
+def test_get_audio_rejects_malformed_keys(client):
+    assert client.get('/api/audio/not-a-key.mp3').status_code == 404
+    assert client.get(f"/api/audio/{'0' * 40}.mp3").status_code == 404
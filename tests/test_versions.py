@@ -0,0 +1,130 @@
+import pytest
+
+import deltas
+import versions
+from models import db, Scene, SceneVersion
+
+
+def _content(n):
+    lines = [f"Line {i}: the detective crosses the wet street toward the diner." for i in range(30)]
+    lines[n % 30] = f"Line {n % 30}: rewritten in draft {n}."
+    return "\n".join(lines + [f"Note added in draft {n}."]) + "\n"
+
+
+def _formatted(n, conversion=0):
+    return "".join(f"<action>Beat {i} of draft {n if i == n % 12 else 0}, pass {conversion}.</action>\n"
+                   for i in range(12))
+
+
+def _write(scene_id, content, formatted):
+    scene = db.session.get(Scene, scene_id)
+    version = SceneVersion(scene_id=scene_id, version_number=versions.next_version_number(scene_id),
+                           title="Scene", content=content, formatted=formatted)
+    db.session.add(version)
+    db.session.flush()
+    scene.current_version_id = version.id
+    db.session.commit()
+    return version.version_number
+
+
+def _check_all(app, client, headers, scene_id, expected):
+    with app.app_context():
+        deltas.reconstruction_cache.clear()
+        for number, (content, formatted) in expected.items():
+            version = versions.find_version(scene_id, number)
+            assert (version.content, version.formatted) == (content, formatted), number
+    deltas.reconstruction_cache.clear()
+    for number, (content, formatted) in expected.items():
+        body = client.get(f'/api/scene/{scene_id}/versions/{number}', headers=headers).json
+        assert (body["content"], body["formatted"]) == (content, formatted), number
+
+
+def test_delta_round_trip():
+    cases = [
+        (("a\nb\nc\n", "<action>x</action>"), ("a\nB\nc\nd", None)),
+        (("", None), ("first line\n", "<action>y</action>\n")),
+        (("same\n", "same"), ("same\n", "same")),
+        (("no newline at end", "x\r\ny\r\n"), ("no newline at end\nmore", "x\r\nz\r\n")),
+    ]
+    for base, texts in cases:
+        assert deltas.apply_delta(base, deltas.make_delta(base, texts)) == texts
+
+
+def test_delta_encoding_with_and_without_compression(monkeypatch):
+    payload = {"content": [[0, 3], ["new\n"]], "formatted": None}
+    assert deltas.encode(payload)[:1] == b'z'
+    assert deltas.decode(deltas.encode(payload)) == payload
+    monkeypatch.setattr(deltas, 'COMPRESS', False)
+    assert deltas.encode(payload)[:1] == b'j'
+    assert deltas.decode(deltas.encode(payload)) == payload
+
+
+def test_history_survives_deltas_reconversions_edits_and_restores(app, client, user, make_scene):
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, [_content(1)])
+    expected = {1: (_content(1), None)}
+
+    with app.app_context():
+        for n in range(2, 41):
+            number = _write(scene_id, _content(n), _formatted(n))
+            expected[number] = (_content(n), _formatted(n))
+            if n % 5 == 0:
+                # Re-conversion rewrites the current version in place.
+                current = versions.current_version(db.session.get(Scene, scene_id))
+                current.formatted = _formatted(n, conversion=1)
+                db.session.commit()
+                expected[number] = (_content(n), _formatted(n, conversion=1))
+
+        rows = SceneVersion.query.filter_by(scene_id=scene_id).order_by(SceneVersion.version_number).all()
+        stored = {row.version_number: (row.delta is not None, row.depth, row.parent_id) for row in rows}
+        current_id = db.session.get(Scene, scene_id).current_version_id
+
+    assert sum(is_delta for is_delta, _, _ in stored.values()) > 30
+    assert max(depth for _, depth, _ in stored.values()) == versions.SNAPSHOT_INTERVAL - 1
+    # Snapshots: full versions in the middle of the chain, every SNAPSHOT_INTERVAL versions.
+    snapshots = [number for number, (is_delta, _, parent) in stored.items() if not is_delta and parent and number != 40]
+    assert snapshots and all(stored[number + 1][1] == 1 for number in snapshots)
+    assert not stored[40][0]
+    _check_all(app, client, headers, scene_id, expected)
+
+    # Editing a superseded version in place inflates the versions diffed against it first.
+    with app.app_context():
+        old = versions.find_version(scene_id, 10)
+        assert old.delta is not None and old.children
+        old.content = "Rewritten by hand.\n"
+        db.session.commit()
+        expected[10] = ("Rewritten by hand.\n", expected[10][1])
+    _check_all(app, client, headers, scene_id, expected)
+
+    # Restoring an old version makes it full again and compacts the one it replaces.
+    with app.app_context():
+        scene = db.session.get(Scene, scene_id)
+        restored = versions.find_version(scene_id, 7)
+        assert restored.delta is not None
+        scene.current_version_id = restored.id
+        db.session.commit()
+        assert versions.find_version(scene_id, 7).delta is None
+        assert db.session.get(SceneVersion, current_id).delta is not None
+    _check_all(app, client, headers, scene_id, expected)
+
+
+@pytest.mark.parametrize('interval', [1, 4])
+def test_snapshot_interval(app, user, make_scene, monkeypatch, interval):
+    monkeypatch.setattr(versions, 'SNAPSHOT_INTERVAL', interval)
+    user_id, _ = user
+    _, scene_id = make_scene(user_id, [_content(n) for n in range(1, 12)])
+    with app.app_context():
+        depths = [row.depth for row in SceneVersion.query.filter_by(scene_id=scene_id).order_by(SceneVersion.id)]
+        deltas.reconstruction_cache.clear()
+        assert [versions.find_version(scene_id, n).content for n in range(1, 12)] == [_content(n) for n in range(1, 12)]
+    assert max(depths) == interval - 1
+
+
+def test_diff_requires_from(client, user, make_scene):
+    user_id, headers = user
+    _, scene_id = make_scene(user_id, ["First draft.", "Second draft."])
+
+    response = client.get(f'/api/scene/{scene_id}/diff?to=2', headers=headers)
+    assert response.status_code == 400
+    assert response.json == {'error': 'from is required'}
+    assert client.get(f'/api/scene/{scene_id}/diff?from=1', headers=headers).status_code == 200
@@ -0,0 +1,185 @@
+import hashlib
+import hmac
+import io
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gtts import gTTS
+from gtts.lang import tts_langs
+
+from ai import clean_screenplay_text
+from chunking import SENTENCE_RE, chunk_screenplay, map_chunks
+
+AUDIO_DIR = 'static/generated_audios'
+TTS_CHUNK_CHARS = int(os.environ.get('TTS_CHUNK_CHARS', 400))
+TTS_WORKERS = int(os.environ.get('TTS_WORKERS', 4))
+NARRATION_CHUNK_TOKENS = int(os.environ.get('NARRATION_CHUNK_TOKENS', 1500))
+# gTTS accents by Google Translate domain. Only these are passed on, so a caller can't
+# point gTTS at a host of their choosing.
+VOICES = ('com', 'com.au', 'co.uk', 'us', 'ca', 'co.in', 'ie', 'co.za', 'com.ng', 'com.br', 'pt', 'com.mx', 'es', 'fr')
+LANGUAGES = frozenset(tts_langs())
+
+
+class GTTSSynthesizer:
+    name = 'gtts'
+
+    def __call__(self, text, voice, lang):
+        # gTTS voices are regional accents selected by the Google Translate domain.
+        buffer = io.BytesIO()
+        gTTS(text, lang=lang, tld=voice).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class OfflineSynthesizer:
+    # Stand-in for tests and offline development: one silent MPEG-1 Layer III frame
+    # (128 kbps, 44.1 kHz, ~26 ms) per character, so output length tracks the text.
+    name = 'offline'
+    FRAME = b'\xff\xfb\x90\x04' + b'\x00' * 413
+
+    def __call__(self, text, voice, lang):
+        return self.FRAME * len(text)
+
+
+SYNTHESIZERS = {
+    'gtts': GTTSSynthesizer,
+    'offline': OfflineSynthesizer,
+}
+
+
+def split_sentences(text, limit=TTS_CHUNK_CHARS):
+    # Packs whole sentences into chunks of at most limit characters; a longer sentence
+    # is split on whitespace.
+    chunks = []
+    current = ''
+    for sentence in SENTENCE_RE.split(' '.join((text or '').split())):
+        while len(sentence) > limit:
+            cut = sentence.rfind(' ', 0, limit)
+            cut = cut if cut > 0 else limit
+            chunks.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if current and len(current) + len(sentence) + 1 > limit:
+            chunks.append(current)
+            current = ''
+        current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+    return [chunk for chunk in chunks if chunk]
+
+
+def narrate(screenplay, api_key):
+    # The narration pass used to be capped at 100 tokens, which cut long scenes short.
+    chunks = chunk_screenplay(screenplay, NARRATION_CHUNK_TOKENS)
+    parts = map_chunks(lambda chunk: clean_screenplay_text(chunk, api_key, max_tokens=NARRATION_CHUNK_TOKENS * 2), chunks, TTS_WORKERS)
+    if any(part is None for part in parts):
+        raise ValueError("clean_screenplay_text returned no result")
+    return "\n".join(part.strip() for part in parts)
+
+
+class SpeechService:
+    # Audio is cached on disk as <key>.mp3 where the key is an HMAC of (scene version,
+    # voice, language, synthesizer), so keys can't be guessed from version ids. While a file is being written it lives at <key>.mp3.part
+    # and grows in playback order, so it can be streamed before synthesis finishes.
+
+    def __init__(self, directory=AUDIO_DIR, synthesizer=None, workers=TTS_WORKERS, chunk_chars=TTS_CHUNK_CHARS,
+                 secret=None):
+        self.directory = directory
+        # Without a configured secret, keys (and so cached files) only last for this process.
+        self.secret = secret or secrets.token_hex(32)
+        self.synthesizer = synthesizer or SYNTHESIZERS[os.environ.get('TTS_SYNTHESIZER', 'gtts')]()
+        self.workers = workers
+        self.chunk_chars = chunk_chars
+        self._lock = threading.Lock()
+        self._in_progress = {}
+
+    def configure(self, synthesizer=None, **settings):
+        if synthesizer is not None:
+            self.synthesizer = synthesizer
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def audio_key(self, version_id, voice, lang):
+        payload = f"{version_id}|{voice}|{lang}|{self.synthesizer.name}"
+        return hmac.new(self.secret.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()[:40]
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def partial_path(self, key):
+        return self.path(key) + '.part'
+
+    def is_cached(self, key):
+        return os.path.exists(self.path(key))
+
+    def synthesize(self, key, text, voice, lang):
+        # Concurrent requests for the same key wait for the first one instead of
+        # synthesizing the same audio twice.
+        with self._lock:
+            event = self._in_progress.get(key)
+            owner = event is None
+            if owner:
+                event = self._in_progress[key] = threading.Event()
+        if not owner:
+            event.wait()
+            if not self.is_cached(key):
+                raise ValueError("Speech synthesis failed")
+            return self.path(key)
+        try:
+            if not self.is_cached(key):
+                self._write(key, text, voice, lang)
+            return self.path(key)
+        finally:
+            with self._lock:
+                del self._in_progress[key]
+            event.set()
+
+    def _write(self, key, text, voice, lang):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        chunks = split_sentences(text, self.chunk_chars)
+        if not chunks:
+            raise ValueError("Nothing to synthesize")
+        partial = self.partial_path(key)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(chunks)))) as pool, \
+                    open(partial, 'wb') as f:
+                futures = [pool.submit(self.synthesizer, chunk, voice, lang) for chunk in chunks]
+                # MP3 frames concatenate cleanly; writing in order lets readers tail the file.
+                for future in futures:
+                    f.write(future.result())
+                    f.flush()
+            os.replace(partial, self.path(key))
+        except Exception:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+
+    def follow(self, key, chunk_size=64 * 1024, timeout=300):
+        # Yields the bytes of an audio file that is still being written until it is
+        # complete. Stops early if the writer gives up and removes the partial file.
+        path, partial = self.path(key), self.partial_path(key)
+        deadline = time.time() + timeout
+        try:
+            f = open(partial, 'rb')
+        except FileNotFoundError:
+            f = open(path, 'rb')
+        with f:
+            while True:
+                data = f.read(chunk_size)
+                if data:
+                    yield data
+                    continue
+                if os.path.exists(path):
+                    # Renamed into place; drain whatever was written after the last read.
+                    data = f.read()
+                    if data:
+                        yield data
+                    return
+                if not os.path.exists(partial) or time.time() > deadline:
+                    return
+                time.sleep(0.1)
+
+
+speech = SpeechService()
@@ -0,0 +1,147 @@
+import os
+from difflib import SequenceMatcher
+from itertools import chain
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import undefer_group
+
+from models import db, Scene, SceneVersion
+from deltas import make_delta
+from screenplay import parse_cache, element_key
+
+# Longest run of deltas before a version is kept as a full snapshot. 1 keeps every
+# version in full.
+SNAPSHOT_INTERVAL = int(os.environ.get('VERSION_SNAPSHOT_INTERVAL', 16))
+
+
+def next_version_number(scene_id):
+    # Numbers count per scene; version ids are global row ids.
+    latest = (db.session.query(func.max(SceneVersion.version_number))
+              .filter(SceneVersion.scene_id == scene_id)
+              .scalar())
+    return (latest or 0) + 1
+
+
+def current_version(scene):
+    return db.session.get(SceneVersion, scene.current_version_id, options=[undefer_group('body')])
+
+
+def find_version(scene_id, version_number):
+    return (SceneVersion.query
+            .options(undefer_group('body'))
+            .filter_by(scene_id=scene_id, version_number=version_number)
+            .first())
+
+
+def diff(old, new, key=None, render=None):
+    # Hunks in the order of difflib opcodes. Unchanged runs only carry their position
+    # and length, so diffs of long scenes stay small.
+    key = key or (lambda item: item)
+    render = render or (lambda item: item)
+    matcher = SequenceMatcher(None, [key(item) for item in old], [key(item) for item in new], autojunk=False)
+    hunks = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        hunk = {"op": tag, "old_start": i1, "new_start": j1}
+        if tag == 'equal':
+            hunk["count"] = i2 - i1
+        else:
+            hunk["old"] = [render(item) for item in old[i1:i2]]
+            hunk["new"] = [render(item) for item in new[j1:j2]]
+        hunks.append(hunk)
+    return hunks
+
+
+def diff_versions(old, new, mode='elements'):
+    if mode == 'lines':
+        hunks = diff((old.formatted or old.content or '').splitlines(), (new.formatted or new.content or '').splitlines())
+    else:
+        hunks = diff(parse_cache.get(old), parse_cache.get(new), key=element_key, render=lambda element: element.to_dict())
+    return {
+        "mode": mode,
+        "hunks": hunks,
+        "removed": sum(len(hunk.get("old", ())) for hunk in hunks),
+        "added": sum(len(hunk.get("new", ())) for hunk in hunks),
+    }
+
+
+def changed(obj, *names):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def rewritten_scenes(session):
+    # Scenes whose current text changed in this flush: the current version moved or was
+    # edited in place. Compacting older versions does not count. For flush hooks that
+    # keep derived indexes (search, embeddings) in step with the current version.
+    moved, edited = set(), {}
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Scene) and changed(obj, 'current_version_id'):
+            moved.add(obj.id)
+        elif isinstance(obj, SceneVersion) and obj in session.dirty and changed(obj, '_content', '_formatted', 'title'):
+            edited.setdefault(obj.scene_id, set()).add(obj.id)
+    scenes = []
+    with session.no_autoflush:
+        for scene_id in moved | set(edited):
+            scene = session.get(Scene, scene_id)
+            if scene is None or scene in session.deleted:
+                continue
+            if scene_id not in moved and scene.current_version_id not in edited[scene_id]:
+                continue
+            scenes.append(scene)
+    return scenes
+
+
+def compact(version, interval=None):
+    # Stores a superseded version as a delta against its parent. A version stays full
+    # when its chain would reach the snapshot interval, when the delta would not be
+    # smaller than the text, or when it has in-place edits waiting in this flush.
+    interval = interval or SNAPSHOT_INTERVAL
+    if version is None or version.delta is not None or version.parent is None:
+        return False
+    state = inspect(version)
+    if state.attrs._content.history.has_changes() or state.attrs._formatted.history.has_changes():
+        return False
+    depth = version.parent.depth + 1
+    if depth >= interval:
+        return False
+    texts = version.texts()
+    delta = make_delta(version.parent.texts(), texts)
+    if len(delta) >= len(texts[0] or '') + len(texts[1] or ''):
+        return False
+    version.delta = delta
+    version._content = ''
+    version._formatted = None
+    # Per-paragraph conversion blocks only matter for the current version.
+    version.blocks = None
+    version.depth = depth
+    return True
+
+
+def _before_flush(session, flush_context, instances):
+    # A new version's parent is the scene's current version at the time it is written.
+    # When a scene's current version moves, the one it replaced is compacted and the
+    # new one is made full, so the current version can always be read without deltas.
+    with session.no_autoflush:
+        for obj in list(session.new):
+            if isinstance(obj, SceneVersion) and obj.parent_id is None and obj.parent is None and obj.scene_id is not None:
+                scene = session.get(Scene, obj.scene_id)
+                if scene is not None and scene.current_version_id:
+                    obj.parent_id = scene.current_version_id
+
+        for obj in list(session.dirty):
+            if not isinstance(obj, Scene):
+                continue
+            history = inspect(obj).attrs.current_version_id.history
+            if not history.has_changes():
+                continue
+            if obj.current_version_id:
+                current = session.get(SceneVersion, obj.current_version_id)
+                if current is not None:
+                    current.inflate()
+            for old_id in history.deleted:
+                if old_id and old_id != obj.current_version_id:
+                    compact(session.get(SceneVersion, old_id))
+
+
+def init_app(app):
+    event.listen(db.session, 'before_flush', _before_flush)